@@ -0,0 +1,332 @@
+# This is a stand-in for the PyXspec module, used by nicer_benchmark.py to measure the cost of the NICER scripts themselves (interpreter,
+# file I/O, text parsing, registry and worker handling) on machines without HEASoft. It implements the parts of the PyXspec interface used by
+# nicer_fit.py and nicer_flux.py. Fits are deterministic: the fit statistic and parameter values only depend on the model expression and the
+# name of the loaded spectrum, so the same campaign always takes the same path through the model pipeline.
+# The time that the real Xspec would spend on each call can be simulated with the 'latencies' dictionary (in seconds).
+# Authors: Batuhan Bahçeci
+# Contact: batuhan.bahceci@sabanciuniv.edu
+
+import os
+import re
+import math
+import time
+import zlib
+
+__all__ = ["AllModels", "AllData", "Fit", "Xset", "Plot", "Model", "Spectrum"]
+
+latencies = {"perform": 0.0, "error": 0.0, "eqwidth": 0.0, "spectrum": 0.0, "save": 0.0, "restore": 0.0}
+
+# Parameters of the model components, as (name, unit, default values). Values are (value, delta, min, bottom, top, max) like in Xspec.
+# Unknown components get a single normalization.
+componentParameters = {
+    "TBabs": [("nH", "10^22", (1.0, 0.001, 0.0, 0.0, 1e5, 1e6))],
+    "pcfabs": [("nH", "10^22", (1.0, 0.001, 0.0, 0.0, 1e5, 1e6)), ("CvrFract", "", (0.5, 0.01, 0.05, 0.05, 0.95, 0.95))],
+    "diskbb": [("Tin", "keV", (1.0, 0.01, 0.0, 0.0, 1000.0, 1000.0)), ("norm", "", (1.0, 0.01, 0.0, 0.0, 1e24, 1e24))],
+    "powerlaw": [("PhoIndex", "", (1.0, 0.01, -3.0, -2.0, 9.0, 10.0)), ("norm", "", (1.0, 0.01, 0.0, 0.0, 1e24, 1e24))],
+    "gaussian": [("LineE", "keV", (6.5, 0.05, 0.0, 0.0, 1e6, 1e6)), ("Sigma", "keV", (0.1, 0.05, 0.0, 0.0, 10.0, 20.0)),
+                 ("norm", "", (1.0, 0.01, 0.0, 0.0, 1e24, 1e24))],
+    "edge": [("edgeE", "keV", (7.0, 0.07, 0.0, 0.0, 100.0, 100.0)), ("MaxTau", "", (1.0, 0.01, 0.0, 0.0, 5.0, 10.0))],
+    "bbodyrad": [("kT", "keV", (3.0, 0.01, 1e-4, 0.01, 100.0, 200.0)), ("norm", "", (1.0, 0.01, 0.0, 0.0, 1e24, 1e24))],
+    "simpl": [("Gamma", "", (2.3, 0.01, 1.1, 1.1, 4.0, 4.0)), ("FracSctr", "", (0.05, 0.01, 0.0, 0.0, 0.4, 1.0)),
+              ("UpScOnly", "", (1.0, -0.01, 0.0, 0.0, 100.0, 100.0))],
+    "cflux": [("Emin", "keV", (0.5, -0.01, 0.0, 0.0, 1e6, 1e6)), ("Emax", "keV", (10.0, -0.01, 0.0, 0.0, 1e6, 1e6)),
+              ("lg10Flux", "cgs", (-12.0, 0.01, -100.0, -100.0, 100.0, 100.0))]
+}
+
+def delay(name, factor=1.0):
+    if latencies.get(name, 0) > 0:
+        time.sleep(latencies[name] * factor)
+
+def numbersOf(text):
+    return [float(element) for element in text.replace(",", " ").split()]
+
+class Parameter:
+    def __init__(self, index, name, unit, values):
+        self.index = index
+        self.name = name
+        self.unit = unit
+        self.link = ""
+        self.error = (0.0, 0.0, "FFFFFFFFF")
+        self._values = list(values)
+
+    @property
+    def values(self):
+        return list(self._values)
+
+    @values.setter
+    def values(self, newValues):
+        # Accepts a number, a list of numbers, or an Xspec string such as "1.7 -1" or ",,0.1,0.1,2.5,2.5" (empty fields are left unchanged)
+        if isinstance(newValues, str):
+            elements = newValues.split(",") if "," in newValues else newValues.split()
+        elif isinstance(newValues, (list, tuple)):
+            elements = list(newValues)
+        else:
+            elements = [newValues]
+
+        for i, element in enumerate(elements[:6]):
+            if isinstance(element, str) and element.strip() == "":
+                continue
+            self._values[i] = float(element)
+
+    @property
+    def frozen(self):
+        return self._values[1] < 0
+
+    @frozen.setter
+    def frozen(self, isFrozen):
+        if isFrozen != self.frozen:
+            self._values[1] = -self._values[1] if self._values[1] != 0 else (-0.01 if isFrozen else 0.01)
+
+class Component:
+    def __init__(self, name, parameters):
+        self.name = name
+        self.parameterNames = [parameter.name for parameter in parameters]
+        for parameter in parameters:
+            setattr(self, parameter.name, parameter)
+
+class Model:
+    def __init__(self, expression, modName="", sourceNum=1, setPars=None):
+        self.expression = expression
+        self.name = modName
+        self.componentNames = []
+        self._parameters = []
+
+        # Duplicated components are named as <component>_<component number>, like in Xspec
+        names = re.findall(r"[A-Za-z][A-Za-z0-9_]*", expression)
+        for number, name in enumerate(names, start=1):
+            parameters = []
+            for parName, unit, values in componentParameters.get(name, [("norm", "", (1.0, 0.01, 0.0, 0.0, 1e24, 1e24))]):
+                parameters.append(Parameter(len(self._parameters) + len(parameters) + 1, parName, unit, values))
+
+            componentName = name if name not in self.componentNames else name + "_" + str(number)
+            self.componentNames.append(componentName)
+            self._parameters.extend(parameters)
+            setattr(self, componentName, Component(componentName, parameters))
+
+        self.nParameters = len(self._parameters)
+        self.fitted = False
+        AllModels.models[sourceNum] = self
+
+        if setPars is not None:
+            for index, values in setPars.items():
+                self(index).values = values
+
+    def __call__(self, index):
+        return self._parameters[index - 1]
+
+    def show(self):
+        pass
+
+class ModelManager:
+    def __init__(self):
+        self.models = {}
+
+    def __call__(self, number):
+        return self.models[number]
+
+    def clear(self):
+        self.models = {}
+
+    def eqwidth(self, component, rangeCompon=None, err=False, number=100, level=90.0):
+        delay("eqwidth", number / 1000)
+        norm = self(1)(sum(len(getattr(self(1), name).parameterNames) for name in self(1).componentNames[:component])).values[0]
+        width = abs(norm) * 0.1
+        AllData(1).eqwidth = [width, width * 0.9, width * 1.1]
+
+class Spectrum:
+    def __init__(self, dataFile, backFile="", respFile="", arfFile=""):
+        delay("spectrum")
+        self.fileName = dataFile
+        self.background = backFile
+        self.response = respFile
+        self.arf = arfFile
+        self.ignored = []
+        self.eqwidth = []
+        self.noticedChannels = 300
+        self.seed = zlib.crc32(os.path.basename(dataFile).encode()) / 2**32
+        AllData.spectra = [self]
+
+    def ignore(self, channels):
+        self.ignored.append(channels)
+        self.noticedChannels = 250
+
+    def notice(self, channels):
+        pass
+
+class DataManager:
+    def __init__(self):
+        self.spectra = []
+
+    def __call__(self, number):
+        return self.spectra[number - 1]
+
+    @property
+    def nSpectra(self):
+        return len(self.spectra)
+
+    def clear(self):
+        self.spectra = []
+
+    def ignore(self, channels):
+        for spectrum in self.spectra:
+            spectrum.ignore(channels)
+
+    def notice(self, channels):
+        pass
+
+class FitManager:
+    def __init__(self):
+        self.query = "yes"
+        self.nIterations = 10
+        self.delta = 0.01
+        self.method = "leven"
+        self.statMethod = "chi"
+
+    def currentState(self):
+        model = AllModels.models.get(1)
+        spectrum = AllData.spectra[0] if AllData.spectra != [] else None
+        return model, spectrum
+
+    @property
+    def dof(self):
+        model, spectrum = self.currentState()
+        if model is None or spectrum is None:
+            return 1
+        return spectrum.noticedChannels - len([parameter for parameter in model._parameters if parameter.frozen == False])
+
+    @property
+    def statistic(self):
+        # Every component improves the fit a little, and unfitted models are worse than fitted ones
+        model, spectrum = self.currentState()
+        if model is None or spectrum is None:
+            return 0.0
+
+        statistic = self.dof * (1 + 2.0 / len(model.componentNames)) * (1 + 0.2 * spectrum.seed)
+        if model.fitted == False:
+            statistic *= 1.5
+        return statistic
+
+    @property
+    def nullhyp(self):
+        return math.exp(-self.statistic / max(self.dof, 1))
+
+    def renorm(self):
+        pass
+
+    def perform(self):
+        model, spectrum = self.currentState()
+        delay("perform", max(1, len(model.componentNames)) if model is not None else 1)
+        if model is None or spectrum is None:
+            return
+
+        # Free parameters are moved by a small deterministic amount, within their limits
+        for parameter in model._parameters:
+            if parameter.frozen == False and parameter.link == "":
+                values = parameter.values
+                values[0] = min(max(values[0] * (1 + 0.02 * (spectrum.seed - 0.5)), values[2]), values[5])
+                parameter.values = values
+        model.fitted = True
+
+    def error(self, command):
+        # The indices are the last element of the command, e.g. "stopat 10 0.1 maximum 1000 2.706 3" or "maximum 1000 1-4"
+        model = AllModels(1)
+        last = command.split()[-1]
+        indices = []
+        for element in last.split(","):
+            if "-" in element:
+                start, end = element.split("-")
+                indices.extend(range(int(start), int(end) + 1))
+            else:
+                indices.append(int(element))
+
+        for index in indices:
+            delay("error")
+            value = model(index).values[0]
+            width = 0.05 * abs(value) + 1e-3
+            model(index).error = (value - width, value + width, "FFFFFFFFF")
+
+    def ftest(self, chisq2, dof2, chisq1, dof1):
+        if dof1 <= dof2 or chisq2 <= 0:
+            return 1.0
+        fValue = ((chisq1 - chisq2) / (dof1 - dof2)) / (chisq2 / dof2)
+        return math.exp(-max(fValue, 0) / 2)
+
+class SettingsManager:
+    def __init__(self):
+        self.chatter = 10
+        self.logChatter = 10
+        self.abund = "angr"
+        self.xsect = "vern"
+        self.log = None
+
+    def openLog(self, fileName):
+        self.closeLog()
+        self.log = open(fileName, "w")
+        self.log.write("Fake Xspec log\n")
+
+    def closeLog(self):
+        if self.log is not None:
+            self.log.close()
+            self.log = None
+
+    def save(self, fileName, info="a"):
+        # Writes an xcm file holding the data ("a" or "f") and the model ("a" or "m")
+        delay("save")
+        lines = ["abund " + self.abund + "\n"]
+        if info in ["a", "f"] and AllData.spectra != []:
+            spectrum = AllData(1)
+            lines.append(f"data 1:1 {spectrum.fileName}\nresponse 1:1 {spectrum.response}\narf 1 {spectrum.arf}\nbackgrnd 1 {spectrum.background}\n")
+            for channels in spectrum.ignored:
+                lines.append("ignore " + channels + "\n")
+        if info in ["a", "m"] and 1 in AllModels.models:
+            model = AllModels(1)
+            lines.append("model  " + model.expression + "\n")
+            for i in range(1, model.nParameters + 1):
+                lines.append("   " + " ".join([str(value) for value in model(i).values]) + "\n")
+
+        with open(fileName, "w") as file:
+            file.writelines(lines)
+
+    def restore(self, fileName):
+        delay("restore")
+        with open(fileName, "r") as file:
+            lines = file.readlines()
+
+        files = {}
+        ignored = []
+        expression = ""
+        parameterValues = []
+        for line in lines:
+            elements = line.split()
+            if elements == []:
+                continue
+            if elements[0] in ["data", "response", "arf", "backgrnd"] and len(elements) > 2:
+                files[elements[0]] = elements[2]
+            elif elements[0] == "ignore":
+                ignored.append(" ".join(elements[1:]))
+            elif elements[0] == "model":
+                expression = line[line.find("model") + 5:].strip()
+            elif expression != "":
+                parameterValues.append(numbersOf(line))
+
+        if "data" in files:
+            Spectrum(files["data"], files.get("backgrnd", ""), files.get("response", ""), files.get("arf", ""))
+            for channels in ignored:
+                AllData.ignore(channels)
+
+        if expression != "":
+            model = Model(expression)
+            for i, values in enumerate(parameterValues[:model.nParameters], start=1):
+                model(i).values = values
+            model.fitted = True
+
+class PlotManager:
+    def __init__(self):
+        self.xAxis = "channel"
+        self.device = "/null"
+
+AllModels = ModelManager()
+AllData = DataManager()
+Fit = FitManager()
+Xset = SettingsManager()
+Plot = PlotManager()
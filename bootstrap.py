@@ -0,0 +1,152 @@
+# This is a helper module for the steps shared by all NICER scripts: finding the script directory, checking the variables of parameter.py,
+# reading the observations and running the scripts. When nicer_main.py runs the scripts in its own process, the checked variables and the
+# observation lists are kept here and handed over to the next scripts instead of being checked and read again.
+# Authors: Batuhan Bahçeci
+# Contact: batuhan.bahceci@sabanciuniv.edu
+
+import os
+import sys
+import runpy
+import traceback
+from registry import openRegistry, lookupObservations
+
+# Variables of parameter.py that have already been checked (or entered by the user) in this process, with their checked values
+validatedValues = {}
+
+# Observation lists that have already been read in this process
+observationCache = {}
+
+def scriptDirectory(scriptFile):
+    return os.path.dirname(os.path.abspath(scriptFile))
+
+def checkBoolean(name, value):
+    # Returns 'value' if it is a boolean, otherwise asks the user for a boolean value
+    if name in validatedValues:
+        return validatedValues[name]
+
+    while isinstance(value, bool) == False:
+        print(f"\nThe '{name}' variable is not of type boolean.")
+        value = input(f"Please enter a boolean value for '{name}' (True/False): ")
+
+        if value == "True" or value == "False":
+            value = (value == "True")
+
+    validatedValues[name] = value
+    return value
+
+def checkWorkerCount(name, value, prompt):
+    # Returns 'value' as an integer if it is a non-negative integer, otherwise asks the user for one. 0 means "use all available cores".
+    if name in validatedValues:
+        return validatedValues[name]
+
+    while str(value).isnumeric() == False:
+        print(f"\nThe '{name}' variable must be a non-negative integer.")
+        value = input(prompt + " (0 uses all available cores): ")
+
+    validatedValues[name] = int(value)
+    return validatedValues[name]
+
+def checkPositiveInteger(name, value):
+    if name in validatedValues:
+        return validatedValues[name]
+
+    while str(value).isnumeric() == False or int(value) <= 0:
+        print(f"\nEither the '{name}' variable is not of type integer, or it is smaller or equal to 0.")
+        value = input(f"Please enter a positive integer value for '{name}' (x > 0): ")
+
+    validatedValues[name] = int(value)
+    return validatedValues[name]
+
+def checkFloatBetween(name, value, lowerLimit, upperLimit):
+    # Returns 'value' as a float if lowerLimit < value < upperLimit, otherwise asks the user for one
+    if name in validatedValues:
+        return validatedValues[name]
+
+    while True:
+        try:
+            value = float(value)
+            if lowerLimit < value < upperLimit:
+                break
+        except:
+            pass
+
+        print(f"\nThe '{name}' variable must be a float number between {lowerLimit} and {upperLimit}.")
+        value = input(f"Please enter a float number between {lowerLimit} and {upperLimit} for '{name}' ({lowerLimit} < x < {upperLimit}): ")
+
+    validatedValues[name] = value
+    return value
+
+def obsidOfPath(path):
+    # e.g. /home/user/NICER/6130010120/ -> 6130010120
+    return os.path.basename(os.path.normpath(path))
+
+def readObservationPaths(inputTxtPath):
+    # Returns the paths in observations.txt that point to existing directories. The file is only read again if it has changed.
+    modificationTime = os.stat(inputTxtPath).st_mtime_ns
+    cacheKey = ("paths", inputTxtPath)
+    if cacheKey in observationCache and observationCache[cacheKey][0] == modificationTime:
+        return list(observationCache[cacheKey][1])
+
+    validPaths = []
+    with open(inputTxtPath, "r") as file:
+        for line in file.readlines():
+            line = line.replace(" ", "")
+            line = line.strip("\n")
+            if line != "" and os.path.exists(line):
+                validPaths.append(line)
+
+    observationCache[cacheKey] = (modificationTime, validPaths)
+    return list(validPaths)
+
+def readSearchedObsids(inputTxtPath):
+    # Returns the obsids of the valid observation paths in observations.txt
+    return [obsidOfPath(path) for path in readObservationPaths(inputTxtPath)]
+
+def selectObsids(obsids, arguments):
+    # Keeps only the obsids given with '--obsid 6130010120,6130010121' among the arguments, in their original order. nicer_main.py uses it to
+    # run a script for a single observation. All obsids are kept if '--obsid' is not given.
+    if "--obsid" not in arguments or arguments.index("--obsid") + 1 >= len(arguments):
+        return obsids
+
+    selectedObsids = arguments[arguments.index("--obsid") + 1].split(",")
+    return [obsid for obsid in obsids if obsid in selectedObsids]
+
+def searchObservations(commonDirectory, searchedObsid):
+    # Returns the registered observations of the searched obsids as (path, obsid, exposure) tuples
+    cacheKey = ("registry", commonDirectory, tuple(searchedObsid))
+    if cacheKey not in observationCache:
+        registry = openRegistry(commonDirectory)
+        observationCache[cacheKey] = lookupObservations(registry, searchedObsid)
+        registry.close()
+
+    return list(observationCache[cacheKey])
+
+def forgetObservations():
+    # Called after the registry has been updated, so that the next scripts read the new observations
+    for cacheKey in list(observationCache.keys()):
+        if cacheKey[0] == "registry":
+            del observationCache[cacheKey]
+
+def runStage(scriptPath, arguments=[]):
+    # Runs a NICER script in this process, as if it was run with "python3 scriptPath arguments". Modules that have already been imported
+    # (parameter.py, PyXspec, astropy...) are not imported again. Terminating the script with quit() only ends the script itself.
+    # Returns False if the script has been terminated before reaching its end. An exception raised by the script (e.g. an Xspec error) is
+    # printed and also ends only the script itself, like a crash of a separately run script.
+    savedArgv = sys.argv
+    savedDirectory = os.getcwd()
+    sys.argv = [scriptPath] + list(arguments)
+
+    finished = True
+    try:
+        runpy.run_path(scriptPath, run_name="__main__")
+    except SystemExit:
+        finished = False
+    except Exception:
+        print(f"\nException occured while running {os.path.basename(scriptPath)}:")
+        traceback.print_exc()
+        finished = False
+    finally:
+        sys.argv = savedArgv
+        os.chdir(savedDirectory)
+
+    return finished
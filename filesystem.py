@@ -0,0 +1,148 @@
+# This is a helper module for the file operations of the NICER scripts. Directories and files are created, copied and removed
+# in-process instead of running mkdir, rm, cp and touch through the shell, and failures are reported instead of being ignored.
+# Authors: Batuhan Bahçeci
+# Contact: batuhan.bahceci@sabanciuniv.edu
+
+import os
+import glob
+import shutil
+import tempfile
+
+def makeDirectory(path):
+    # Creates the directory together with its missing parent directories, like "mkdir -p"
+    try:
+        os.makedirs(path, exist_ok=True)
+    except OSError as e:
+        print(f"ERROR: Could not create the directory {path}: {e}")
+        return False
+
+    return True
+
+def isProtectedPath(path):
+    # Guards against removing everything because of an empty or mistyped path, e.g. outputDir = "" or "/"
+    if path.strip() == "":
+        return True
+
+    realPath = os.path.realpath(path)
+    if realPath == "/" or realPath == os.path.realpath(os.path.expanduser("~")):
+        return True
+
+    # Top level directories such as /home or /data
+    return os.path.dirname(realPath) == "/"
+
+def removePath(path, recursive=False):
+    # Removes a file, or a directory with all of its contents if recursive is True. A path that does not exist is not an error.
+    if isProtectedPath(path):
+        print(f"ERROR: Refusing to remove the protected path '{path}'")
+        return False
+
+    try:
+        if os.path.isdir(path) and not os.path.islink(path):
+            if recursive == False:
+                print(f"ERROR: Could not remove {path}: it is a directory")
+                return False
+            shutil.rmtree(path)
+        else:
+            os.remove(path)
+    except FileNotFoundError:
+        pass
+    except OSError as e:
+        print(f"ERROR: Could not remove {path}: {e}")
+        return False
+
+    return True
+
+def clearDirectory(path):
+    # Removes the contents of the directory but keeps the directory itself, like "rm -r path/*"
+    try:
+        entries = os.listdir(path)
+    except FileNotFoundError:
+        return True
+    except OSError as e:
+        print(f"ERROR: Could not list the contents of {path}: {e}")
+        return False
+
+    success = True
+    for entry in entries:
+        if removePath(os.path.join(path, entry), recursive=True) == False:
+            success = False
+
+    return success
+
+def removeMatching(pattern):
+    # Removes the files matching a shell pattern, e.g. commonFiles/mod*
+    success = True
+    for path in glob.glob(pattern):
+        if removePath(path) == False:
+            success = False
+
+    return success
+
+def touchFile(path):
+    # Creates an empty file if it does not exist
+    try:
+        with open(path, "a"):
+            pass
+    except OSError as e:
+        print(f"ERROR: Could not create the file {path}: {e}")
+        return False
+
+    return True
+
+def copyFile(source, destination):
+    # Copies the file, 'destination' can be either a file path or a directory
+    if os.path.isdir(destination):
+        destination = os.path.join(destination, os.path.basename(source))
+
+    try:
+        shutil.copyfile(source, destination)
+    except OSError as e:
+        print(f"ERROR: Could not copy {source} to {destination}: {e}")
+        return False
+
+    return True
+
+def linkOrCopy(source, destination):
+    # Creates a hard link instead of copying the data when both paths are on the same file system, and falls back to copying otherwise.
+    # Only use it for files that are never modified in place, since the linked files share their contents.
+    if os.path.isdir(destination):
+        destination = os.path.join(destination, os.path.basename(source))
+
+    try:
+        if os.path.lexists(destination):
+            os.remove(destination)
+        os.link(source, destination)
+        return True
+    except OSError:
+        # Different file systems, or a file system without hard links
+        return copyFile(source, destination)
+
+def atomicWrite(path, content):
+    # Writes 'content' (a string or a list of lines) to a temporary file in the same directory and moves it over 'path' in one step,
+    # so that a crash or another process reading the file never sees it half-written
+    if isinstance(content, str):
+        content = [content]
+
+    directory = os.path.dirname(os.path.abspath(path))
+    tempPath = ""
+    try:
+        fd, tempPath = tempfile.mkstemp(dir=directory, prefix="." + os.path.basename(path) + ".", suffix=".tmp")
+        with os.fdopen(fd, "w") as file:
+            # Keep the permissions of the file being replaced (mkstemp creates files that only the owner can read)
+            mode = 0o644
+            if os.path.exists(path):
+                mode = os.stat(path).st_mode & 0o777
+            os.fchmod(file.fileno(), mode)
+
+            for line in content:
+                file.write(line)
+            file.flush()
+            os.fsync(file.fileno())
+        os.replace(tempPath, path)
+    except OSError as e:
+        print(f"ERROR: Could not write to {path}: {e}")
+        if tempPath != "" and os.path.exists(tempPath):
+            os.remove(tempPath)
+        return False
+
+    return True
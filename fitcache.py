@@ -0,0 +1,114 @@
+# This is a helper module that keeps the fit results of nicer_fit.py under commonFiles, so that observations whose spectral files,
+# model pipeline and fit settings have not changed since the last run do not have to be fitted again
+# Authors: Batuhan Bahçeci
+# Contact: batuhan.bahceci@sabanciuniv.edu
+
+import os
+import json
+import hashlib
+from filesystem import makeDirectory, removePath, copyFile, atomicWrite
+
+def fileDigest(path, digestIndex=None):
+    # Returns the sha256 digest of the file contents. If a digest index is given, the digest is only recalculated when the size or the
+    # modification time of the file has changed since it was last calculated.
+    stat = os.stat(path)
+    absolutePath = os.path.abspath(path)
+
+    if digestIndex is not None and absolutePath in digestIndex:
+        size, mtime, digest = digestIndex[absolutePath]
+        if size == stat.st_size and mtime == stat.st_mtime_ns:
+            return digest
+
+    sha = hashlib.sha256()
+    with open(path, "rb") as file:
+        while True:
+            block = file.read(1024 * 1024)
+            if not block:
+                break
+            sha.update(block)
+
+    digest = sha.hexdigest()
+    if digestIndex is not None:
+        digestIndex[absolutePath] = [stat.st_size, stat.st_mtime_ns, digest]
+
+    return digest
+
+def loadDigestIndex(cacheDir):
+    try:
+        with open(cacheDir + "/file_digests.json", "r") as file:
+            return json.load(file)
+    except Exception:
+        return {}
+
+def saveDigestIndex(cacheDir, digestIndex):
+    makeDirectory(cacheDir)
+    writeJson(cacheDir + "/file_digests.json", digestIndex)
+
+def writeJson(path, content):
+    # The file is replaced in one step, so that a crash never leaves a half-written file behind
+    if atomicWrite(path, json.dumps(content)) == False:
+        raise OSError("Could not write to " + path)
+
+def fitCacheKey(spectralFiles, pipelineSignature, settings, digestIndex=None):
+    # The key changes if any of the spectral files, the compiled model pipeline or the given fit settings change
+    sha = hashlib.sha256()
+    for path in spectralFiles:
+        sha.update(fileDigest(path, digestIndex).encode())
+
+    sha.update(pipelineSignature.encode())
+    sha.update(json.dumps(settings, sort_keys=True, default=str).encode())
+
+    return sha.hexdigest()
+
+def lookupFitResult(cacheDir, key):
+    # Returns the cached result for the key, or None if the key is not in the cache
+    entryDir = cacheDir + "/" + key
+    try:
+        with open(entryDir + "/result.json", "r") as file:
+            return json.load(file)
+    except Exception:
+        return None
+
+def storeFitResult(cacheDir, key, result, resultsFiles, observationFiles):
+    # Copies the given result files (from the results folder of the version) and observation files (from the observation directory)
+    # into the cache entry. result.json is written last, so an entry is only used once all of its files have been copied.
+    entryDir = cacheDir + "/" + key
+    removePath(entryDir, recursive=True)
+    if makeDirectory(entryDir + "/results") == False or makeDirectory(entryDir + "/observation") == False:
+        raise OSError("Could not create the cache entry " + entryDir)
+
+    for path in resultsFiles:
+        if copyFile(path, entryDir + "/results/" + os.path.basename(path)) == False:
+            raise OSError("Could not copy " + path + " to the cache entry")
+
+    for path in observationFiles:
+        if copyFile(path, entryDir + "/observation/" + os.path.basename(path)) == False:
+            raise OSError("Could not copy " + path + " to the cache entry")
+
+    writeJson(entryDir + "/result.json", result)
+
+def restoreFitResult(cacheDir, key, resultsLocation, observationDir):
+    # Copies the files of a cache entry into a new results folder and the observation directory. Paths of the old results folder that
+    # are written inside text files (e.g. xspec_bestmod_script.xcm) are replaced with the new one. Returns the cached result.
+    entryDir = cacheDir + "/" + key
+    result = lookupFitResult(cacheDir, key)
+    if result is None:
+        return None
+
+    oldLocation = result.get("results_location", "")
+
+    for fileName in os.listdir(entryDir + "/results"):
+        if fileName.endswith(".xcm") and oldLocation != "":
+            with open(entryDir + "/results/" + fileName, "r") as file:
+                content = file.read()
+            with open(resultsLocation + "/" + fileName, "w") as file:
+                file.write(content.replace(oldLocation, resultsLocation))
+        elif copyFile(entryDir + "/results/" + fileName, resultsLocation + "/" + fileName) == False:
+            return None
+
+    for fileName in os.listdir(entryDir + "/observation"):
+        if copyFile(entryDir + "/observation/" + fileName, observationDir + "/" + fileName) == False:
+            return None
+
+    result["results_location"] = resultsLocation
+    return result
@@ -0,0 +1,73 @@
+# This is a helper module for the header index of the spectral files, kept in the headers table of the observation registry. Only the
+# primary and the first extension headers of a file are read (never its data), once for every version of the file: the keywords used by
+# the scripts (EXPOSURE, MJD-OBS, DATE-OBS, TOTCTS) are saved together with the size, modification time and a digest of the headers, and
+# are returned from the registry until the size or the modification time of the file changes. A file whose headers could not be read is
+# saved as invalid together with the error, so that it is not opened again either.
+# Authors: Batuhan Bahçeci
+# Contact: batuhan.bahceci@sabanciuniv.edu
+
+import os
+import time
+import hashlib
+from astropy.io import fits
+
+headerColumns = ["size", "mtime", "digest", "valid", "error", "extension", "exposure", "mjd", "date_obs", "counts"]
+
+def spectralFileNames(obsid):
+    # Spectrum, background, arf and rmf files created by nicerl3-spect with suffix=3c50
+    return ["ni" + obsid + "mpu7_sr3c50.pha", "ni" + obsid + "mpu7_bg3c50.pha", "ni" + obsid + "mpu73c50.arf", "ni" + obsid + "mpu73c50.rmf"]
+
+def readHeaders(path, stat):
+    # Reads the primary and the first extension headers of the file. The HDUs are loaded lazily, so the data is skipped without being read.
+    entry = {"size": stat.st_size, "mtime": stat.st_mtime_ns, "digest": "", "valid": False, "error": "", "extension": "",
+             "exposure": None, "mjd": None, "date_obs": None, "counts": None}
+    try:
+        with fits.open(path, lazy_load_hdus=True) as hdu:
+            primaryHeader = hdu[0].header
+            extensionHeader = hdu[1].header
+    except Exception as e:
+        entry["error"] = str(e)
+        return entry
+
+    entry["digest"] = hashlib.sha256((primaryHeader.tostring() + extensionHeader.tostring()).encode()).hexdigest()
+    entry["extension"] = extensionHeader.get("EXTNAME", "")
+    entry["exposure"] = extensionHeader.get("EXPOSURE", primaryHeader.get("EXPOSURE"))
+    entry["mjd"] = extensionHeader.get("MJD-OBS", primaryHeader.get("MJD-OBS"))
+    entry["date_obs"] = extensionHeader.get("DATE-OBS", primaryHeader.get("DATE-OBS"))
+    entry["counts"] = extensionHeader.get("TOTCTS", primaryHeader.get("TOTCTS"))
+    entry["valid"] = True
+    return entry
+
+def lookupHeaders(connection, paths):
+    # Returns {path: entry} for the given files, where an entry holds the columns in headerColumns. The headers of new and changed files
+    # are read and saved to the registry in a single transaction. Files that do not exist are returned as invalid but are not saved.
+    rows = {}
+    for i in range(0, len(paths), 500):
+        chunk = paths[i:i + 500]
+        query = "SELECT path, " + ", ".join(headerColumns) + " FROM headers WHERE path IN (" + ", ".join(["?"] * len(chunk)) + ")"
+        for row in connection.execute(query, chunk):
+            rows[row[0]] = dict(zip(headerColumns, row[1:]))
+
+    entries = {}
+    newEntries = []
+    for path in paths:
+        try:
+            stat = os.stat(path)
+        except OSError as e:
+            entries[path] = {"size": None, "mtime": None, "digest": "", "valid": False, "error": str(e), "extension": "",
+                             "exposure": None, "mjd": None, "date_obs": None, "counts": None}
+            continue
+
+        entry = rows.get(path)
+        if entry is None or entry["size"] != stat.st_size or entry["mtime"] != stat.st_mtime_ns:
+            entry = readHeaders(path, stat)
+            newEntries.append((path, entry))
+        entry["valid"] = bool(entry["valid"])
+        entries[path] = entry
+
+    if newEntries != []:
+        with connection:
+            connection.executemany("INSERT OR REPLACE INTO headers (path, " + ", ".join(headerColumns) + ", recorded) VALUES (" + ", ".join(["?"] * (len(headerColumns) + 2)) + ")",
+                                   [[path] + [entry[column] for column in headerColumns] + [time.time()] for path, entry in newEntries])
+
+    return entries
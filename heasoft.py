@@ -0,0 +1,92 @@
+# This is a helper module for running HEASoft tasks from the NICER scripts. Independent tasks of an observation (e.g. the nicerl3-lc light
+# curves of each energy band) are run at the same time by an asyncio event loop, with a limit on the number of running tasks. Every task gets
+# its own PFILES directory, the output of a task is appended to the log file as one block once the task has finished (so the outputs of
+# tasks running at the same time are never mixed), and a task that exits with a non-zero code is run again up to 'retries' times, with its
+# retry command (e.g. with clobber=yes, so that a file left behind by the failed attempt does not make the retry fail).
+# Authors: Batuhan Bahçeci
+# Contact: batuhan.bahceci@sabanciuniv.edu
+
+import os
+import time
+import shutil
+import asyncio
+import tempfile
+
+def createPfilesDirectory():
+    # Nicer tasks write their parameter (.par) files under the first directory in $PFILES. Each task gets its own directory
+    # so that tasks running at the same time in different workers do not overwrite each other's parameter files.
+    pfilesDir = tempfile.mkdtemp(prefix="nicer_pfiles_")
+
+    systemPfiles = os.environ.get("PFILES", "")
+    if ";" in systemPfiles:
+        systemPfiles = systemPfiles[systemPfiles.find(";") + 1:]
+    elif os.environ.get("HEADAS") is not None:
+        systemPfiles = os.environ.get("HEADAS") + "/syspfiles"
+
+    return pfilesDir, pfilesDir + ";" + systemPfiles
+
+def appendToLog(logFile, taskName, attempt, returnCode, output):
+    try:
+        with open(logFile, "ab") as file:
+            file.write(f"\n========== {taskName} (attempt {attempt}, exit code {returnCode}) ==========\n".encode())
+            file.write(output)
+    except Exception as e:
+        print(f"Exception occured while writing the output of {taskName} to {logFile}: {e}")
+
+async def runTask(taskName, command, retryCommand, logFile, semaphore, retries):
+    # Returns (taskName, exit code of the last attempt, number of attempts, elapsed seconds)
+    startTime = time.time()
+    returnCode = -1
+    attempt = 0
+
+    async with semaphore:
+        while attempt <= retries:
+            attempt += 1
+            pfilesDir, pfilesValue = createPfilesDirectory()
+            taskEnv = os.environ.copy()
+            taskEnv["PFILES"] = pfilesValue
+
+            try:
+                process = await asyncio.create_subprocess_shell(command if attempt == 1 else retryCommand, stdin=asyncio.subprocess.DEVNULL, stdout=asyncio.subprocess.PIPE,
+                                                                stderr=asyncio.subprocess.STDOUT, env=taskEnv)
+                output, _ = await process.communicate()
+                returnCode = process.returncode
+            except Exception as e:
+                output = f"Exception occured while running {taskName}: {e}\n".encode()
+                returnCode = -1
+            finally:
+                shutil.rmtree(pfilesDir, ignore_errors=True)
+
+            # The event loop runs in a single thread, so the whole block is written before the output of another task
+            appendToLog(logFile, taskName, attempt, returnCode, output)
+            if returnCode == 0:
+                break
+
+            if attempt <= retries:
+                print(f"{taskName} exited with code {returnCode}, running it again ({attempt}/{retries})...")
+
+    return taskName, returnCode, attempt, time.time() - startTime
+
+async def runTaskGroup(tasks, logFile, concurrency, retries):
+    semaphore = asyncio.Semaphore(max(1, concurrency))
+    return await asyncio.gather(*[runTask(task[0], task[1], task[-1], logFile, semaphore, retries) for task in tasks])
+
+def runConcurrently(tasks, logFile, concurrency, retries=0):
+    # 'tasks' are (task name, shell command) or (task name, shell command, retry command) tuples, without any redirection of the output.
+    # Returns the names of the tasks that have failed in all of their attempts, in the order of 'tasks'.
+    if len(tasks) == 0:
+        return []
+
+    print("Running " + ", ".join([task[0] for task in tasks]) + f" ({min(len(tasks), max(1, concurrency))} at a time)...")
+    results = asyncio.run(runTaskGroup(tasks, logFile, concurrency, retries))
+
+    failedTasks = []
+    for taskName, returnCode, attempts, elapsed in results:
+        if returnCode == 0:
+            print(f"Finished {taskName} in {elapsed:.1f} s" + (f" after {attempts} attempts." if attempts > 1 else "."))
+        else:
+            print(f"{taskName} has failed with exit code {returnCode} after {attempts} attempts, please check the pipeline log file.")
+            failedTasks.append(taskName)
+
+    print()
+    return failedTasks
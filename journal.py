@@ -0,0 +1,73 @@
+# This is a helper module that keeps a journal of the campaign under commonFiles. Every stage records the progress of each observation
+# as soon as it is finished, so that a run started with '--resume' can continue from where a previous run has stopped.
+# Authors: Batuhan Bahçeci
+# Contact: batuhan.bahceci@sabanciuniv.edu
+
+import os
+import json
+import time
+import fcntl
+from filesystem import atomicWrite
+
+journalFileName = "campaign_journal.log"
+
+def recordEntry(journalPath, stage, key, status, **info):
+    # Appends one entry to the journal. Each entry is a single JSON line written with one call under an exclusive lock and synced
+    # to the disk, so entries written by different worker processes never get mixed up. A line that is cut short by a crash is
+    # ignored by readStage().
+    entry = {"stage": stage, "key": key, "status": status, "time": time.time()}
+    entry.update(info)
+    line = (json.dumps(entry) + "\n").encode()
+
+    fd = os.open(journalPath, os.O_RDWR | os.O_APPEND | os.O_CREAT, 0o644)
+    try:
+        fcntl.flock(fd, fcntl.LOCK_EX)
+
+        # Start on a new line if the last entry has been cut short by a crash
+        size = os.fstat(fd).st_size
+        if size > 0 and os.pread(fd, 1, size - 1) != b"\n":
+            line = b"\n" + line
+
+        written = 0
+        while written < len(line):
+            written += os.write(fd, line[written:])
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+def readEntries(journalPath):
+    entries = []
+    try:
+        with open(journalPath, "r") as file:
+            for line in file:
+                try:
+                    entries.append(json.loads(line))
+                except Exception:
+                    # Incomplete line left behind by a crash
+                    continue
+    except FileNotFoundError:
+        pass
+
+    return entries
+
+def readStage(journalPath, stage):
+    # Returns the latest entry of every key recorded for the stage since the stage was last started
+    stageEntries = {}
+    for entry in readEntries(journalPath):
+        if entry.get("stage") != stage:
+            continue
+
+        if entry.get("status") == "start":
+            stageEntries = {}
+        else:
+            stageEntries[entry["key"]] = entry
+
+    return stageEntries
+
+def startStage(journalPath, stage):
+    # Starts a new (not resumed) run of the stage. The old entries of the stage are dropped from the journal, and the journal is
+    # replaced in one step so that the entries of the other stages are never lost.
+    keptEntries = [entry for entry in readEntries(journalPath) if entry.get("stage") != stage]
+    keptEntries.append({"stage": stage, "key": "", "status": "start", "time": time.time()})
+
+    atomicWrite(journalPath, [json.dumps(entry) + "\n" for entry in keptEntries])
@@ -0,0 +1,124 @@
+# This is a helper module for nicer_create.py that creates the light curves of an observation from its cleaned event file without running
+# nicerl3-lc once for every energy band. The TIME and PI columns of the memory-mapped event file are read once, the time bin of every event
+# is calculated once for each time resolution and the events of every PI range are counted with a single bincount. Only the time bins inside
+# the GTIs are written, with their fractional exposure, as OGIP light curves named like the nicerl3-lc outputs (ni<obsid>mpu7_sr<suffix>.lc).
+# Authors: Batuhan Bahçeci
+# Contact: batuhan.bahceci@sabanciuniv.edu
+
+import os
+import glob
+import numpy as np
+from astropy.io import fits
+
+def findCleanedEventFile(directory, obsid):
+    # nicerl2 writes the cleaned event file as ni<obsid>_0mpu7_cl.evt under cldir
+    eventFile = directory + "/ni" + obsid + "_0mpu7_cl.evt"
+    if os.path.exists(eventFile):
+        return eventFile
+
+    matchingFiles = sorted(glob.glob(directory + "/*_cl.evt"))
+    if len(matchingFiles) == 0:
+        return ""
+    return matchingFiles[0]
+
+def lightCurveSuffix(piRange, resolutionPower):
+    # e.g. ("50-200", -8) -> "_50_200_dt8", the suffix given to nicerl3-lc
+    return "_" + piRange.replace(" ", "").replace("-", "_") + "_dt" + str(abs(resolutionPower))
+
+def binsInGtis(gtiStarts, gtiStops, startTime, binSize):
+    # Returns the indices of the time bins (counted from startTime) that overlap with the GTIs, and the exposure of each bin in seconds
+    firstBins = np.floor((gtiStarts - startTime) / binSize).astype(np.int64)
+    binCounts = np.ceil((gtiStops - startTime) / binSize).astype(np.int64) - firstBins
+    binCounts = np.maximum(binCounts, 0)
+
+    # The bins of all GTIs one after another, without a loop over the GTIs
+    gtiOfBin = np.repeat(np.arange(len(gtiStarts)), binCounts)
+    binIndices = np.arange(binCounts.sum()) - np.repeat(np.cumsum(binCounts) - binCounts, binCounts) + firstBins[gtiOfBin]
+
+    binStarts = startTime + binIndices * binSize
+    overlaps = np.minimum(binStarts + binSize, gtiStops[gtiOfBin]) - np.maximum(binStarts, gtiStarts[gtiOfBin])
+
+    # A bin shared by two GTIs gets the exposure of both
+    bins, inverse = np.unique(binIndices, return_inverse=True)
+    exposures = np.bincount(inverse, weights=np.clip(overlaps, 0, None), minlength=len(bins))
+
+    keep = exposures > 0
+    return bins[keep], exposures[keep]
+
+def writeLightCurve(fileName, header, gtiHdu, times, counts, exposures, binSize, piRange):
+    piMin, piMax = [int(value) for value in piRange.replace(" ", "").split("-")]
+    rates = counts / exposures
+
+    columns = [fits.Column(name="TIME", format="D", unit="s", array=times),
+               fits.Column(name="RATE", format="E", unit="count/s", array=rates),
+               fits.Column(name="ERROR", format="E", unit="count/s", array=np.sqrt(counts) / exposures),
+               fits.Column(name="FRACEXP", format="E", array=exposures / binSize)]
+    rateHdu = fits.BinTableHDU.from_columns(columns, name="RATE")
+
+    for keyword in ["TELESCOP", "INSTRUME", "OBS_ID", "OBJECT", "RA_OBJ", "DEC_OBJ", "DATE-OBS", "DATE-END", "TSTART", "TSTOP",
+                    "MJDREFI", "MJDREFF", "TIMEREF", "TIMESYS", "TIMEUNIT", "TIMEZERO", "CLOCKAPP", "DEADAPP"]:
+        if keyword in header:
+            rateHdu.header[keyword] = header[keyword]
+
+    rateHdu.header["HDUCLASS"] = ("OGIP", "Format conforms to OGIP standard")
+    rateHdu.header["HDUCLAS1"] = ("LIGHTCURVE", "Extension contains a light curve")
+    rateHdu.header["HDUCLAS2"] = ("TOTAL", "Extension contains the total count rate")
+    rateHdu.header["HDUCLAS3"] = ("RATE", "Extension contains count rates")
+    rateHdu.header["TIMEDEL"] = (binSize, "Time bin size in seconds")
+    rateHdu.header["TIMEPIXR"] = (0.5, "Times are at the middle of the bins")
+    rateHdu.header["EXPOSURE"] = (float(exposures.sum()), "Exposure time in seconds")
+    rateHdu.header["CHANMIN"] = (piMin, "Lowest PI channel in the light curve")
+    rateHdu.header["CHANMAX"] = (piMax, "Highest PI channel in the light curve")
+    rateHdu.header["CREATOR"] = ("nicer_create.py", "Native light curve builder")
+
+    # The file is written next to its final name and moved over it in one step, like nicerl3-lc with clobber=yes
+    tempFileName = fileName + ".tmp" + str(os.getpid())
+    fits.HDUList([fits.PrimaryHDU(), rateHdu, gtiHdu]).writeto(tempFileName, overwrite=True)
+    os.replace(tempFileName, fileName)
+
+def buildLightCurves(eventFile, outputDirectory, obsid, curves):
+    # 'curves' are (PI range, power of two of the time resolution) tuples, e.g. ("50-200", -8). Returns the names of the written files.
+    with fits.open(eventFile, memmap=True) as hdu:
+        header = hdu["EVENTS"].header
+        eventTimes = np.asarray(hdu["EVENTS"].data.field("TIME"), dtype=np.float64)
+        eventPis = np.asarray(hdu["EVENTS"].data.field("PI"), dtype=np.int64)
+
+        gtiHdu = fits.BinTableHDU(data=hdu["GTI"].data.copy(), header=hdu["GTI"].header.copy(), name="GTI")
+        gtiStarts = np.asarray(hdu["GTI"].data.field("START"), dtype=np.float64)
+        gtiStops = np.asarray(hdu["GTI"].data.field("STOP"), dtype=np.float64)
+        header = header.copy()
+
+    order = np.argsort(gtiStarts)
+    gtiStarts = gtiStarts[order]
+    gtiStops = gtiStops[order]
+    startTime = gtiStarts[0] if len(gtiStarts) > 0 else float(header.get("TSTART", 0))
+
+    # The events of each PI range are selected once and reused for every time resolution
+    bandMasks = {}
+    for piRange, resolutionPower in curves:
+        if piRange not in bandMasks:
+            piMin, piMax = [int(value) for value in piRange.replace(" ", "").split("-")]
+            bandMasks[piRange] = (eventPis >= piMin) & (eventPis <= piMax)
+
+    writtenFiles = []
+    for resolutionPower in sorted(set([resolutionPower for piRange, resolutionPower in curves])):
+        binSize = 2.0 ** resolutionPower
+        bins, exposures = binsInGtis(gtiStarts, gtiStops, startTime, binSize)
+
+        # Row of the written light curve each event falls into. Events outside the GTIs (there should be none in a cleaned file) are dropped.
+        eventBins = np.floor((eventTimes - startTime) / binSize).astype(np.int64)
+        eventRows = np.searchsorted(bins, eventBins)
+        insideGtis = eventRows < len(bins)
+        insideGtis[insideGtis] = bins[eventRows[insideGtis]] == eventBins[insideGtis]
+
+        times = startTime + (bins + 0.5) * binSize
+        for piRange, curvePower in curves:
+            if curvePower != resolutionPower:
+                continue
+
+            counts = np.bincount(eventRows[insideGtis & bandMasks[piRange]], minlength=len(bins)).astype(np.float64)
+            fileName = outputDirectory + "/ni" + obsid + "mpu7_sr" + lightCurveSuffix(piRange, curvePower) + ".lc"
+            writeLightCurve(fileName, header, gtiHdu, times, counts, exposures, binSize, piRange)
+            writtenFiles.append(fileName)
+
+    return writtenFiles
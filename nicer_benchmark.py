@@ -0,0 +1,241 @@
+# This is a NICER script for measuring the time spent by the scripts themselves (interpreter, file I/O, text parsing, registry and worker
+# handling), without HEASoft. It creates synthetic campaigns with the spectral files, processed_obs.txt and parameters_bestmodel.txt files of
+# 10, 100 and 1000 observations, runs nicer_fit.py, nicer_flux.py and nicer_plot.py on them with the deterministic stand-in for PyXspec under
+# benchmark/xspec.py, and reports the throughput of each stage. Usage:
+#   python3 nicer_benchmark.py [--sizes 10,100,1000] [--workers N] [--latency perform=0.01,error=0.005] [--output FILE]
+#                              [--baseline FILE] [--tolerance 0.25] [--keep]
+#   --sizes       numbers of observations of the synthetic campaigns
+#   --workers     fit_worker_count, flux_worker_count and plot_worker_count used by the scripts (default: 1)
+#   --latency     seconds that the stand-in waits for each Xspec call (perform, error, eqwidth, spectrum, save, restore), 0 by default
+#   --output      CSV file the results are appended to (default: benchmark/benchmark_results.csv), to follow them over time
+#   --baseline    CSV file written by an earlier run, the script exits with status 1 if a stage has become slower than its latest
+#                 result in that file by more than 'tolerance' (e.g. 0.25 = 25%)
+#   --keep        keeps the synthetic campaigns under the temporary directory instead of removing them
+# Authors: Batuhan Bahçeci
+# Contact: batuhan.bahceci@sabanciuniv.edu
+
+import os
+import sys
+
+# The stand-in must be found before the real PyXspec
+scriptDir = os.path.dirname(os.path.realpath(__file__))
+sys.path.insert(0, scriptDir + "/benchmark")
+
+import csv
+import time
+import platform
+import tempfile
+import contextlib
+import xspec
+import parameter
+import numpy as np
+from astropy.io import fits
+from filesystem import makeDirectory, removePath, atomicWrite
+from registry import openRegistry
+from resultstore import readParameterFile, parameterFileLines
+from bootstrap import runStage
+
+print("==============================================================================")
+print("\t\t\tRunning nicer_benchmark.py\n")
+
+os.chdir(scriptDir)
+
+#========================================================== Input Checks ===========================================================
+arguments = sys.argv[1:]
+
+def argumentValue(name, default):
+    if name not in arguments:
+        return default
+    try:
+        return arguments[arguments.index(name) + 1]
+    except IndexError:
+        print(f"'{name}' must be followed by a value.")
+        quit()
+
+try:
+    campaignSizes = [int(size) for size in argumentValue("--sizes", "10,100,1000").split(",")]
+    if min(campaignSizes) <= 0:
+        raise Exception()
+except:
+    print("'--sizes' must be followed by positive integers seperated by commas, e.g. --sizes 10,100,1000")
+    quit()
+
+try:
+    workerCount = int(argumentValue("--workers", "1"))
+except:
+    print("'--workers' must be followed by an integer (0 uses all available cores).")
+    quit()
+
+try:
+    for element in argumentValue("--latency", "").split(","):
+        if element == "":
+            continue
+        name, value = element.split("=")
+        if name not in xspec.latencies or float(value) < 0:
+            raise Exception()
+        xspec.latencies[name] = float(value)
+except:
+    print("'--latency' must be followed by name=seconds pairs seperated by commas, where names are: " + ", ".join(xspec.latencies.keys()))
+    quit()
+
+try:
+    tolerance = float(argumentValue("--tolerance", "0.25"))
+    if tolerance < 0:
+        raise Exception()
+except:
+    print("'--tolerance' must be followed by a non-negative number, e.g. 0.25 for 25%.")
+    quit()
+
+resultsFile = argumentValue("--output", scriptDir + "/benchmark/benchmark_results.csv")
+baselineFile = argumentValue("--baseline", "")
+keepCampaigns = "--keep" in arguments
+
+if baselineFile != "" and os.path.exists(baselineFile) == False:
+    print(f"Could not find the baseline file '{baselineFile}'.")
+    quit()
+#===================================================================================================================================
+
+#===================================================================================================================================
+# Functions
+resultColumns = ["date", "python", "machine", "size", "stage", "seconds", "ms_per_observation", "observations_per_second", "finished", "workers", "latencies"]
+
+def writeSpectralFile(fileName, obsid, mjd, extensionName):
+    # A small OGIP-like file with the header keywords read by the scripts
+    columns = [fits.Column(name="CHANNEL", format="J", array=np.arange(1501, dtype=np.int32)),
+               fits.Column(name="COUNTS", format="J", array=np.full(1501, 10, dtype=np.int32))]
+    table = fits.BinTableHDU.from_columns(columns, name=extensionName)
+    table.header["OBS_ID"] = obsid
+    table.header["MJD-OBS"] = mjd
+    table.header["EXPOSURE"] = 1000.0
+    fits.HDUList([fits.PrimaryHDU(), table]).writeto(fileName, overwrite=True)
+
+def createCampaign(campaignDir, size):
+    # Creates the observation folders of nicer_create.py for 'size' observations, one observation per day. Returns the output directory.
+    outputDirectory = campaignDir + "/output"
+    commonDirectory = outputDirectory + "/commonFiles"
+    makeDirectory(commonDirectory)
+
+    observationLines = []
+    processedLines = []
+    for i in range(size):
+        obsid = str(6000000000 + i)
+        mjd = 60000.0 + i
+        rawPath = campaignDir + "/data/" + obsid
+        path = outputDirectory + "/" + obsid
+        makeDirectory(rawPath)
+        makeDirectory(path)
+
+        writeSpectralFile(path + "/ni" + obsid + "mpu7_sr3c50.pha", obsid, mjd, "SPECTRUM")
+        writeSpectralFile(path + "/ni" + obsid + "mpu7_bg3c50.pha", obsid, mjd, "SPECTRUM")
+        writeSpectralFile(path + "/ni" + obsid + "mpu73c50.arf", obsid, mjd, "SPECRESP")
+        writeSpectralFile(path + "/ni" + obsid + "mpu73c50.rmf", obsid, mjd, "MATRIX")
+
+        # Parameter file in the format written by nicer_fit.py
+        atomicWrite(path + "/parameters_bestmodel.txt", parameterFileLines([("Powerlaw index", "", 2.0 + 0.001 * i, 1.9, 2.1),
+                                                                           ("Tin (keV)", "", 1.0, 0.95, 1.05),
+                                                                           ("TBabs nH", "", 6.0, 5.9, 6.1)]))
+
+        observationLines.append(rawPath + "\n")
+        processedLines.append(path + " " + obsid + " 1000.0\n")
+
+    atomicWrite(campaignDir + "/observations.txt", observationLines)
+    atomicWrite(commonDirectory + "/processed_obs.txt", processedLines)
+    return outputDirectory
+
+def parseCampaign(outputDirectory):
+    # Imports processed_obs.txt into a new observation registry and reads the parameter file of every observation
+    registry = openRegistry(outputDirectory + "/commonFiles")
+    paths = [row[0] for row in registry.execute("SELECT path FROM observations")]
+    registry.close()
+
+    for path in paths:
+        readParameterFile(path + "/parameters_bestmodel.txt")
+
+def readBaseline(fileName):
+    # Returns the latest result of every (size, stage) pair in a results file
+    baseline = {}
+    with open(fileName, "r", newline="") as file:
+        for row in csv.DictReader(file):
+            baseline[(int(row["size"]), row["stage"])] = float(row["seconds"])
+    return baseline
+
+def appendResults(fileName, rows):
+    newFile = os.path.exists(fileName) == False
+    try:
+        with open(fileName, "a", newline="") as file:
+            writer = csv.DictWriter(file, fieldnames=resultColumns)
+            if newFile:
+                writer.writeheader()
+            writer.writerows(rows)
+    except Exception as e:
+        print(f"Exception occured while writing the results to {fileName}: {e}")
+#===================================================================================================================================
+
+# Settings of parameter.py used by the benchmarked scripts. The fit cache is disabled so that every run fits all observations.
+parameter.fit_worker_count = workerCount
+parameter.flux_worker_count = workerCount
+parameter.plot_worker_count = workerCount
+parameter.shakefit_worker_count = 1
+parameter.use_fit_cache = False
+parameter.fix_parameters_after_sampling = False
+parameter.chatterOn = False
+
+stages = [("parse", ""), ("fit", parameter.fit_script_name), ("flux", parameter.flux_script_name), ("plot", parameter.plot_script_name)]
+latencyText = " ".join([name + "=" + str(value) for name, value in xspec.latencies.items() if value > 0])
+results = []
+
+for size in campaignSizes:
+    campaignDir = tempfile.mkdtemp(prefix=f"nicer_benchmark_{size}_")
+    print(f"Creating a synthetic campaign of {size} observations under {campaignDir}...")
+    outputDirectory = createCampaign(campaignDir, size)
+
+    parameter.outputDir = outputDirectory
+    parameter.inputTxtFile = os.path.relpath(campaignDir + "/observations.txt", scriptDir)
+
+    # The output of the scripts is kept in a log file, so that printing to the terminal is not measured
+    with open(campaignDir + "/benchmark.log", "w", buffering=1) as logFile:
+        for stage, scriptName in stages:
+            start = time.perf_counter()
+            with contextlib.redirect_stdout(logFile):
+                if stage == "parse":
+                    parseCampaign(outputDirectory)
+                    finished = True
+                else:
+                    finished = runStage(scriptDir + "/" + scriptName, [])
+            seconds = time.perf_counter() - start
+
+            results.append({"date": time.strftime("%Y-%m-%d %H:%M:%S"), "python": platform.python_version(), "machine": platform.node(), "size": size,
+                            "stage": stage, "seconds": round(seconds, 4), "ms_per_observation": round(1000 * seconds / size, 3),
+                            "observations_per_second": round(size / seconds, 2), "finished": finished, "workers": workerCount, "latencies": latencyText})
+
+            if finished == False:
+                print(f"WARNING: {scriptName} has been terminated before reaching its end, see {campaignDir}/benchmark.log")
+
+    if keepCampaigns:
+        print(f"The campaign has been kept under {campaignDir}\n")
+    else:
+        removePath(campaignDir, recursive=True)
+
+print(f"\n{'Size':>6} {'Stage':<8} {'Time (s)':>10} {'ms/obs':>10} {'obs/s':>10}")
+for row in results:
+    print(f"{row['size']:>6} {row['stage']:<8} {row['seconds']:>10.3f} {row['ms_per_observation']:>10.3f} {row['observations_per_second']:>10.2f}")
+
+regressions = []
+if baselineFile != "":
+    baseline = readBaseline(baselineFile)
+    for row in results:
+        previous = baseline.get((row["size"], row["stage"]))
+        if previous is not None and row["seconds"] > previous * (1 + tolerance):
+            regressions.append(f"{row['stage']} ({row['size']} observations): {row['seconds']:.3f} s, previously {previous:.3f} s")
+
+appendResults(resultsFile, results)
+print(f"\nResults have been appended to {resultsFile}")
+
+if os.path.exists(scriptDir + "/__pycache__"):
+    removePath(scriptDir + "/__pycache__", recursive=True)
+
+if regressions != []:
+    print(f"\nERROR: The following stages are more than {tolerance * 100:.0f}% slower than in {baselineFile}:")
+    for regression in regressions:
+        print("\t" + regression)
+    sys.exit(1)
@@ -4,15 +4,28 @@
 
 from parameter import *
 from datetime import datetime, timezone, timedelta
+from workers import runInParallel, resolveWorkerCount
+from filesystem import makeDirectory, removePath, clearDirectory, touchFile, copyFile, atomicWrite
+from registry import openRegistry, modeOfPath, registerObservations, setStageStatus, recordScreening, exportProcessedObs
+from heasoft import createPfilesDirectory, runConcurrently
+from headerindex import spectralFileNames, lookupHeaders
+from lightcurve import findCleanedEventFile, lightCurveSuffix, buildLightCurves
+from bootstrap import scriptDirectory, checkBoolean, checkWorkerCount, readObservationPaths, obsidOfPath, selectObsids, forgetObservations
+import subprocess
+import numpy as np
+from astropy.io import fits
+import shutil
+import time
+import json
+import glob
+import sys
+import fcntl
 
 print("==============================================================================")
 print("\t\t\tRunning " + create_script_name + "\n")
 
 # Find the script's own path
-scriptPath = os.path.abspath(__file__)
-scriptPathRev = scriptPath[::-1]
-scriptPathRev = scriptPathRev[scriptPathRev.find("/") + 1:]
-scriptDir = scriptPathRev[::-1]
+scriptDir = scriptDirectory(__file__)
 
 # Check if outputDir has been assigned to be a spesific directory or not
 # If not, assign outputDir to the directory where the script is located at
@@ -26,36 +39,27 @@ while(Path(outputDir).exists() == False):
     quit()
 
 # Input check for overwrite_files
-if isinstance(overwrite_files, bool) == False:
-    while True:
-        print("\nThe 'overwrite_files' variable is not of type boolean.")
-        overwrite_files = input("Please enter a boolean value for 'overwrite_files' (True/False): ")
-
-        if overwrite_files == "True" or overwrite_files == "False":
-            overwrite_files = bool(overwrite_files)
-            break
+overwrite_files = checkBoolean("overwrite_files", overwrite_files)
 
 # Input check for createHighResLightCurves
-if isinstance(createHighResLightCurves, bool) == False:
-    while True:
-        print("\nThe 'createHighResLightCurves' variable is not of type boolean.")
-        createHighResLightCurves = input("Please enter a boolean value for 'createHighResLightCurves' (True/False): ")
-
-        if createHighResLightCurves == "True" or createHighResLightCurves == "False":
-            createHighResLightCurves = bool(createHighResLightCurves)
-            break
+createHighResLightCurves = checkBoolean("createHighResLightCurves", createHighResLightCurves)
 
-# Input check for highResLcTimeResInPwrTwo
+# Input check for highResLcTimeResInPwrTwo, which may be a single power of two or a list of them
+highResLcResolutions = list(highResLcTimeResInPwrTwo) if isinstance(highResLcTimeResInPwrTwo, list) else [highResLcTimeResInPwrTwo]
 if createHighResLightCurves:
-    while (str(highResLcTimeResInPwrTwo).lstrip("-").isnumeric() == False) or (int(highResLcTimeResInPwrTwo) > 0):
-        print("Please enter an integer value x <= 0 for the time resolution of high resolution light curves, or enter 'exit' to terminate the script.")
-        highResLcTimeResInPwrTwo = input("Enter your input x (x<=0 / exit): ")
-        if highResLcTimeResInPwrTwo == "exit":
-            print("Terminating " + create_script_name + ": Next scripts to be executed may crash.")
-            quit()
-        if highResLcTimeResInPwrTwo.lstrip("-").isnumeric() == True and int(highResLcTimeResInPwrTwo) <= 0:
-            highResLcTimeResInPwrTwo = int(highResLcTimeResInPwrTwo)
-            break
+    for i in range(len(highResLcResolutions)):
+        while (str(highResLcResolutions[i]).lstrip("-").isnumeric() == False) or (int(highResLcResolutions[i]) > 0):
+            print("Please enter an integer value x <= 0 for the time resolution of high resolution light curves, or enter 'exit' to terminate the script.")
+            highResLcResolutions[i] = input("Enter your input x (x<=0 / exit): ")
+            if highResLcResolutions[i] == "exit":
+                print("Terminating " + create_script_name + ": Next scripts to be executed may crash.")
+                quit()
+            if highResLcResolutions[i].lstrip("-").isnumeric() == True and int(highResLcResolutions[i]) <= 0:
+                break
+        highResLcResolutions[i] = int(highResLcResolutions[i])
+
+# Input check for use_native_lightcurves
+use_native_lightcurves = checkBoolean("use_native_lightcurves", use_native_lightcurves)
 
 # Input check for createHighResLightCurves
 while (str(createHighResLightCurves) != "True" and str(createHighResLightCurves) != "False"):
@@ -64,12 +68,301 @@ while (str(createHighResLightCurves) != "True" and str(createHighResLightCurves)
         createHighResLightCurves = bool(createHighResLightCurves)
         break
 
-# Open the txt file located within the same directory as the script.
+# Input checks for highResLcConcurrency and highResLcRetries
+if createHighResLightCurves:
+    highResLcConcurrency = checkWorkerCount("highResLcConcurrency", highResLcConcurrency, "Please enter the number of light curves to be created at the same time")
+    if highResLcConcurrency == 0:
+        highResLcConcurrency = len(highResLcPiRanges) * len(highResLcResolutions)
+
+    while str(highResLcRetries).isnumeric() == False:
+        print("\nThe 'highResLcRetries' variable must be a non-negative integer.")
+        highResLcRetries = input("Please enter the number of times a failed light curve will be created again (x >= 0): ")
+    highResLcRetries = int(highResLcRetries)
+
+# Input check for prescreen_exposure
+prescreen_exposure = checkBoolean("prescreen_exposure", prescreen_exposure)
+
+# Input check for minimum_exposure
+while True:
+    try:
+        minimum_exposure = float(minimum_exposure)
+        if minimum_exposure >= 0:
+            break
+    except Exception:
+        pass
+    print("\nThe 'minimum_exposure' variable must be a non-negative number of seconds.")
+    minimum_exposure = input("Please enter the minimum exposure of the observations to be fitted (x >= 0): ")
+
+# Input check for create_worker_count
+create_worker_count = checkWorkerCount("create_worker_count", create_worker_count, "Please enter the number of observations to be processed at the same time")
+
+# Read the observation paths from the txt file located within the same directory as the script.
 try:
-    inputFile = open(scriptDir + "/" + inputTxtFile, "r")
+    validPaths = readObservationPaths(scriptDir + "/" + inputTxtFile)
 except Exception as e:
-    print(f"Exception occured while opening {inputTxtFile}: {e}")
+    print(f"Exception occured while reading {inputTxtFile}: {e}")
     quit()
+
+# nicer_main.py runs this script for single observations with '--stream --obsid <obsid>', while other observations are processed by
+# other instances of the script
+selectedObsids = selectObsids([obsidOfPath(path) for path in validPaths], sys.argv[1:])
+validPaths = [path for path in validPaths if obsidOfPath(path) in selectedObsids]
+streamRun = "--stream" in sys.argv[1:]
+#========================================================================================================================
+
+#========================================================================================================================
+# Functions
+def runNigeodown():
+    # Only one instance of the script downloads the geomagnetic data at a time
+    with open(commonDirectory + "/.nigeodown.lock", "w") as lockFile:
+        fcntl.flock(lockFile, fcntl.LOCK_EX)
+        print("Running nigeodown...")
+        os.system("nigeodown chatter=5")
+        print("Finished nigeodown.")
+
+def runPipelineCommand(command, taskName, taskEnv):
+    # Runs a Nicer task through the shell and returns True only if the task has finished with exit code 0
+    print("Running " + taskName + "...")
+    try:
+        result = subprocess.run(command, shell=True, env=taskEnv)
+    except Exception as e:
+        print(f"Exception occured while running {taskName}: {e}")
+        return False
+
+    if result.returncode != 0:
+        print(f"{taskName} exited with code {result.returncode}, please check the pipeline log file.")
+        return False
+
+    print("Finished " + taskName + ".\n")
+    return True
+
+def orbitGtis(timeColumn, sunshineColumn):
+    # Splits the rows of the mkf file into intervals where SUNSHINE does not change and there is no gap in TIME, and returns
+    # them as [start, stop, "day"/"night"] lists. Every row stands for one time step (1 s in NICER mkf files), so each interval
+    # lasts until one step after its last row, and an interval of a single row lasts one step.
+    if len(timeColumn) == 0:
+        return []
+
+    timeSteps = np.diff(timeColumn)
+    rowStep = float(np.median(timeSteps)) if len(timeSteps) > 0 else 1.0
+    gapThreshold = 5 * rowStep if len(timeSteps) > 0 else 0
+    boundaries = np.flatnonzero((np.diff(sunshineColumn) != 0) | (timeSteps > gapThreshold))
+
+    starts = np.concatenate(([0], boundaries + 1))
+    stops = np.concatenate((boundaries, [len(timeColumn) - 1]))
+
+    gtis = []
+    for start, stop in zip(starts, stops):
+        mode = "day" if sunshineColumn[start] == 1 else "night"
+        gtis.append([float(timeColumn[start]), float(timeColumn[stop]) + rowStep, mode])
+
+    return gtis
+
+def scanMkf(mkfFile, obsid):
+    # Reads the observation date from the mkf file and, for observations made after the light leak, whether the observation has
+    # day and/or night time data together with the day/night GTIs. Only the SUNSHINE and TIME columns are read, in one go from the
+    # memory-mapped file. The results are cached under commonFiles/mkf_cache, so that an unchanged mkf file is never opened again.
+    # Returns None if the mkf file can not be read.
+    cacheFile = mkfCacheDirectory + "/" + obsid + ".json"
+    try:
+        stat = os.stat(mkfFile)
+    except Exception as e:
+        print(f"Exception occured while reading {mkfFile}: {e}")
+        return None
+
+    try:
+        with open(cacheFile, "r") as file:
+            summary = json.load(file)
+        if summary["mkf"] == os.path.abspath(mkfFile) and summary["size"] == stat.st_size and summary["mtime"] == stat.st_mtime_ns and summary.get("version") == mkfCacheVersion:
+            return summary
+    except Exception:
+        pass
+
+    summary = {"mkf": os.path.abspath(mkfFile), "size": stat.st_size, "mtime": stat.st_mtime_ns, "version": mkfCacheVersion, "date": "", "day": False, "night": False, "gti": []}
+    try:
+        with fits.open(mkfFile, memmap=True) as hdu:
+            summary["date"] = hdu[1].header["DATE-OBS"].replace("T", " ")
+
+            if datetime.strptime(summary["date"], '%Y-%m-%d %H:%M:%S') > lightleak_object:
+                try:
+                    sunshineColumn = np.array(hdu[1].data.field("SUNSHINE"))
+                    timeColumn = np.array(hdu[1].data.field("TIME"), dtype=float)
+                except Exception as e:
+                    print(f"Exception occured while accessing 'SUNSHINE' column in mkf file: {e}")
+                    return None
+
+                dayRows = (sunshineColumn == 1)
+                summary["day"] = bool(dayRows.any())
+                summary["night"] = bool((~dayRows).any())
+                summary["gti"] = orbitGtis(timeColumn, sunshineColumn)
+    except Exception as e:
+        print(f"Exception occured while opening {mkfFile}: {e}")
+        return None
+
+    atomicWrite(cacheFile, json.dumps(summary))
+    return summary
+
+def orbitExposure(mkfFile, obsid, obsMode):
+    # Total length of the day or night orbits of an observation made after the light leak, read from the cached mkf summary. Screening
+    # can only remove time from the orbits, so this is an upper limit of the exposure. Returns None if it can not be estimated.
+    mkfSummary = scanMkf(mkfFile, obsid)
+    if mkfSummary is None or mkfSummary["gti"] == []:
+        return None
+
+    return sum([stop - start for start, stop, mode in mkfSummary["gti"] if mode == obsMode])
+
+def cleanedExposure(directory, obsid):
+    # Exposure left after the screening of nicerl2, i.e. the total length of the GTIs of the cleaned event file. This is the exposure that
+    # nicerl3-spect writes to the spectrum. Only the GTI extension is read. Returns None if it can not be read.
+    eventFile = findCleanedEventFile(directory, obsid)
+    if eventFile == "":
+        return None
+
+    try:
+        with fits.open(eventFile, memmap=True) as hdu:
+            gtiData = hdu["GTI"].data
+            return float(np.sum(np.asarray(gtiData.field("STOP"), dtype=float) - np.asarray(gtiData.field("START"), dtype=float)))
+    except Exception as e:
+        print(f"Exception occured while reading the GTIs of {eventFile}: {e}")
+        return None
+
+def processObservation(task):
+    # Runs nicerl2, nicerl3-spect and nicerl3-lc for a single output directory. 'obsMode' is an empty string for observations made
+    # before the light leak, and "day" or "night" for the sub-directories of observations made after the light leak.
+    # Returns a summary of the task, which is merged with the summaries of the other workers at the end of the script.
+    obs, obsid, outObsDir, obsMode, matching_mkf_files = task
+    startTime = time.time()
+    summary = {"obsid": obsid, "mode": obsMode, "directory": outObsDir, "failed": "", "skipped": "", "exposure": None, "exposure_source": "", "elapsed": 0}
+
+    # Create a log file to record the outputs of pipeline commands
+    pipelineLog = outObsDir + "/pipeline_output.log"
+    clobber_parameter = "no"
+
+    if (overwrite_files == False):
+        clearDirectory(outObsDir)
+    else:
+        clobber_parameter = "yes"
+
+    touchFile(pipelineLog)
+
+    # The mkf file is copied instead of being linked, since nicerl2 updates it in place
+    for each_file in matching_mkf_files:
+        copyFile(each_file, outObsDir)
+
+    # Observations made after the light leak are screened with different undershoot ranges for day and night orbits
+    threshParameter = ""
+    if obsMode == "night":
+        threshParameter = " thresh_range='-3.0-3.0'"
+    elif obsMode == "day":
+        threshParameter = " thresh_range='32-38'"
+
+    spectChatter = ""
+    lcChatter = ""
+    if obsMode == "":
+        spectChatter = " chatter=3"
+        lcChatter = " chatter=4"
+
+    # Every task uses its own parameter file directory
+    pfilesDir, pfilesValue = createPfilesDirectory()
+    taskEnv = os.environ.copy()
+    taskEnv["PFILES"] = pfilesValue
+
+    # Run nicer pipeline commands
+    print("==============================================================================")
+    print("Starting to run pipeline commands for observation: " + obsid + "\n")
+
+    if obsMode != "":
+        print("NOTICE: Observation " + obsid + " is made after the 22/05/2023 NICER optical light leak.")
+        print("Spectral files will be located under 'day' and 'night' sub-directories depending on the observation orbit time.")
+        print("Getting exposure=0 error especially for day-time observations is an expected result.")
+        print("Currently processing: " + obsMode + " time\n")
+
+    # Day or night orbits that are already shorter than minimum_exposure can not pass the screening, so not even nicerl2 is run for them
+    if prescreen_exposure and obsMode != "":
+        exposure = orbitExposure(matching_mkf_files[0], obsid, obsMode)
+        if exposure is not None:
+            summary["exposure"] = exposure
+            summary["exposure_source"] = "mkf orbits"
+            if exposure < minimum_exposure:
+                summary["skipped"] = f"{obsMode} orbits of the mkf file last {exposure:.1f} s, below {minimum_exposure:g} s"
+
+    # Run nicerl2
+    if summary["skipped"] == "":
+        nicerl2 = "nicerl2 indir=" + obs + " mkfile='$CLDIR/ni$OBSID.mkf' clobber=" + clobber_parameter + " chatter=3 history=yes detlist=launch,-14,-34" + threshParameter + " filtcolumns=NICERV5 cldir=" + outObsDir + " > " + pipelineLog
+        if runPipelineCommand(nicerl2, "nicerl2", taskEnv) == False:
+            summary["failed"] = "nicerl2"
+
+    # The exposure left after the screening of nicerl2 is known from the GTIs of the cleaned event file, so the spectral and light curve
+    # tasks are not run for an observation whose spectrum would be rejected by the exposure filter at the end of the script anyway
+    if prescreen_exposure and summary["failed"] == "" and summary["skipped"] == "":
+        exposure = cleanedExposure(outObsDir, obsid)
+        if exposure is not None:
+            summary["exposure"] = exposure
+            summary["exposure_source"] = "cleaned event GTIs"
+            if exposure < minimum_exposure:
+                summary["skipped"] = f"screened exposure is {exposure:.1f} s, below {minimum_exposure:g} s"
+
+    if summary["skipped"] != "":
+        print("Skipping the spectral and light curve tasks of observation " + obsid + ": " + summary["skipped"] + "\n")
+        summary["failed"] = "exposure screening"
+
+    # Run nicerl3-spect
+    if summary["failed"] == "":
+        nicerl3spect = "nicerl3-spect " + outObsDir + " mkfile='$CLDIR/ni$OBSID.mkf' clobber=" + clobber_parameter + " grouptype=optmin" + spectChatter + " groupscale=10 bkgmodeltype=3c50 suffix=3c50 >> " + pipelineLog
+        if runPipelineCommand(nicerl3spect, "nicerl3-spect", taskEnv) == False:
+            summary["failed"] = "nicerl3-spect"
+
+    # Create all light curves in one pass over the cleaned event file instead of running nicerl3-lc for each of them
+    if summary["failed"] == "" and use_native_lightcurves:
+        curves = [("50-1000", 0)]
+        if createHighResLightCurves:
+            curves += [(each.replace(" ", ""), resolution) for resolution in highResLcResolutions for each in highResLcPiRanges]
+
+        eventFile = findCleanedEventFile(outObsDir, obsid)
+        print("Creating " + str(len(curves)) + " light curves from " + eventFile + "...")
+        try:
+            if eventFile == "":
+                raise Exception("could not find the cleaned event file")
+            buildLightCurves(eventFile, outObsDir, obsid, curves)
+            print("Finished creating the light curves.\n")
+        except Exception as e:
+            print(f"Exception occured while creating the light curves: {e}")
+            summary["failed"] = "light curves"
+
+    # Run nicerl3-lc and create default resolution (1s) light curve
+    if summary["failed"] == "" and use_native_lightcurves == False:
+        nicerl3lc = "nicerl3-lc " + outObsDir + " mkfile='$CLDIR/ni$OBSID.mkf' clobber=" + clobber_parameter + " pirange=50-1000" + lcChatter + " timebin=1 suffix=_50_1000_dt0 >> " + pipelineLog
+        if runPipelineCommand(nicerl3lc, "nicerl3-lc", taskEnv) == False:
+            summary["failed"] = "nicerl3-lc"
+
+    # Check whether the user wants to create high resolution light curves. The light curves of the energy bands do not depend on each other,
+    # so they are created at the same time, each with its own PFILES directory (see heasoft.py).
+    if summary["failed"] == "" and createHighResLightCurves and use_native_lightcurves == False:
+        bandTasks = []
+        for resolution in highResLcResolutions:
+            for each in highResLcPiRanges:
+                each = each.replace(" ", "")
+                nicerl3lc = "nicerl3-lc " + outObsDir + " mkfile='$CLDIR/ni$OBSID.mkf' clobber=" + clobber_parameter + " pirange=" + str(each) + " timebin=" + str(2**resolution) + " suffix=" + lightCurveSuffix(each, resolution)
+                # A failed attempt may leave its light curve behind, which the retries overwrite
+                retryCommand = nicerl3lc.replace(" clobber=" + clobber_parameter + " ", " clobber=yes ")
+                bandTasks.append(("nicerl3-lc (pirange=" + each + ", timebin=" + str(2**resolution) + ")", nicerl3lc, retryCommand))
+
+        failedTasks = runConcurrently(bandTasks, pipelineLog, highResLcConcurrency, highResLcRetries)
+        if failedTasks != []:
+            summary["failed"] = ", ".join(failedTasks)
+
+    shutil.rmtree(pfilesDir, ignore_errors=True)
+
+    print("Please do not forget to check pipeline log file to detect potential issues that might have occured while creating output files.")
+    print("==============================================================================")
+
+    # Create log file for saving fit results that will be used by nicer_fit.py
+    fitLog = outObsDir +"/" + resultsFile
+    touchFile(fitLog)
+
+    summary["elapsed"] = time.time() - startTime
+    return summary
+
 #========================================================================================================================
 if overwrite_files == True:
     print("'overwrite_files' variable is set to True: Clobber parameter for Nicer tasks will be set to YES.\n")
@@ -79,24 +372,19 @@ else:
     
 # Create "commonFiles" directory for storing model files and flux graphs
 commonDirectory = outputDir + "/commonFiles"   # ~/NICER/analysis/commonFiles
-if Path(commonDirectory).exists() == False:
-    os.system("mkdir " + commonDirectory)
+if makeDirectory(commonDirectory) == False:
+    quit()
+
+# Dates and day/night GTIs read from the mkf files
+mkfCacheDirectory = commonDirectory + "/mkf_cache"
+mkfCacheVersion = 2   # Summaries cached by an older version of the script are read again
+makeDirectory(mkfCacheDirectory)
 
 # Create 22/05/2023 Nicer light leak date object
 lightLeak_date = "2023/05/22" 
 date_format = "%Y/%m/%d"
 lightleak_object = datetime.strptime(lightLeak_date, date_format)
 
-#Extract observation paths from observations.txt
-validPaths = []
-for line in inputFile.readlines():
-    line = line.replace(" ", "")
-    line = line.strip("\n")
-    if line != "" and Path(line).exists():
-        validPaths.append(line)
-
-inputFile.close()
-
 # If there is no valid observation path, do not proceed any further
 if len(validPaths) == 0:
     print("Could not find any observation directory to process.")
@@ -118,9 +406,7 @@ except:
 nigeodownFlag = True
 
 if Path("kp_potsdam.fits").exists() == False:
-    print("Running nigeodown...")
-    os.system("nigeodown chatter=5")
-    print("Finished nigeodown.")
+    runNigeodown()
     nigeodownFlag = False
 
 # Extract file creation date
@@ -134,7 +420,6 @@ geomag_time_object = geomag_time_object + timedelta(days=1)
 
 # Change directory back to the previous location
 os.chdir(cwd)
-import glob
 # This dictionary will carry obsid-(output directory, orbit time) key-value pairs for the observation made after the light leak
 lightleak_observations = {}
 
@@ -142,6 +427,9 @@ processed_paths = []
 
 valid_paths_v2 = []
 
+# mkf files of each observation, found once and passed to the workers
+mkfFilesOfObservation = {}
+
 # Iterate through the filter files of observations, extract date of each observation
 for obs in validPaths:
     #Find observation id (e.g. 6130010120)
@@ -158,47 +446,27 @@ for obs in validPaths:
         print(f"Observation {obsid} will not be processed.")
         continue
 
-    hdu = fits.open(matching_mkf_files[0])
-    date = hdu[1].header["DATE-OBS"]
-    date = date.replace("T", " ")
-    time_object = datetime.strptime(date, '%Y-%m-%d %H:%M:%S')
+    mkfSummary = scanMkf(matching_mkf_files[0], obsid)
+    if mkfSummary is None:
+        continue
+
+    time_object = datetime.strptime(mkfSummary["date"], '%Y-%m-%d %H:%M:%S')
 
     if nigeodownFlag and geomag_time_object < time_object:
         # Geomagnetic data is not updated for the current observation
         nigeodownFlag = False
-        print("Running nigeodown...")
-        os.system("nigeodown chatter=5")
-        print("Finished nigeodown.")
+        runNigeodown()
     
     if time_object > lightleak_object:
-        try:
-            sunshine = hdu[1].data["SUNSHINE"]
-        except Exception as e:
-            print(f"Exception occured while accessing 'SUNSHINE' column in mkf file: {e}")
-            continue
-
-        dayFlag = False
-        nightFlag = False
-        mixFlag = False
-        for val in sunshine:
-            if val == 1:
-                dayFlag = True
-            else:
-                nightFlag = True
-            
-            if dayFlag and nightFlag:
-                mixFlag = True
-                break
-        
+        dayFlag = mkfSummary["day"]
+        nightFlag = mkfSummary["night"]
+
         if dayFlag and (not nightFlag):
             # Day observation after light leak
             lightleak_observations[obsid] = [(outputDir + "/" + obsid + "/day", "day")]
 
             # Create the output directories if they are not created already
-            if Path(outputDir + "/" + obsid).exists() == False:
-                os.system("mkdir " + outputDir + "/" + obsid)
-            if Path(outputDir + "/" + obsid + "/day").exists() == False:
-                os.system("mkdir " + outputDir + "/" + obsid + "/day")
+            makeDirectory(outputDir + "/" + obsid + "/day")
 
             processed_paths.append([outputDir + "/" + obsid + "/day", obsid])
 
@@ -207,10 +475,7 @@ for obs in validPaths:
             lightleak_observations[obsid] = [(outputDir + "/" + obsid + "/night", "night")]
 
             # Create the output directories if they are not created already
-            if Path(outputDir + "/" + obsid).exists() == False:
-                os.system("mkdir " + outputDir + "/" + obsid)
-            if Path(outputDir + "/" + obsid + "/night").exists() == False:
-                os.system("mkdir " + outputDir + "/" + obsid + "/night")
+            makeDirectory(outputDir + "/" + obsid + "/night")
 
             processed_paths.append([outputDir + "/" + obsid + "/night", obsid])
 
@@ -219,25 +484,24 @@ for obs in validPaths:
             lightleak_observations[obsid] = [(outputDir + "/" + obsid + "/day", "day"), (outputDir + "/" + obsid + "/night", "night")]
 
             # Create the output directories if they are not created already
-            if Path(outputDir + "/" + obsid).exists() == False:
-                os.system("mkdir " + outputDir + "/" + obsid)
-            if Path(outputDir + "/" + obsid + "/night").exists() == False:
-                os.system("mkdir " + outputDir + "/" + obsid + "/night")
-            if Path(outputDir + "/" + obsid + "/day").exists() == False:
-                os.system("mkdir " + outputDir + "/" + obsid + "/day")
+            makeDirectory(outputDir + "/" + obsid + "/night")
+            makeDirectory(outputDir + "/" + obsid + "/day")
 
             processed_paths.append([outputDir + "/" + obsid + "/day", obsid])
             processed_paths.append([outputDir + "/" + obsid + "/night", obsid])
 
     else:
         # Observation before the light leak
-        if Path(outputDir + "/" + obsid).exists() == False:
-            os.system("mkdir " + outputDir + "/" + obsid)
+        makeDirectory(outputDir + "/" + obsid)
 
         processed_paths.append([outputDir + "/" + obsid, obsid])
     
     valid_paths_v2.append(obs)
+    mkfFilesOfObservation[obs] = matching_mkf_files
 
+# Every observation made before the light leak, and every day/night sub-directory of the observations made after the light leak,
+# is processed as an independent task
+pipelineTasks = []
 for obs in valid_paths_v2:
     #Find observation id (e.g. 6130010120)
     pathLocations = obs.split("/")
@@ -248,266 +512,111 @@ for obs in valid_paths_v2:
     
     if obsid not in lightleak_observations:
         # Observation made before the light leak
-        outObsDir = outputDir + "/" + obsid
-
-        # Create a log file to record the outputs of pipeline commands
-        pipelineLog = outObsDir + "/pipeline_output.log"
-        if Path(pipelineLog).exists() == False:
-            os.system("touch " + pipelineLog)
-
-        
-        clobber_parameter = "no"
-
-        if (overwrite_files == False):
-            os.system(f"rm -r {outObsDir}/*")
-        else:
-            clobber_parameter = "yes"
+        pipelineTasks.append((obs, obsid, outputDir + "/" + obsid, "", mkfFilesOfObservation[obs]))
+    else:
+        for obsTuple in lightleak_observations[obsid]:
+            pipelineTasks.append((obs, obsid, obsTuple[0], obsTuple[1], mkfFilesOfObservation[obs]))
 
-        matching_mkf_files = glob.glob(obs + "/auxil/ni*.mkf*")
-        for each_file in matching_mkf_files:
-            os.system(f"cp {each_file} {outObsDir}")
+workerCount = min(resolveWorkerCount(create_worker_count), len(pipelineTasks))
+if workerCount > 1:
+    print(f"{len(pipelineTasks)} observation directories will be processed by {workerCount} workers at the same time.")
+    print("Outputs of the pipeline commands are written to pipeline_output.log under each observation directory.\n")
 
-        # Run nicer pipeline commands
-        print("==============================================================================")
-        print("Starting to run pipeline commands for observation: " + obsid + "\n")
+taskSummaries = runInParallel(processObservation, pipelineTasks, workerCount)
 
-        # Run nicerl2
-        print("Running nicerl2...")
-        nicerl2 = "nicerl2 indir=" + obs + " mkfile='$CLDIR/ni$OBSID.mkf' clobber=" + clobber_parameter + " chatter=3 history=yes detlist=launch,-14,-34 filtcolumns=NICERV5 cldir=" + outObsDir + " > " + pipelineLog
-        try:
-            os.system(nicerl2)
-            print("Finished nicerl2.\n")
-        except Exception as e:
-            print(f"Exception occured while running nicerl2: {e}")
-            continue
+# Merge the summaries of all workers into a single summary file under commonFiles
+summaryLines = []
+print("==============================================================================")
+print("Summary of the pipeline commands:\n")
+for summary in taskSummaries:
+    obsName = summary["obsid"]
+    if summary["mode"] != "":
+        obsName += " (" + summary["mode"] + ")"
+
+    if summary["failed"] == "":
+        statusText = "finished"
+    else:
+        statusText = "failed at " + summary["failed"]
 
-        # Run nicerl3-spect
-        print("Running nicerl3-spect...")
-        nicerl3spect = "nicerl3-spect " + outObsDir + " mkfile='$CLDIR/ni$OBSID.mkf' clobber=" + clobber_parameter + " grouptype=optmin chatter=3 groupscale=10 bkgmodeltype=3c50 suffix=3c50 >> " + pipelineLog     
-        try:
-            os.system(nicerl3spect)
-            print("Finished nicerl3-spect.\n")
-        except Exception as e:
-            print(f"Exception occured while running nicerl3-spect: {e}")
-            continue
-        
-        # Run nicerl3-lc and create default resolution (1s) light curve
-        print("Running nicerl3-lc...")
-        nicerl3lc = "nicerl3-lc " + outObsDir + " mkfile='$CLDIR/ni$OBSID.mkf' clobber=" + clobber_parameter + " pirange=50-1000 chatter=4 timebin=1 suffix=_50_1000_dt0 >> " + pipelineLog 
-        try:
-            os.system(nicerl3lc)
-            print("Finished nicerl3-lc.")
-        except Exception as e:
-            print(f"Exception occured while running nicerl3-lc: {e}")
-            continue
+    if summary["skipped"] != "":
+        statusText = "skipped (" + summary["skipped"] + ")"
 
-        # Check whether the user wants to create high resolution light curves
-        if createHighResLightCurves:
-            for each in highResLcPiRanges:
-                each = each.replace(" ", "")
-                nicerl3lc = "nicerl3-lc " + outObsDir + " mkfile='$CLDIR/ni$OBSID.mkf' clobber=" + clobber_parameter + " pirange=" + str(each) + " timebin=" + str(2**highResLcTimeResInPwrTwo) +" suffix=_"+ str(each).replace("-", "_") + "_dt" + str(abs(highResLcTimeResInPwrTwo)).replace(".", "") + " >> " + pipelineLog
-                try:
-                    os.system(nicerl3lc)
-                except:
-                    print(f"Exception occured while running high resolution nicerl3-lc: {e}")
-                    break
+    summaryLine = obsName + ": " + statusText + " in " + format(summary["elapsed"], ".1f") + " s -> " + summary["directory"] + "/pipeline_output.log"
+    summaryLines.append(summaryLine + "\n")
+    print(summaryLine)
+print("==============================================================================")
 
-            print("Finished nicerl3-lc.\n")
+# When the observations are streamed by nicer_main.py, every instance of the script adds its own lines to the summary
+try:
+    with open(commonDirectory + "/pipeline_summary.log", "a" if streamRun else "w") as summaryFile:
+        for line in summaryLines:
+            summaryFile.write(line)
+except Exception as e:
+    print(f"Exception occured while writing to pipeline_summary.log file under commonFiles directory: {e}")
 
-        print("Please do not forget to check pipeline log file to detect potential issues that might have occured while creating output files.")
-        print("==============================================================================")
+# Extract the paths, obsid and exposure of observations with exposure >= minimum_exposure only. Directories skipped by the exposure
+# screening do not have a spectrum.
+# The headers of the spectra are read once and kept in the registry for the next scripts (see headerindex.py).
+skippedDirectories = [summary["directory"] for summary in taskSummaries if summary["skipped"] != ""]
+spectrumPaths = [each_path[0] + "/" + spectralFileNames(each_path[1])[0] for each_path in processed_paths if each_path[0] not in skippedDirectories]
+try:
+    registry = openRegistry(commonDirectory)
+    spectrumHeaders = lookupHeaders(registry, spectrumPaths)
+    registry.close()
+except Exception as e:
+    print(f"Exception occured while reading the headers of the spectrum files: {e}")
+    quit()
 
-        # Create log file for saving fit results that will be used by nicer_fit.py
-        fitLog = outObsDir +"/" + resultsFile
-        if Path(fitLog).exists() == False:
-            os.system("touch " + fitLog)
-    
-    else:
-        for obsTuple in lightleak_observations[obsid]:
-            outObsDir = obsTuple[0]
-            obsMode = obsTuple[1]
-
-            # Create a log file to record the outputs of pipeline commands
-            pipelineLog = outObsDir + "/pipeline_output.log"
-            if Path(pipelineLog).exists() == False:
-                os.system("touch " + pipelineLog)
-            
-            clobber_parameter = "no"
-
-            if (overwrite_files == False):
-                os.system(f"rm -r {outObsDir}/*")
-            else:
-                clobber_parameter = "yes"
-            
-            matching_mkf_files = glob.glob(obs + "/auxil/ni*.mkf*")
-            for each_file in matching_mkf_files:
-                os.system(f"cp {each_file} {outObsDir}")
-
-            if obsMode == "night":
-                threshRange = "'-3.0-3.0'"
-            else:
-                threshRange = "'32-38'"
-
-            # Run nicer pipeline commands
-            print("==============================================================================")
-            print("Starting to run pipeline commands for observation: " + obsid + "\n")
-
-            print("NOTICE: Observation " + obsid + " is made after the 22/05/2023 NICER optical light leak.")
-            print("Spectral files will be located under 'day' and 'night' sub-directories depending on the observation orbit time.")
-            print("Getting exposure=0 error especially for day-time observations is an expected result.")
-            print("Currently processing: " + obsMode + " time\n")
-
-            # Run nicerl2
-            print("Running nicerl2...")
-            nicerl2 = "nicerl2 indir=" + obs + " mkfile='$CLDIR/ni$OBSID.mkf' clobber=" + clobber_parameter + " chatter=3 history=yes detlist=launch,-14,-34 thresh_range=" + threshRange + " filtcolumns=NICERV5 cldir=" + outObsDir + " > " + pipelineLog
-            try:
-                os.system(nicerl2)
-                print("Finished nicerl2.\n")
-            except Exception as e:
-                print(f"Exception occured while running nicerl2: {e}")
-                continue
-
-            # Run nicerl3-spect
-            print("Running nicerl3-spect...")
-            nicerl3spect = "nicerl3-spect " + outObsDir + " mkfile='$CLDIR/ni$OBSID.mkf' clobber=" + clobber_parameter + " grouptype=optmin groupscale=10 bkgmodeltype=3c50 suffix=3c50 >> " + pipelineLog
-            try:
-                os.system(nicerl3spect)
-                print("Finished nicerl3-spect.\n")
-            except Exception as e:
-                print(f"Exception occured while running nicerl3-spect: {e}")
-                continue
-            
-            # Run nicerl3-lc and create default resolution (1s) light curve
-            print("Running nicerl3-lc...")
-            nicerl3lc = "nicerl3-lc " + outObsDir + " mkfile='$CLDIR/ni$OBSID.mkf' clobber=" + clobber_parameter + " pirange=50-1000 timebin=1 suffix=_50_1000_dt0 >> " + pipelineLog
-            try:
-                os.system(nicerl3lc)
-                print("Finished nicerl3-lc.\n")
-            except Exception as e:
-                print(f"Exception occured while running nicerl3-lc: {e}")
-                continue
-
-            # Check whether the user wants to create high resolution light curves
-            if createHighResLightCurves:
-                for each in highResLcPiRanges:
-                    each = each.replace(" ", "")
-                    nicerl3lc = "nicerl3-lc " + outObsDir + " mkfile='$CLDIR/ni$OBSID.mkf' clobber=" + clobber_parameter + " pirange=" + str(each) + " timebin=" + str(2**highResLcTimeResInPwrTwo) +" suffix=_"+ str(each).replace("-", "_") + "_dt" + str(abs(highResLcTimeResInPwrTwo)).replace(".", "") + " >> " + pipelineLog
-                    try:
-                        os.system(nicerl3lc)
-                    except Exception as e:
-                        print(f"Exception occured while running high resolution nicerl3-lc: {e}")
-                        break
-
-
-            print("Please do not forget to check pipeline log file to detect potential issues that might have occured while creating output files.")
-            print("==============================================================================")
-
-            # Create log file for saving fit results that will be used by nicer_fit.py
-            fitLog = outObsDir +"/" + resultsFile
-            if Path(fitLog).exists() == False:
-                os.system("touch " + fitLog)
-
-# Extract the paths, obsid and exposure of observations with exposure > 100 only.
 expo_processed_paths = []
 for each_path in processed_paths:
     folder_path = each_path[0]
     obsid = each_path[1]
 
-    try:
-        hdu = fits.open(folder_path + "/ni" + obsid + "mpu7_sr3c50.pha")
-    except Exception as e:
-        print(f"Exception occured while opening ni{obsid}mpu7_sr3c50.pha: {e}")
-        continue
-    try:
-        expo = hdu[1].header["EXPOSURE"]
-    except Exception as e:
-        print(f"Missing column 'EXPOSURE' in ni{obsid}mpu7_sr3c50.pha: {e}")
+    if folder_path in skippedDirectories:
         continue
 
-    if expo >= 100:
-        # Filter out observations with exposure less than 100 seconds
-        expo_processed_paths.append([folder_path, obsid, expo])
-    else:
-        print(f"Observation {obsid} has exposure below 100 seconds, spectral fitting will not be applied.")
-
-
-# Create processed_obs.txt that will serve as a log of the previously processed observations
-if Path(commonDirectory + "/processed_obs.txt").exists() == False:
-    os.system("touch " + commonDirectory + "/processed_obs.txt")
-
-
-if clean_obs_history == False:
-    all_file_lines = {}
-
-    file = open(commonDirectory + "/processed_obs.txt", "r")
-    all_lines = file.readlines()
-    file.close()
-
-    # Extract previously recorded paths
-    for line in all_lines:
-        line = line.strip("\n")
-        all_file_lines[line] = 1
-
-    # Add the exposure filtered paths into a single dictionary with the previous paths from processed_obs.txt
-    for each in expo_processed_paths:
-        path = each[0]
-        obsid = each[1]
-        expo = each[2]
-        line = path + " " + str(obsid) + " " + str(expo)
-
-        if line not in all_file_lines:
-            all_file_lines[line] = 1
-
-    # Convert the obsid value from int to string, and save all lines in a list of tuples
-    lines_to_be_sorted = []
-    for each_line in all_file_lines.keys():
-        each_line = each_line.split(" ")
-        each_line[1] = int(each_line[1])
-        each_line = tuple(each_line)
-
-        lines_to_be_sorted.append(each_line)
-
-    # Sort the tuples according to obsid values
-    sorted_lines = sorted(lines_to_be_sorted, key=lambda x: x[1])
-
-    # Convert the sorted tuples to a line format in string
-    lines_to_be_written = []
-    for line in sorted_lines:
-        line_str = ""
-
-        for elem in line:
-            line_str += (str(elem) + " ")
-        
-        line_str = line_str[:-1]
-        line_str += "\n"
-
-        lines_to_be_written.append(line_str)
+    headers = spectrumHeaders[folder_path + "/" + spectralFileNames(obsid)[0]]
+    if headers["valid"] == False:
+        print(f"Exception occured while opening ni{obsid}mpu7_sr3c50.pha: {headers['error']}")
+        continue
+    if headers["exposure"] is None:
+        print(f"Missing column 'EXPOSURE' in ni{obsid}mpu7_sr3c50.pha")
+        continue
 
-    # Rewrite the contents of the processed_obs.txt
-    file = open(commonDirectory + "/processed_obs.txt", "w")
-    for line in lines_to_be_written:
-        file.write(line)
+    expo = headers["exposure"]
+    mjd = headers["mjd"]
 
-    file.close()
+    if expo >= minimum_exposure:
+        # Filter out observations with exposure less than minimum_exposure seconds
+        expo_processed_paths.append([folder_path, obsid, expo, mjd])
+    else:
+        print(f"Observation {obsid} has exposure below {minimum_exposure:g} seconds, spectral fitting will not be applied.")
 
-else:
-    # The previous records of paths will not be kept
+# Register the exposure filtered observations in a single transaction. If clean_obs_history is True, the previous records are removed and only
+# the currently filtered observations are kept (nicer_main.py removes them once before streaming the observations).
+try:
+    registry = openRegistry(commonDirectory)
+    registerObservations(registry, [(obsid, modeOfPath(path), path, float(expo), mjd) for path, obsid, expo, mjd in expo_processed_paths], replaceAll=clean_obs_history and streamRun == False)
 
-    # Write the contents of the processed_obs.txt with only the currently filtered observations
-    file = open(commonDirectory + "/processed_obs.txt", "w")
-    for each in expo_processed_paths:
-        line = ""
+    createStatus = []
+    for summary in taskSummaries:
+        if summary["failed"] == "":
+            createStatus.append((summary["directory"], "done"))
+        else:
+            createStatus.append((summary["directory"], "failed at " + summary["failed"]))
+    setStageStatus(registry, createStatus, "create")
 
-        for elem in each:
-            line += (str(elem) + " ")
-        
-        line = line[:-1]
-        line += "\n"
+    # The screened exposure and the reason of every skipped directory are kept for later review
+    recordScreening(registry, [(summary["directory"], summary["obsid"], summary["exposure"], summary["exposure_source"], summary["skipped"])
+                               for summary in taskSummaries if summary["exposure_source"] != ""])
 
-        file.write(line)
-        
-    file.close()
+    # processed_obs.txt is kept as a readable export of the registry
+    exportProcessedObs(registry, commonDirectory + "/processed_obs.txt")
+    registry.close()
+    forgetObservations()
+except Exception as e:
+    print(f"Exception occured while updating the observation registry under commonFiles directory: {e}")
 
 # This file is created after importing variables from another python file
 if Path(scriptDir + "/__pycache__").exists():
-    os.system("rm -rf "+scriptDir+"/__pycache__")
\ No newline at end of file
+    removePath(scriptDir + "/__pycache__", recursive=True)
@@ -3,25 +3,27 @@
 # Contact: batuhan.bahceci@sabanciuniv.edu
 
 from parameter import *
-import operator
-
-operator_mapping = {
-    ">": operator.gt,
-    ">=": operator.ge,
-    "<": operator.lt,
-    "<=": operator.le,
-    "==": operator.eq,
-    "!=": operator.ne
-}
+from workers import runInParallel, resolveWorkerCount
+from pipeline import compilePipeline, operator_mapping
+from fitcache import fitCacheKey, storeFitResult, restoreFitResult, loadDigestIndex, saveDigestIndex
+from journal import journalFileName, recordEntry, readStage, startStage
+from filesystem import makeDirectory, removePath, removeMatching, clearDirectory, copyFile, atomicWrite
+from productstore import productStoreName, linkFromStore
+from registry import registryFileName, openRegistry, setStageStatus
+from resultstore import recordFitResults, readParameterFile, parameterFileLines
+from telemetry import telemetryFileName, startTelemetry, setObservation, countEvent, startSpan, finishSpan
+from headerindex import spectralFileNames, lookupHeaders
+from seeds import seedDirectoryName, seedFileName, recordSeed, findNeighbours, interpolateParameters, recordProvenance, clearSeeds
+from bootstrap import scriptDirectory, checkBoolean, checkWorkerCount, checkPositiveInteger, checkFloatBetween, readSearchedObsids, selectObsids, searchObservations
+import sys
+from xspec import *
+import numpy as np
 
 print("==============================================================================")
 print("\t\t\tRunning " + fit_script_name + "\n")
 
 # Find the script's own path
-scriptPath = os.path.abspath(__file__)
-scriptPathRev = scriptPath[::-1]
-scriptPathRev = scriptPathRev[scriptPathRev.find("/") + 1:]
-scriptDir = scriptPathRev[::-1]
+scriptDir = scriptDirectory(__file__)
 os.chdir(scriptDir)
 
 # Check if outputDir has been assigned to be a spesific directory or not
@@ -42,67 +44,38 @@ if Path(outputDir + "/commonFiles").exists() == False:
     quit()
 
 # Input check for restartAlways
-if isinstance(restartAlways, bool) == False:
-    while True:
-        print("\nThe 'restartAlways' variable is not of type boolean.")
-        restartAlways = input("Please enter a boolean value for 'restartAlways' (True/False): ")
-
-        if restartAlways == "True" or restartAlways == "False":
-            restartAlways = bool(restartAlways)
-            break
+restartAlways = checkBoolean("restartAlways", restartAlways)
 
 # Input check for restartOnce
-if isinstance(restartOnce, bool) == False:
-    while True:
-        print("\nThe 'restartOnce' variable is not of type boolean.")
-        restartOnce = input("Please enter a boolean value for 'restartOnce' (True/False): ")
-
-        if restartOnce == "True" or restartOnce == "False":
-            restartOnce = bool(restartOnce)
-            break
+restartOnce = checkBoolean("restartOnce", restartOnce)
 
 # Input check for ftestSignificance
-if isinstance(ftestSignificance, float) == False or not (0 < ftestSignificance < 1):
-    while True:
-        try:
-            ftestSignificance = float(ftestSignificance)
-            if ftestSignificance <= 0 or ftestSignificance >= 1:
-                raise Exception()
-            else:
-                break
-        except:
-            print("\nThe 'fTestSignificance' variable must be a float number between 0 and 1.")
-            ftestSignificance = input("Please enter a float number between 0 and 1 for 'ftestSignificance' (0 < x < 1): ")
+ftestSignificance = checkFloatBetween("ftestSignificance", ftestSignificance, 0, 1)
 
 # Input check for fix_sample_size
-if str(fix_sample_size).isnumeric() == False or int(fix_sample_size) <= 0:
-    while True:
-        print("\nEither the 'fix_sample_size' variable is not of type integer, or it is smaller or equal to 0.")
-        fix_sample_size = input("Please enter a positive integer value for 'fix_sample_size' (x > 0): ")
-
-        if fix_sample_size.isnumeric() and int(fix_sample_size) > 0:
-            fix_sample_size = int(fix_sample_size)
-            break
+fix_sample_size = checkPositiveInteger("fix_sample_size", fix_sample_size)
 
 # Input check for fix_parameters_after_sampling
-if isinstance(fix_parameters_after_sampling, bool) == False:
-    while True:
-        print("\nThe 'fix_parameters_after_sampling' variable is not of type boolean.")
-        fix_parameters_after_sampling = input("Please enter a boolean value for 'fix_parameters_after_sampling' (True/False): ")
-
-        if fix_parameters_after_sampling == "True" or fix_parameters_after_sampling == "False":
-            fix_parameters_after_sampling = bool(fix_parameters_after_sampling)
-            break
+fix_parameters_after_sampling = checkBoolean("fix_parameters_after_sampling", fix_parameters_after_sampling)
 
 # Input check for errorCalculations
-if isinstance(errorCalculations, bool) == False:
-    while True:
-        print("\nThe 'errorCalculations' variable is not of type boolean.")
-        errorCalculations = input("Please enter a boolean value for 'errorCalculations' (True/False): ")
+errorCalculations = checkBoolean("errorCalculations", errorCalculations)
 
-        if errorCalculations == "True" or errorCalculations == "False":
-            errorCalculations = bool(errorCalculations)
-            break
+# Input check for use_fit_cache
+use_fit_cache = checkBoolean("use_fit_cache", use_fit_cache)
+
+# Input check for use_telemetry
+use_telemetry = checkBoolean("use_telemetry", use_telemetry)
+
+# Input checks for use_warm_start and warm_start_interpolation
+use_warm_start = checkBoolean("use_warm_start", use_warm_start)
+warm_start_interpolation = checkBoolean("warm_start_interpolation", warm_start_interpolation)
+
+# Input check for fit_worker_count
+fit_worker_count = checkWorkerCount("fit_worker_count", fit_worker_count, "Please enter the number of observations to be fitted at the same time")
+
+# Input check for shakefit_worker_count
+shakefit_worker_count = checkWorkerCount("shakefit_worker_count", shakefit_worker_count, "Please enter the number of parameter errors to be calculated at the same time")
 
 # Input check for model_pipeline_name
 if model_pipeline_name == "":
@@ -196,6 +169,7 @@ def shakefit(bestModelList, resultsFile):
         fitModel(bestModelList)
         updateParameters(bestModel)
 
+        scanIndices = []
         for i in range(1, paramNum+1):
             parDelta = AllModels(1)(i).values[1]
 
@@ -205,40 +179,45 @@ def shakefit(bestModelList, resultsFile):
             if i not in parametersToCalculateError:
                 continue
 
-            continueError = True
-            delChi = 2.706
-            counter = 0
-            while continueError and counter < 100:
-                counter += 1
-                Fit.error("stopat 10 0.1 maximum 1000 " + str(delChi) + " " + str(i))
-                errorResult = AllModels(1)(i).error
-                errorString = errorResult[2]
-
-                if errorString[3] == "T" or errorString[4] == "T":
-                    # Hit lower/upper limits, stop the error process for the current model parameter
-                    continueError = False
-
-                if errorString[0] == "F":
-                    # Could not find a new minimum
-                    continueError = False
-                elif errorString[1] == "T":
-                    # Non-monotonicity detected
-                    delChi += 2
-
-                if continueError == False:
-                    # Save error calculation results to the log file
-                    # Save error calculation results to the log file
-                    parName = AllModels(1)(i).name
-                    parValue = AllModels(1)(i).values[0]
-                    parValue = AllModels(1)(i).values[0]
-                    errorTuple = "(" + listToStr(errorResult) + ")"
-                    resultsFile.write("Par " + str(i) + ": " + parName + " " + errorTuple+"\n")
-            
-        # Check if any parameter value has gotten outside their initially calculated confidence interval
+            scanIndices.append(i)
+
+        if min(resolveWorkerCount(shakefit_worker_count), len(scanIndices)) > 1:
+            scanResults = scanErrorsInParallel(scanIndices)
+        else:
+            scanResults = [scanParameterError((i, "")) for i in scanIndices]
+
+        # Results are merged in parameter order, whether they have been calculated serially or by the workers
+        for scan in scanResults:
+            i = scan["index"]
+            parameterErrors[i] = scan["error"]
+            countEvent("error_calls", scan["retries"])
+
+            if scan["finished"]:
+                # Save error calculation results to the log file
+                errorTuple = "(" + listToStr(scan["error"]) + ")"
+                resultsFile.write("Par " + str(i) + ": " + scan["name"] + " " + errorTuple+"\n")
+
+        # A worker may have found a better fit while scanning the error of its parameter. In that case, continue from the best
+        # of these fits, since the parameters of this session have not been changed by the workers.
         rerunShakefit = False
+        bestScan = None
+        for scan in scanResults:
+            if scan["values"] != [] and scan["statistic"] < Fit.statistic - 1e-3:
+                if bestScan is None or scan["statistic"] < bestScan["statistic"]:
+                    bestScan = scan
+
+        if bestScan is not None:
+            for m in range(1, paramNum+1):
+                if AllModels(1)(m).values[1] >= 0:
+                    AllModels(1)(m).values = bestScan["values"][m-1]
+            rerunShakefit = True
+            print("A better fit has been found during the error calculations. Rerunning shakefit...\n")
+            continue
+
+        # Check if any parameter value has gotten outside their initially calculated confidence interval
         for m in range(1, AllModels(1).nParameters+1):
             parValue = AllModels(1)(m).values[0]
-            errorString = AllModels(1)(m).error
+            errorString = parameterErrors.get(m, AllModels(1)(m).error)
             if errorString[0] != 0 and parValue < errorString[0]:
                 rerunShakefit = True
                 print("Some parameters are out of their previously calculated error boundaries. Rerunning shakefit...\n")
@@ -251,6 +230,75 @@ def shakefit(bestModelList, resultsFile):
     resultsFile.write("=================================================================\n\n")
     updateParameters(bestModel)
 
+def calculateParameterError(i):
+    # Runs Fit.error for the i'th parameter until the error calculation converges, increasing delta chi-squared while non-monotonicity
+    # is detected. Returns the error result, whether the calculation has finished, and the number of Fit.error calls.
+    continueError = True
+    delChi = 2.706
+    counter = 0
+    errorResult = AllModels(1)(i).error
+    while continueError and counter < 100:
+        counter += 1
+        Fit.error("stopat 10 0.1 maximum 1000 " + str(delChi) + " " + str(i))
+        errorResult = AllModels(1)(i).error
+        errorString = errorResult[2]
+
+        if errorString[3] == "T" or errorString[4] == "T":
+            # Hit lower/upper limits, stop the error process for the current model parameter
+            continueError = False
+
+        if errorString[0] == "F":
+            # Could not find a new minimum
+            continueError = False
+        elif errorString[1] == "T":
+            # Non-monotonicity detected
+            delChi += 2
+
+    return errorResult, (continueError == False), counter
+
+def scanParameterError(task):
+    # Calculates the error of a single parameter. 'stateFile' is the xcm file that carries the data and the best fitting model;
+    # when it is given, the state is restored before the calculation, so that every parameter starts from the same best fit
+    # even if the same worker has already scanned another parameter.
+    i, stateFile = task
+    scan = {"index": i, "values": [], "statistic": 0}
+
+    if stateFile != "":
+        # The xspec log file is inherited from the fit process, workers should not write into it
+        Xset.closeLog()
+        AllData.clear()
+        AllModels.clear()
+        Xset.restore(stateFile)
+        Fit.query = "no"
+
+    errorResult, finished, counter = calculateParameterError(i)
+    scan["error"] = errorResult
+    scan["finished"] = finished
+    scan["retries"] = counter
+    scan["name"] = AllModels(1)(i).name
+
+    if stateFile != "":
+        scan["statistic"] = Fit.statistic
+        scan["values"] = [AllModels(1)(m).values[0] for m in range(1, AllModels(1).nParameters+1)]
+
+    return scan
+
+def scanErrorsInParallel(scanIndices):
+    # Saves the current data and model to an xcm file, and calculates the errors of the given parameters in 'shakefit_worker_count'
+    # worker sessions restored from that file. The results are returned in the order of scanIndices.
+    stateFile = outObsDir + "/.shakefit_state_" + str(os.getpid()) + ".xcm"
+    if Path(stateFile).exists():
+        os.remove(stateFile)
+    Xset.save(stateFile, "a")
+
+    try:
+        scanResults = runInParallel(scanParameterError, [(i, stateFile) for i in scanIndices], shakefit_worker_count)
+    finally:
+        if Path(stateFile).exists():
+            os.remove(stateFile)
+
+    return scanResults
+
 def listToStr(array):
     result = ""
     for char in array:
@@ -286,6 +334,7 @@ def fitModel(bestModelList):
     Fit.delta = 0.01
     Fit.renorm()
     Fit.perform()
+    countEvent("fits")
     updateParameters(bestModelList)
 
 def updateParameters(modList):
@@ -311,32 +360,90 @@ def saveModel(fileName, location = "default"):
     # the model file will be saved under default (outObsDir) directory
     
     if location == "default":
-        xcmPath = Path(outObsDir + "/" + fileName)
-        if xcmPath.exists():
-            subprocess.run(["rm", outObsDir + "/" + fileName])
+        removePath(outObsDir + "/" + fileName)
 
         Xset.save(outObsDir + "/" + fileName, "m")
     else:
-        xcmPath = Path(location + "/" + fileName)
-        if xcmPath.exists():
-            subprocess.run(["rm", location + "/" + fileName])
+        # Model files under other locations (e.g. commonFiles) can be read by other fit workers at the same time. The model is saved
+        # to a temporary file first and then moved over the old file, so that the other workers never restore a half-written file.
+        tempFileName = location + "/.tmp" + str(os.getpid()) + "_" + fileName
+        Xset.save(tempFileName, "m")
+        os.replace(tempFileName, location + "/" + fileName)
+
+        if location == commonDirectory and use_warm_start:
+            saveSeed(fileName)
+
+def currentParameterValues():
+    # Returns the Xspec values of all parameters of the current model, with component.parameter names as keys
+    values = {}
+    for comp in AllModels(1).componentNames:
+        compObj = getattr(AllModels(1), comp)
+        for par in compObj.parameterNames:
+            values[comp + "." + par] = list(getattr(compObj, par).values)
+    return values
+
+def saveSeed(fileName):
+    # Keeps the model saved to commonFiles as a seed of the current observation, so that the observations close in time can start from it
+    seedFile = seedFileName(seedDirectory, outObsDir, obsid, fileName)
+    tempFileName = seedDirectory + "/.tmp" + str(os.getpid()) + "_" + fileName
+
+    try:
+        Xset.save(tempFileName, "m")
+        os.replace(tempFileName, seedFile)
+
+        registry = openRegistry(commonDirectory)
+        recordSeed(registry, outObsDir, obsid, observationDate, fileName, seedFile, currentParameterValues())
+        registry.close()
+    except Exception as e:
+        print(f"WARNING: The model of observation {obsid} could not be saved as a seed for the other observations: {e}")
+
+def warmStart(bestModelList, modelfile):
+    # Loads the seed of the nearest observation in time that has been fitted with the same model components. If there are seeds on both
+    # sides and warm_start_interpolation is True, the free parameters are set to the values interpolated between them.
+    # Returns False if there is no seed to start from.
+    try:
+        registry = openRegistry(commonDirectory)
+        before, after = findNeighbours(registry, outObsDir, observationDate, modelfile)
+        registry.close()
+    except Exception as e:
+        print(f"WARNING: Could not search the seeds of the other observations: {e}")
+        return False
 
-        Xset.save(location + "/" + fileName, "m")
+    if before is None and after is None:
+        return False
+
+    neighbours = [seed for seed in [before, after] if seed is not None]
+    nearest = min(neighbours, key=lambda seed: abs(seed["mjd"] - observationDate))
+
+    updateParameters(bestModelList)
+    Xset.restore(nearest["seed_file"])
+
+    entry = {"modfile": modelfile, "method": "nearest", "sources": [nearest["obsid"]], "distance": abs(nearest["mjd"] - observationDate)}
+    if warm_start_interpolation and len(neighbours) == 2 and after["mjd"] > before["mjd"]:
+        for fullName, value in interpolateParameters(before, after, observationDate).items():
+            compName, parName = fullName.split(".")
+            try:
+                getattr(getattr(AllModels(1), compName), parName).values = value
+            except Exception:
+                pass
+
+        entry = {"modfile": modelfile, "method": "interpolated", "sources": [before["obsid"], after["obsid"]], "distance": entry["distance"]}
+
+    print(f"Starting from the {entry['method']} seed of observation(s) {', '.join(entry['sources'])} ({entry['distance']:.3f} days away)")
+    logFile.write(f"Seed of {modelfile}: {entry['method']} from {', '.join(entry['sources'])} ({entry['distance']:.3f} days away)\n")
+    seedProvenance.append(entry)
+    return True
 
 def saveData(location = "default"):
     # Similar to saveModel function, this function saves the data instead of model in an xcm file
     if location == "default":
         fileName = outObsDir + "/" + "data_" + obsid + ".xcm"
-        filePath = Path(fileName)
-        if filePath.exists():
-            subprocess.run(["rm", fileName])
+        removePath(fileName)
         Xset.save(fileName, "f")
 
     else:
         fileName = location + "/" + "data_" + obsid + ".xcm"
-        filePath = Path(fileName)
-        if filePath.exists():
-            subprocess.run(["rm", fileName])
+        removePath(fileName)
         Xset.save(fileName, "f")
 
 def writeBestFittingModel(resultsFile):
@@ -598,6 +705,7 @@ def calculateGaussEqw(logFile):
 
             try:
                 AllModels.eqwidth(counter, err=True, number=1000, level=90)
+                countEvent("draws", 1000)
                 eqwList.append("Equivalent width: " + str(listToStr(AllData(1).eqwidth)) + " (" + str(format(energyVal, ".2f")) + " keV gauss)\n")
             except Exception as e:
                 eqwList.append("Calculating eqw failed for component: " + comp + "\n")
@@ -618,21 +726,6 @@ def fixAllParameters(fixedValues):
 
         parObj.values = fixedValues[key]
 
-def filterOutliers(dataset):
-    # Here I use Z-Score algorithm to filter out the outliers of the dataset
-    # I saw that 3 sigma was commonly used for filtering outliers in this method, but since I will be filtering out nH values and we do not expect nH values to change
-    # that drastically, I narrowed down the interval and set the z-score as 2 sigma.
-    mean = np.mean(dataset)
-    std_dev = np.std(dataset)
-    threshold = 3
-
-    filtered_dataset = []
-    for i in dataset:
-        if std_dev == 0 or (abs(i - mean) / std_dev <= threshold):
-            filtered_dataset.append(i)
-    
-    return filtered_dataset
-
 def closeAllFiles():
     print("\nClosing all files..")
     logFile.close()
@@ -676,6 +769,9 @@ def assignTxtParameters(parameterList):
 def searchPremodel(bestModelList, path = ""):
     modelfile = extractModFileName()
     foundFile = False
+    if path == "" and use_warm_start and warmStart(bestModelList, modelfile):
+        return
+
     if path == "":
         path = outputDir + "/commonFiles"
         print("\nLooking for a model file '" + modelfile + "' under '" + path + "'")
@@ -699,6 +795,9 @@ def searchPremodel(bestModelList, path = ""):
     if foundFile == False:
         print("Could not find the target model file under '" + path + "'")
 
+    if path == commonDirectory:
+        seedProvenance.append({"modfile": modelfile, "method": "premodel" if foundFile else "none", "sources": [], "distance": None})
+
 def saveCommand(saveType):
     print("Saving requested xcm file as type: " + saveType)
     modelName = extractModFileName()
@@ -740,932 +839,944 @@ def calculateComponentOrder(compName, targetName):
 
     return compCount + 1
 
-def parseTxt(source, bestModelList, nullhypList, logFile, enableFixing):
-    sourcefile = open(source, "r")
-    lines = sourcefile.readlines()
+def orderSuffixOf(number):
+    if number == 1:
+        return "st"
+    elif number == 2:
+        return "nd"
+    elif number == 3:
+        return "rd"
+    else:
+        return "th"
 
-    if_stack = []
+def runLoad(command, state):
+    loadModel(command.expression)
 
-    currentModel = ""
-    lastAddedModel = ""
-    lastAddedModelNumber = 0
-    orderSuffix = ""
+def runAssign(command, state):
+    if command.useLast:
+        parameterList = [(compName, state["lastAddedModelNumber"], parTuple) for compName, compNum, parTuple in command.assignments]
+    else:
+        parameterList = command.assignments
 
-    lineCount = 0
-    for line in lines:
-        lineCount += 1
-        #===============    Preprocess the line    =======================
-        line = line.strip("\n\t ")
+    assignTxtParameters(parameterList)
 
-        if len(line) == 0:
-            continue
-        
-        if line[0] == "#":
-            continue
-        
-        line = line.split(" ")
-
-        # Remove the spaces in the line
-        idx_counter = 0
-        while idx_counter < len(line):
-            if (line[idx_counter] == ""):
-                line.pop(idx_counter)
-            else:
-                idx_counter += 1
-        #=======================================
-                
-        try:
-            if line[0].lower() == "model":
-                if line[1] == model_pipeline_name:
-                    # Found the target model name
-                    if currentModel == "":
-                        # First time encountering that model name, start processing the model
-                        currentModel = model_pipeline_name
-                        continue
-                    else:
-                        # A model pipeline has been defined before, but the current line tries to define another pipeline
-                        raise Exception("Trying to process another model pipeline, probably due to not using ENDMODEL keyword.")
+def runSearch(command, state):
+    if command.path != "":
+        searchPremodel(state["bestModelList"], command.path)
+    else:
+        searchPremodel(state["bestModelList"])
 
-        except Exception as e:
-            print(f"Exception occured: {e}")
-            print("\nERROR: Invalid implementation for a pipeline name in models.txt -> Line: " + str(lineCount))
-            quit()
+    if state["enableFixing"][0]:
+        fixAllParameters(fixedValues)
 
-        if currentModel != model_pipeline_name:
-            # If the current pipeline does not match
-            continue
-            
-        if line[0].lower() == "endmodel":
-            # End of model pipeline
-            return True
-        
-        # Enter if we are currently in an if statement
-        if len(if_stack) != 0:
-            if line[0] == "if":
-                # There is a nested if statement coming up. If current if statement is evaluated to False, no need to check inner if statements.
-                # If that is the case, evaluate all upcoming if statements to False. If not, pass this step and move onto if evaluation block.
-                if if_stack[-1] == False:
-                    if_stack.append(False)
-                    continue
-
-            elif line[0] == "endif":
-                # End of inner if statement is reached.
-                if_stack.pop()
-                continue
+def runFit(command, state):
+    fitModel(state["bestModelList"])
 
-            else:
-                # It is another command. If the innermost if statement is evaluated to False, skip it.
-                if if_stack[-1] == False:
-                    continue
+def runSave(command, state):
+    saveCommand(command.saveType)
 
-        try:
-            if line[0] == "load":
-                modelName = ""
-                for par in line[1:]:
-                    modelName += par
+def runFtest(command, state):
+    if command.option == "nullhyp":
+        ftestOptions("nullhyp", state["bestModelList"], state["nullhypList"], state["logFile"], state["lastAddedModel"], state["lastAddedModelNumber"], state["orderSuffix"])
+        return
 
-                loadModel(modelName)
-                continue
-        except Exception as e:
-            print(f"Exception occured while loading model: {e}")
-            print("\nERROR: Invalid implementation of 'load' command in models.txt -> Line: " + str(lineCount))
-            quit()
-          
-        try:
-            if line[0] == "assign":
-                if line[1] == "-last":
-                    parameterList = []
-                    for eachPar in line[2:]:
-                        temp = eachPar.split(":")
-                        compName = temp[0].split(".")[0]
-                        parName = temp[0].split(".")[1]
-                        parValue = temp[1]
-
-                        parameterList.append((compName, lastAddedModelNumber, (parName, parValue)))
-                        
-                    assignTxtParameters(parameterList)
+    if state["lastAddedModel"] == "":
+        raise Exception("You must use addcomp to add models before using f-test")
 
-                    continue
-                else:
-                    parameterList = []
-                    for eachPar in line[1:]:
-                        if eachPar[0] == "(":
-                            bracketIdx = eachPar.find(")")
-                            compNum = int(eachPar[1:bracketIdx])
-
-                            temp = eachPar.split(":")
-                            fullName = temp[0][bracketIdx+1:]
-                            compName = fullName.split(".")[0]
-                            parName = fullName.split(".")[1]
-                            parValue = temp[1]
-
-                            parameterList.append((compName, compNum, (parName, parValue)))
-                        else:
-                            compNum = 1
-                            temp = eachPar.split(":")
-                            compName = temp[0].split(".")[0]
-                            parName = temp[0].split(".")[1]
-                            parValue = temp[1]
-
-                            parameterList.append((compName, compNum, (parName, parValue)))
-                        
-                    assignTxtParameters(parameterList)
+    ftestOptions("perform", state["bestModelList"], state["nullhypList"], state["logFile"], state["lastAddedModel"], state["lastAddedModelNumber"], state["orderSuffix"], command.infoTxt)
 
-                    continue
+    state["lastAddedModelNumber"] = 0
+    state["lastAddedModel"] = ""
 
-        except Exception as e:
-            print(f"Exception occured while running 'assign' command: {e}")
-            print("\nERROR: Invalid implementation of 'assign' command in models.txt -> Line: " + str(lineCount))
-            quit()
-        
-        try:
-            if line[0] == "search" and line[1] == "premodel":
-                if len(line) > 2:
-                    modelString = ""
-                    for i in line[2:]:
-                        modelString += i
-                    if modelString[-1] == "/":
-                        modelString = modelString[:-1]
-                
-                    searchPremodel(bestModelList, modelString)
-                else:
-                    searchPremodel(bestModelList)
+def runAddcomp(command, state):
+    state["lastAddedModel"] = command.compName
+    state["lastAddedModelNumber"] = calculateComponentOrder(command.compName, command.targetComp)
+    addComp(command.compName, command.targetComp, command.placement, command.calcChar, state["bestModelList"], command.encapsulate)
+    state["orderSuffix"] = orderSuffixOf(state["lastAddedModelNumber"])
 
-                if enableFixing[0]:
-                    fixAllParameters(fixedValues)
-                    
-                continue
-        except Exception as e:
-            print(f"Exception occured while running 'search' command: {e}")
-            print("\nERROR: Invalid implementation of 'search' command in models.txt -> Line: " + str(lineCount))
-            quit()               
-        
-        try:
-            if line[0] == "fit":
-                fitModel(bestModelList)
-                continue
-        except Exception as e:
-            print(f"Exception occured while running 'fit' command: {e}")
-            print("\nERROR: Invalid implementation of 'fit' command in models.txt -> Line: " + str(lineCount))
-            quit()
-        
-        try:
-            if line[0] == "save":
-                if line[1] == "model":
-                    saveCommand("model")
-                elif line[1] == "data":
-                    saveCommand("data")
-                else:
-                    raise Exception("Invalid parameter for the 'save' command")
+def runDelcomp(command, state):
+    removeComp(command.compName, command.compNum, state["bestModelList"])
 
-                continue
+def runSetpoint(command, state):
+    if state["enableFixing"][0]:
+        print("\nAll parameters spesified by 'fix_parameters_after_sampling' have now been fixed.")
+        fixAllParameters(fixedValues)
 
-        except Exception as e:
-            print(f"Exception occured: {e}")
-            print("\nERROR: Invalid implementation of 'save' command in models.txt -> Line: " + str(lineCount))
-            quit()
-        
-        try:
-            if line[0] == "ftest":
-                if line[1] == "nullhyp" or line[1] == "null" or line[0] == "nullhypothesis":
-                    ftestOptions("nullhyp", bestModelList, nullhypList, logFile, lastAddedModel, lastAddedModelNumber, orderSuffix)
-                    continue
-
-                elif line[1] == "perform":
-                    if lastAddedModel == "":
-                        raise Exception("You must use addcomp to add models before using f-test")
-                        
-                    if len(line) > 2:
-                        newStr = " ".join(line[2:])
-                        if (newStr[0] != "\"" and newStr[0] != "'") or (newStr[-1] != "\"" and newStr[-1] != "'") or (newStr[0] != newStr[-1]):
-                            raise Exception("Invalid parameter entry for 'ftest' command")
-                        
-                        else:
-                            newStr = newStr[1:-1]
-                            ftestOptions("perform", bestModelList, nullhypList, logFile, lastAddedModel, lastAddedModelNumber, orderSuffix, newStr)
+def runShakefit(command, state):
+    shakefit(state["bestModelList"], state["logFile"])
 
-                            lastAddedModelNumber = 0
-                            lastAddedModel = ""
-                            continue
+def evaluateIf(command):
+    if command.checkModel:
+        modelExists = command.target in AllModels(1).componentNames
+        if command.condition == "exists":
+            return modelExists
+        else:
+            return not modelExists
+
+    compObj = getattr(AllModels(1), command.target[0])
+    parObj = getattr(compObj, command.target[1])
+    lhs = float(parObj.values[0])
+
+    operatorText, rhs = command.condition
+    return operator_mapping[operatorText](lhs, rhs)
+
+commandRunners = {
+    "load": runLoad,
+    "assign": runAssign,
+    "search": runSearch,
+    "fit": runFit,
+    "save": runSave,
+    "ftest": runFtest,
+    "addcomp": runAddcomp,
+    "delcomp": runDelcomp,
+    "setpoint": runSetpoint,
+    "shakefit": runShakefit
+}
 
-                    ftestOptions("perform", bestModelList, nullhypList, logFile, lastAddedModel, lastAddedModelNumber, orderSuffix)
+def runPipeline(pipeline, bestModelList, nullhypList, logFile, enableFixing):
+    # Executes the commands of the compiled model pipeline on the currently loaded spectrum. The pipeline has already been
+    # validated by compilePipeline(), so only the errors coming from PyXspec can occur here.
+    state = {
+        "bestModelList": bestModelList,
+        "nullhypList": nullhypList,
+        "logFile": logFile,
+        "enableFixing": enableFixing,
+        "lastAddedModel": "",
+        "lastAddedModelNumber": 0,
+        "orderSuffix": ""
+    }
+
+    commands = pipeline.commands
+    counter = 0
+    while counter < len(commands):
+        command = commands[counter]
+        counter += 1
 
-                    lastAddedModelNumber = 0
-                    lastAddedModel = ""
-                    continue
-                else:
-                    raise Exception("\nCannot process anything related to ftest unless a model is defined first.")
-                
-        except Exception as e:
-            print(f"Exception occured: {e}")
-            print("\nERROR: Invalid implementation of 'ftest' command in models.txt -> Line: " + str(lineCount))
-            quit()
-        
         try:
-            if line[0] == "addcomp" or line[0] == "addc":
-                if len(line) == 6:
-                    if line[5] == "-wrap":
-                        # addcomp edge after TBabs *
-                        lastAddedModel = line[1]
-                        lastAddedModelNumber = calculateComponentOrder(line[1], line[3])
-                        addComp(line[1], line[3], line[2], line[4], bestModelList, True)
-                        
-                        if lastAddedModelNumber == 1:
-                            orderSuffix = "st"
-                        elif lastAddedModelNumber == 2:
-                            orderSuffix = "nd"
-                        elif lastAddedModelNumber == 3:
-                            orderSuffix = "rd"
-                        else:
-                            orderSuffix = "th"
-                        continue
-                    else:
-                        raise Exception("Invalid input for the the optional 'wrap' parameter.")
-
-                elif len(line) > 6:
-                    raise Exception("addcomp function takes 6 parameters at maximum, more than 6 inputs were given.")
-                
-                lastAddedModel = line[1]
-                lastAddedModelNumber = calculateComponentOrder(line[1], line[3])
-                addComp(line[1], line[3], line[2], line[4], bestModelList)
-
-                if lastAddedModelNumber == 1:
-                    orderSuffix = "st"
-                elif lastAddedModelNumber == 2:
-                    orderSuffix = "nd"
-                elif lastAddedModelNumber == 3:
-                    orderSuffix = "rd"
-                else:
-                    orderSuffix = "th"
-                continue
-        
+            if command.name == "if":
+                if evaluateIf(command) == False:
+                    # Skip to the command after the matching endif
+                    counter = command.jump
+            else:
+                span = startSpan(command.name, line=command.lineNumber, stat_before=currentStatistic())
+                commandRunners[command.name](command, state)
+                finishSpan(span, stat_after=currentStatistic())
         except Exception as e:
-            print(f"Exception occured: {e}")
-            print("\nERROR: Invalid implementation of 'addcomp' command in models.txt -> Line: " + str(lineCount))
+            print(f"Exception occured while running '{command.name}' command: {e}")
+            print("\nERROR: Invalid implementation of '" + command.name + "' command in models.txt -> Line: " + str(command.lineNumber))
             quit()
-        
-        try:
-            if line[0] == "if":
-                if line[1] == "model":
-                    if line[3].lower() == "exists":
-                        model_name = line[2]
 
-                        if model_name in AllModels(1).componentNames:
-                            if_stack.append(True)
-                        else:
-                            if_stack.append(False)
+def currentStatistic():
+    # Fit statistic of the current model, or None if there is no model loaded yet
+    try:
+        return Fit.statistic
+    except Exception:
+        return None
 
-                    elif line[3].lower() == "missing":
-                        model_name = line[2]
+def removeModelFiles():
+    print("Removing all model files under '" + commonDirectory + "'\n")
+    removeMatching(commonDirectory + "/mod*")
 
-                        if model_name in AllModels(1).componentNames:
-                            if_stack.append(False)
-                        else:
-                            if_stack.append(True)
+    try:
+        registry = openRegistry(commonDirectory)
+        clearSeeds(registry, seedDirectory)
+        registry.close()
+    except Exception as e:
+        print(f"WARNING: Seeds under '{seedDirectory}' could not be removed: {e}")
 
-                    else:
-                        raise Exception("Unknown parameter for checking models. Enter either 'missing' or 'exists'.")
-                else:
-                    fullName = line[1].split(".")
-                    compObj = getattr(AllModels(1), fullName[0])
-                    parName = fullName[1]
-                    parObj = getattr(compObj, parName)
-                    parValue = parObj.values[0]
-
-                    lhs = float(parValue)
-                    rhs = float(line[3])
-                    actualOperator = operator_mapping.get(line[2])
-
-                    result = actualOperator(lhs, rhs)
-                    if result:
-                        if_stack.append(True)
-                    else:
-                        if_stack.append(False)
-                    
-                continue
-        except Exception as e:
-            print(f"Exception occured: {e}")
-            print("\nERROR: Invalid implementation of 'if' command in models.txt -> Line: " + str(lineCount))
-            quit()
-        
-        try:
-            if line[0] == "delc" or line[0] == "delcomp":
-                if line[1][0] == "(":
-                    closingIdx = int(line[1].find(")"))
-                    compNum = line[1][1:closingIdx]
+def allocateResultsLocation(outObsDir):
+    # Creates the folder for the next version of the fit results of an observation, and returns its path.
+    # Returns an empty string if the version counter of the observation could not be read or updated.
+    results_folder = outObsDir + "/results"
 
-                    removeComp(line[1][closingIdx +1:], int(compNum), bestModelList)
-                    continue
+    if makeDirectory(results_folder) == False:
+        return ""
 
-                removeComp(line[1], 1, bestModelList)
-                continue
-        except Exception as e:
-            print(f"Exception occured while running 'delcomp' command: {e}")
-            print("\nERROR: Invalid implementation of 'delcomp' command in models.txt -> Line: " + str(lineCount))
-            quit()
-        
-        try:
-            if line[0] == "setpoint":
-                if line[1] == "fix":
-                    if enableFixing[0]:
-                        print("\nAll parameters spesified by 'fix_parameters_after_sampling' have now been fixed.")
-                        fixAllParameters(fixedValues)
-                        continue
-                    else:
-                        continue
-        except Exception as e:
-            print(f"Exception occured while running 'setpoint' command: {e}")
-            print("\nERROR: Invalid implementation of 'setpoint' command in models.txt -> Line: " + str(lineCount))
-            quit()
-        
-        try:
-            if line[0] == "shakefit":
-                shakefit(bestModelList, logFile)
-        except Exception as e:
-            print(f"Exception occured while running 'shakefit' command: {e}")
-            print("\nERROR: Invalid implementation of 'shakefit' command in models.txt -> Line: " + str(lineCount))
-            quit()
+    if clean_result_history:
+        clearDirectory(results_folder)
+    
+    if Path(results_folder + "/version_counter.txt").exists() == False:
+        if atomicWrite(results_folder + "/version_counter.txt", ["CREATED BY NICER_FIT.PY, DO NOT MODIFY, DO NOT CHANGE THE FILE PATH\n", "1\n"]) == False:
+            return ""
         
-        while (True):
-            print("\nUndefined command in current line: '" + " ".join(line) + "' (Line "+ str(lineCount) +")")
-            userInput = input("The line will not be executed. Would you like to continue executing the script ? (y/n): ")
-            print()
-            if userInput.lower() == "n":
-                print("Terminating the script..")
-                quit()
-            elif userInput.lower() == "y":
-                print("Continuing to the script..")
-                break
+    all_lines = []
+    try:
+        with open(results_folder + "/version_counter.txt") as version_file:
+            all_lines = version_file.readlines()
+            version = int(all_lines[1].strip("\n"))
+    except Exception as e:
+        print(f"Exception occured opening the file {results_folder}/version_counter.txt: {e}")
+        return ""
+
+    # The counter is replaced in one step, so that a crash can not leave a half-written counter behind
+    if atomicWrite(results_folder + "/version_counter.txt", [all_lines[0], str(version + 1) + "\n"]) == False:
+        return ""
     
-    return False
+    output_save_name = custom_name
+    if output_save_name == "":
+        output_save_name = model_pipeline_name
+
+    results_location = results_folder + "/" + output_save_name + "_" + str(version)
+    removePath(results_location, recursive=True)
+    if makeDirectory(results_location) == False:
+        return ""
+
+    return results_location
+
+def prepareObservation(path, obsid, exposure):
+    # Runs the steps that do not need PyXspec in the main process: finds the spectral files, creates the results folder
+    # for the current version and reads the date of the observation. Returns the task that will be sent to a fit worker,
+    # or None if the observation cannot be fitted.
+    outObsDir = path
+
+    if Path(outObsDir).exists() == False:
+        print(f"Directory {outObsDir} of observation {obsid} could not be found.")
+        return None
+
+    # Find the spectrum, background, arf and response files
+    spectrumFile, backgroundFile, arfFile, rmfFile = spectralFileNames(obsid)
+
+    foundSpectrum = Path(outObsDir + "/" + spectrumFile).exists()
+    foundBackground = Path(outObsDir + "/" + backgroundFile).exists()
+    foundArf = Path(outObsDir + "/" + arfFile).exists()
+    foundRmf = Path(outObsDir + "/" + rmfFile).exists()
+
+    # Check if there are any missing files
+    if not (foundSpectrum and foundBackground and foundArf and foundRmf):
+        print("ERROR: Necessary files for spectral fitting are missing for the observation: " + obsid)
+        if foundSpectrum == False:
+            print("Missing spectrum file")
+        if foundBackground == False:
+            print("Missing background file")
+        if foundArf == False:
+            print("Missing arf file")
+        if foundRmf == False:
+            print("Missing rmf file")
+        return None
+    
+    print("All the necessary spectral files are found for observation " + obsid + ". Please check if the correct files are in use.")
+    print("Spectrum file:", spectrumFile)
+    print("Background file:", backgroundFile)
+    print("Arf file:", arfFile)
+    print("Rmf file:", rmfFile, "\n")
+
+    #==========================================================================================
+    # Check whether the headers of the spectral files could be read, from the header index filled before preparing the observations
+    for eachFile in [spectrumFile, backgroundFile, arfFile, rmfFile]:
+        headers = spectralHeaders.get(outObsDir + "/" + eachFile)
+        if headers is None or headers["valid"] == False:
+            print(f"Exception occured opening the file {eachFile}: {headers['error'] if headers is not None else 'headers have not been read'}")
+            return None
+
+    # Date of observation in MJD
+    date = spectralHeaders[outObsDir + "/" + spectrumFile]["mjd"]
+    if date is None:
+        print(f"Exception occured while reading 'MJD-OBS' from {spectrumFile}: keyword not found")
+        return None
+
+    task = {
+        "path": outObsDir,
+        "obsid": obsid,
+        "exposure": exposure,
+        "date": date,
+        "results_location": "",
+        "spectrumFile": spectrumFile,
+        "backgroundFile": backgroundFile,
+        "arfFile": arfFile,
+        "rmfFile": rmfFile
+    }
+
+    #==========================================================================================
+    # If the run is being resumed, continue with the version of the previous run instead of creating a new one
+    entry = fitJournal.get(outObsDir)
+    if entry is not None and Path(entry["results_location"]).exists():
+        if entry["status"] == "done":
+            print("Observation " + obsid + " has already been fitted by the previous run, its results under " + entry["results_location"] + " will be kept.\n")
+            task["results_location"] = entry["results_location"]
+            task["journalResult"] = entry["result"]
+            return task
+        elif entry["status"] == "sampled":
+            task["results_location"] = entry["results_location"]
+            task["journalSample"] = entry["result"]
+            return task
+
+    if entry is not None:
+        # The previous run has stopped before finishing this observation, remove its partial results and fit it again under the same version
+        results_location = entry["results_location"]
+        print("Removing the partial results of observation " + obsid + " under " + results_location + "\n")
+        removePath(results_location, recursive=True)
+        if makeDirectory(results_location) == False:
+            return None
+    else:
+        # Create the correct version of outputs
+        results_location = allocateResultsLocation(outObsDir)
+        if results_location == "":
+            return None
+
+    recordEntry(journalPath, "fit", outObsDir, "allocated", results_location=results_location)
+
+    # The spectral files are only read by Xspec, so the results folders only hold links to a single stored copy of each file
+    for eachFile in [spectrumFile, backgroundFile, arfFile, rmfFile]:
+        if linkFromStore(productStoreDirectory, outObsDir + "/" + eachFile, results_location + "/" + eachFile, digestIndex) == False:
+            return None
+
+    task["results_location"] = results_location
+    return task
+
+def sampleFixedParameters(exposure):
+    # Returns the current values of the parameters listed in 'parametersToFix', paired with the exposure of the observation
+    samples = {}
+    for eachPar in parametersToFix:
+        fullName = eachPar
+        eachPar = eachPar.split(".")
+        compName = eachPar[0]
+        parName = eachPar[1]
+        if compName in AllModels(1).expression:
+            compObj = getattr(AllModels(1), compName)
+            parObj = getattr(compObj, parName)
+            samples[fullName] = (parObj.values[0], float(exposure))
+        else:
+            print("\n" + compName + " is not included in the model expression for observation " + obsid)
+            print("There will not be any value added to the sample for calculating parameter average for " + fullName)
 
-#===================================================================================================================
-try:
-    energyLimits = energyFilter.split(" ")
-    Emin = energyLimits[0]
-    Emax = energyLimits[1]
-except Exception as e:
-    print(f"Exception occured while reading 'energyLimits' variable due to incorrect format: {e}")
-    quit()
+    return samples
 
-allDir = os.listdir(outputDir)
-commonDirectory = outputDir + "/commonFiles"   # ~/NICER/analysis/commonFiles
-
-# Initializing required variables/dictionaries in case fix_parameters_after_sampling is set to True.
-fixedValues = {}
-takeAverages = False
-startFixingParameters = [False]
-if fix_parameters_after_sampling:
-    takeAverages = True
+def calculateFixedValues(sampleResults):
+    # Takes the average of the sampled parameter values coming from the three longest exposures, and returns them in a dictionary
+    # that can be passed to fixAllParameters()
+    sampledValues = {}
+    for result in sampleResults:
+        if result["status"] != "sampled":
+            continue
 
-# If both restartOnce and restartAlways are set to True, set restartAlways to False.
-if restartOnce:
-    restartAlways = False
+        for fullName, valueExposurePair in result["sampled"].items():
+            if fullName not in sampledValues:
+                sampledValues[fullName] = [valueExposurePair]
+            else:
+                sampledValues[fullName].append(valueExposurePair)
 
-# Switch on/off chatter
-if chatterOn == False:
-    print("Chatter has been disabled.\n") 
-    Xset.chatter = 0
+    averages = {}
+    for fullName in parametersToFix:
+        if fullName not in sampledValues:
+            print("\n" + fullName + " is not included in the model expression of any sampled observation.")
+            print("There will not be any parameter fixing applied for this parameter.")
+            continue
 
-# Set the correct path for the model_file
-model_file = scriptDir + "/" + model_file
+        parPairs = {}
+        for parValue, expoValue in sampledValues[fullName]:
+            if expoValue in parPairs:
+                parPairs[expoValue].append(parValue)
+            else:
+                parPairs[expoValue] = [parValue]
+        
+        sortedPairs = {key: parPairs[key] for key in sorted(parPairs, reverse=True)}
 
-searchedObsid = []
-try:
-    with open(scriptDir + "/" + inputTxtFile, "r") as file:
-        allLines = file.readlines()
-        for line in allLines:
-            line = line.replace(" ", "")
-            line = line.strip("\n")
-            if line != "" and Path(line).exists():
-                if line[-1] != "/":
-                    slashIdx = line.rfind("/")
-                    obsid = line[slashIdx+1 :]
-                else:
-                    slashIdx = line[:-1].rfind("/")
-                    obsid = line[slashIdx+1:-1]
-                
-                searchedObsid.append(obsid)
-except Exception as e:
-    print(f"Exception occured while opening {inputTxtFile}: {e}")
-    quit()
+        countPar = 0
+        totalParValue = 0
 
-if len(searchedObsid) == 0:
-    print("\nCould not find any valid observation path given in the observations.txt file.")
-    quit()
+        try:
+            print("Taking the average of " + fullName + " values:")
+            keyList = list(sortedPairs.keys())
+            valueList = list(sortedPairs.values())
+            for i in range(3):
+                for j in range(len(valueList[i])):
+                    print(fullName + " value:", valueList[i][j], "from an observation with exposure:", keyList[i])
+                    totalParValue += valueList[i][j]
+                    countPar += 1
+        except:
+            print("\nWARNING: Average " + fullName + " values will be calculated using data from less than 3 observations.\n")
+        
+        avgPar = totalParValue / countPar
+        averages[fullName] = str(avgPar) + " -1"
+        print(fullName + " has been fixed to the value:", avgPar, "\n")
+
+    return averages
+
+def removeBestModelFiles(allFiles):
+    # Remove any pre-existing best model files under the current observation directory
+    for eachFile in allFiles:
+        if "best_" in eachFile:
+            removePath(eachFile)
+
+def spectralFilesOf(task):
+    return [task["spectrumFile"], task["backgroundFile"], task["arfFile"], task["rmfFile"]]
+
+def startingPointDigest():
+    # Digest of the model files under commonFiles as they are when a fit pass starts. 'search premodel' starts the fits from these files,
+    # so a result is only restored if the fit that produced it has started from the same files (e.g. from none, after restartOnce).
+    # The seeds of the warm start are a part of the starting point as well.
+    modelFiles = sorted([fileName for fileName in os.listdir(commonDirectory) if fileName.startswith("mod")])
+
+    seeds = []
+    if use_warm_start:
+        registry = openRegistry(commonDirectory)
+        seeds = registry.execute("SELECT path, modfile, mjd, parameters FROM seeds ORDER BY path, modfile").fetchall()
+        registry.close()
+
+    return fitCacheKey([commonDirectory + "/" + fileName for fileName in modelFiles], " ".join(modelFiles), {"seeds": seeds}, digestIndex)
+
+def fitCacheKeyOf(task, startingPoint):
+    # Everything that changes the outcome of a fit has to be a part of the key, otherwise a stale result could be restored
+    settings = {
+        "restartOnce": restartOnce,
+        "restartAlways": restartAlways,
+        "startingPoint": startingPoint,
+        "obsid": task["obsid"],
+        "sampling": task["sampling"],
+        "fixParameters": task["fixParameters"],
+        "fixedValues": task["fixedValues"],
+        "energyFilter": energyFilter,
+        "xspec_abundance": xspec_abundance,
+        "ftestSignificance": ftestSignificance,
+        "errorCalculations": errorCalculations,
+        "parametersForShakefit": parametersForShakefit,
+        "parametersToFix": parametersToFix,
+        "checkPowerlawErrorAndFreeze": checkPowerlawErrorAndFreeze,
+        "powerlawIndexToFreezeAt": powerlawIndexToFreezeAt,
+        "use_warm_start": use_warm_start,
+        "warm_start_interpolation": warm_start_interpolation
+    }
+    spectralFiles = [task["path"] + "/" + eachFile for eachFile in spectralFilesOf(task)]
+
+    return fitCacheKey(spectralFiles, modelPipeline.signature(), settings, digestIndex)
+
+def storeInFitCache(task, result, observationFiles):
+    # Saves the results of a finished fit to the fit cache. A failure here only costs a refit the next time, so it is not fatal.
+    if task.get("cacheKey") is None:
+        return
+
+    results_location = task["results_location"]
+    resultsFiles = []
+    for eachFile in os.listdir(results_location):
+        if eachFile not in spectralFilesOf(task):
+            resultsFiles.append(results_location + "/" + eachFile)
+
+    existingFiles = []
+    for eachFile in observationFiles:
+        if Path(outObsDir + "/" + eachFile).exists():
+            existingFiles.append(outObsDir + "/" + eachFile)
+
+    cachedResult = dict(result)
+    cachedResult["results_location"] = results_location
 
-iterationMax = 0
-searchedObservations = []
-if Path(commonDirectory + "/processed_obs.txt").exists() == False:
-    print("\nCould not find 'processed_obs.txt' file under the 'commonFiles' directory.")
-    print("Please make sure both the 'commonFiles' directory and the 'processed_obs.txt' files exist and are constructed as intended by nicer_create.py.\n")
-    quit()
-else:
     try:
-        with open(commonDirectory + "/processed_obs.txt", "r") as filteredFile:
-            allLines = filteredFile.readlines()
-            for eachObsid in searchedObsid:
-                for line in allLines:
-                    line = line.strip("\n")
-                    lineElements = line.split(" ")
-
-                    if lineElements[1] == eachObsid:
-                        iterationMax += 1
-                        searchedObservations.append((lineElements[0], lineElements[1], lineElements[2]))
+        storeFitResult(fitCacheDirectory, task["cacheKey"], cachedResult, resultsFiles, existingFiles)
     except Exception as e:
-        print(f"Exception occured while opening processed_obs.txt: {e}")
-        quit()
+        print(f"WARNING: Fit results of observation {obsid} could not be saved to the fit cache: {e}")
 
-if len(searchedObservations) == 0:
-    print("\nCould not find the searched observation paths in 'processed_obs.txt', most likely due to having low exposure.")
-    quit()
+def restoreFromFitCache(task):
+    # Copies the cached fit results of an observation into its new results folder. Returns None if the observation is not in the cache.
+    if task.get("cacheKey") is None:
+        return None
 
-if iterationMax > fix_sample_size:
-    iterationMax = fix_sample_size
+    outObsDir = task["path"]
+    if task["sampling"] == False:
+        removeBestModelFiles([outObsDir + "/" + eachFile for eachFile in os.listdir(outObsDir)])
 
-try:
-    chi_file = open(commonDirectory + "/reduced_chi.log", "w")
-    chi_file.write(model_pipeline_name + "\n")
-except Exception as e:
-    print(f"Exception occured while writing to reduced_chi.log file under commonFiles directory: {e}")
-    quit()
+    try:
+        result = restoreFitResult(fitCacheDirectory, task["cacheKey"], task["results_location"], outObsDir)
+    except Exception as e:
+        print(f"WARNING: Cached fit results of observation {task['obsid']} could not be restored, it will be fitted again: {e}")
+        return None
 
-version_dictionary = {}
+    if result is None:
+        return None
 
-for x in range(2):
-    current_chi = 0
-    current_dof = 0
+    # Share the best model with the other observations, just like a fitted observation does
+    if result.get("modFileName") is not None and Path(outObsDir + "/" + result["modFileName"]).exists():
+        copyFile(outObsDir + "/" + result["modFileName"], commonDirectory)
 
-    iteration = 0
-    for path, obsid, exposure in searchedObservations:
-        iteration += 1
+    result["path"] = outObsDir
+    result["date"] = task["date"]
+    result["cached"] = True
 
-        print("=============================================================================================")
-        print("Starting the fitting procedure for observation:", obsid)
-        if startFixingParameters[0]:
-            print("Fixing nH parameters: TRUE\n")
-        else:
-            print("Fixing nH parameters: FALSE\n")
+    return result
+
+def fitAndRecord(task):
+    # Fits the observation and records the outcome to the campaign journal as soon as it is finished
+    setObservation(task["obsid"])
+    span = startSpan("observation")
+    result = fitObservation(task)
+    finishSpan(span, status=result["status"])
+    recordEntry(journalPath, "fit", task["path"], result["status"], results_location=task["results_location"], result=result)
+    return result
 
-        outObsDir = path
+def runFitPass(tasks):
+    # Takes the observations finished by the resumed run and the ones found in the fit cache, and sends only the remaining ones to the
+    # fit workers. The results are returned in the same order as tasks.
+    results = [None] * len(tasks)
+    pendingIndices = []
 
+    startingPoint = ""
+    if use_fit_cache:
         try:
-            os.chdir(outObsDir)
+            startingPoint = startingPointDigest()
         except Exception as e:
-            print(f"Exception occured while trying to change directory to {outObsDir}: {e}")
+            print(f"WARNING: Model files under {commonDirectory} could not be read for the fit cache: {e}")
+
+    for i, task in enumerate(tasks):
+        journaledResult = task.get("journalResult")
+        if journaledResult is None and task["sampling"]:
+            journaledResult = task.get("journalSample")
+
+        if journaledResult is not None:
+            results[i] = journaledResult
             continue
 
-        allFiles = os.listdir(outObsDir)
+        if use_fit_cache:
+            try:
+                task["cacheKey"] = fitCacheKeyOf(task, startingPoint)
+            except Exception as e:
+                print(f"WARNING: Fit cache key of observation {task['obsid']} could not be calculated: {e}")
+                task["cacheKey"] = None
+
+            # restartAlways asks for every observation to be fitted from scratch, so its results are only stored in the cache
+            if restartAlways == False:
+                results[i] = restoreFromFitCache(task)
+            if results[i] is not None:
+                print("Fit results of observation " + task["obsid"] + " have been restored from the fit cache.")
+                recordEntry(journalPath, "fit", task["path"], results[i]["status"], results_location=task["results_location"], result=results[i])
+                continue
 
-        # Find the spectrum, background, arf and response files
-        foundSpectrum = False
-        foundBackground = False
-        foundArf = False
-        foundRmf = False
-        missingFiles = True
+        pendingIndices.append(i)
 
-        if Path("ni"+obsid+"mpu7_sr3c50.pha").exists():
-            spectrumFile = "ni"+obsid+"mpu7_sr3c50.pha"
-            foundSpectrum = True
+    if use_fit_cache:
+        print(f"\n{len(tasks) - len(pendingIndices)} of {len(tasks)} observations have been restored from the fit cache, {len(pendingIndices)} will be fitted.\n")
 
-        if Path("ni" + obsid + "mpu7_bg3c50.pha").exists():
-            backgroundFile = "ni" + obsid + "mpu7_bg3c50.pha"
-            foundBackground = True
+    # Observations are fitted in the order of their dates, so that each fit can start from the seeds of the observations just before it
+    if use_warm_start:
+        pendingIndices.sort(key=lambda i: tasks[i]["date"])
 
-        if Path("ni" + obsid + "mpu73c50.arf").exists():
-            arfFile = "ni" + obsid + "mpu73c50.arf"
-            foundArf = True
+    pendingResults = runInParallel(fitAndRecord, [tasks[i] for i in pendingIndices], workerCount)
+    for i, result in zip(pendingIndices, pendingResults):
+        results[i] = result
 
-        if Path("ni" + obsid + "mpu73c50.rmf").exists():
-            rmfFile = "ni" + obsid + "mpu73c50.rmf"
-            foundRmf= True
+    return results
 
-        if foundSpectrum and foundBackground and foundArf and foundRmf:
-            # All necessary files have been found
-            missingFiles = False
-        
-        # Check if there are any missing files
-        if missingFiles:
-            print("ERROR: Necessary files for spectral fitting are missing for the observation: " + obsid)
-            if foundSpectrum == False:
-                print("Missing spectrum file")
-            if foundBackground == False:
-                print("Missing background file")
-            if foundArf == False:
-                print("Missing arf file")
-            if foundRmf == False:
-                print("Missing rmf file")
-            continue
-        
-        print("All the necessary spectral files are found. Please check if the correct files are in use.")
-        print("Spectrum file:", spectrumFile)
-        print("Background file:", backgroundFile)
-        print("Arf file:", arfFile)
-        print("Rmf file:", rmfFile, "\n")
+def fitObservation(task):
+    # Fits a single observation using the model pipeline. This function is run by the fit workers, and each worker process owns
+    # its own PyXspec session. The variables used by the other functions (outObsDir, obsid, logFile...) are therefore set as
+    # globals of the worker process. The results that the main process needs are returned in a dictionary.
+    global outObsDir, obsid, logFile, xspec_output_file, bestModel, fixedValues, startFixingParameters, parameterErrors, observationDate, seedProvenance
 
-        results_location = ""
+    outObsDir = task["path"]
+    obsid = task["obsid"]
+    exposure = task["exposure"]
+    results_location = task["results_location"]
+    fixedValues = task["fixedValues"]
+    startFixingParameters = [task["fixParameters"]]
 
-        #==========================================================================================
-        # Create the correct version of outputs
-        if outObsDir not in version_dictionary:
-            results_folder = outObsDir + "/results"
+    observationDate = task["date"]
+    seedProvenance = []
 
-            if Path(results_folder).exists() == False:
-                os.system("mkdir " + results_folder)
+    result = {"obsid": obsid, "path": outObsDir, "date": task["date"], "status": "failed", "seeds": seedProvenance}
 
-            if clean_result_history:
-                os.system("rm -r " + results_folder + "/*")
-            
-            if Path(results_folder + "/version_counter.txt").exists() == False:
-                os.system("touch " + results_folder + "/version_counter.txt")
-
-                try:
-                    with open(results_folder + "/version_counter.txt", "w") as version_file:
-                        version_file.write("CREATED BY NICER_FIT.PY, DO NOT MODIFY, DO NOT CHANGE THE FILE PATH\n")
-                        version_file.write("1\n")
-                except Exception as e:
-                    print(f"Exception occured trying to write to file {results_folder}/version_counter.txt: {e}")
-                    continue
-                
-            
-            all_lines = []
-            try:
-                with open(results_folder + "/version_counter.txt") as version_file:
-                    all_lines = version_file.readlines()
-                    version = int(all_lines[1].strip("\n"))
-            except Exception as e:
-                print(f"Exception occured opening the file {results_folder}/version_counter.txt: {e}")
-                continue
+    print("=============================================================================================")
+    print("Starting the fitting procedure for observation:", obsid)
+    if startFixingParameters[0]:
+        print("Fixing nH parameters: TRUE\n")
+    else:
+        print("Fixing nH parameters: FALSE\n")
 
-            try:
-                with open(results_folder + "/version_counter.txt", "w") as version_file:
-                    version_file.write(all_lines[0])
-                    version_file.write(str(version + 1) + "\n")
-            except Exception as e:
-                print(f"Exception occured trying to write to file {results_folder}/version_counter.txt: {e}")
-                continue
-            
-            output_save_name = custom_name
-            if output_save_name == "":
-                output_save_name = model_pipeline_name
+    try:
+        os.chdir(outObsDir)
+    except Exception as e:
+        print(f"Exception occured while trying to change directory to {outObsDir}: {e}")
+        return result
 
-            results_location = results_folder + "/" + output_save_name + "_" + str(version)
-            if Path(results_location).exists():
-                os.system("rm -r " + results_location)
+    allFiles = os.listdir(outObsDir)
 
-            os.system("mkdir " + results_location)
+    if restartAlways:
+        removeModelFiles()
 
-            version_dictionary[outObsDir] = results_location
-        else:
-            results_location = version_dictionary[outObsDir]
-        
-        # Location of log file that saves fit results
-        fit_file_loc = results_location + "/" + resultsFile
-        xspec_output_file = results_location + "/xspec_output.log"
-
-        os.system("cp " + spectrumFile + " " + results_location)
-        os.system("cp " + backgroundFile + " " + results_location)
-        os.system("cp " + arfFile + " " + results_location)
-        os.system("cp " + rmfFile + " " + results_location)
-        #==========================================================================================
-        # Check whether the spectral files can be opened successfully or not
-        try:
-            hdu = fits.open(spectrumFile)
-            hdu.close()
-        except Exception as e:
-            print(f"Exception occured opening the file {spectrumFile}: {e}")
-            continue
+    # Location of log file that saves fit results
+    fit_file_loc = results_location + "/" + resultsFile
+    xspec_output_file = results_location + "/xspec_output.log"
 
-        try:
-            hdu = fits.open(backgroundFile)
-            hdu.close()
-        except Exception as e:
-            print(f"Exception occured opening the file {backgroundFile}: {e}")
-            continue
+    #==========================================================================================  
+    # From now on, PyXspec will be utilized for fitting and comparing models
+    
+    # Set some Xspec settings
+    try:
+        logFile = open(fit_file_loc, "w")
+    except Exception as e:
+        print(f"Exception occured while opening {fit_file_loc}: {e}")
+        return result
 
-        try:
-            hdu = fits.open(arfFile)
-            hdu.close()
-        except Exception as e:
-            print(f"Exception occured opening the file {arfFile}: {e}")
-            continue
+    Xset.openLog(xspec_output_file)
+    try:
+        Xset.abund = xspec_abundance
+    except Exception as e:
+        print(f"Exception occured while setting xspec abundance: {e}")
+        quit()
 
-        try:
-            hdu = fits.open(rmfFile)
-            hdu.close()
-        except Exception as e:
-            print(f"Exception occured opening the file {rmfFile}: {e}")
-            continue
-        #==========================================================================================
+    Fit.query = "no"
 
-        # Date of observation in MJD
-        hdu = fits.open(spectrumFile)
-        date = hdu[1].header["MJD-OBS"]
+    logFile.write("OBSERVATION ID: " + obsid + "\n\n")
 
-        #==========================================================================================
+    # Load the necessary files
+    s1 = Spectrum(dataFile=task["spectrumFile"], arfFile=task["arfFile"], respFile=task["rmfFile"], backFile=task["backgroundFile"])
+    Plot.xAxis = "keV"
+    AllData.ignore("bad")
 
-        if restartOnce and iteration == 1:
-            print("Removing all model files under '" + commonDirectory + "'\n")
-            os.system("rm " + commonDirectory + "/mod*")
-        elif restartAlways:
-            print("Removing all model files under '" + commonDirectory + "'\n")
-            os.system("rm " + commonDirectory + "/mod*")
+    try:
+        AllData(1).ignore("**-" + Emin + " " + Emax +"-**")
+    except Exception as e:
+        print(f"Exception occured while setting the energy filter due to incorrect format: {e}")
+        quit()
 
-        #==========================================================================================  
-        # From now on, PyXspec will be utilized for fitting and comparing models
-        
-        # Set some Xspec settings
-        try:
-            logFile = open(fit_file_loc, "w")
-        except Exception as e:
-            print(f"Exception occured while opening {fit_file_loc}: {e}")
+    saveData(results_location)
+    
+    # Lists that will store parameter values throughout the script
+    bestModel = [{}, {}]
+    nullhypList = [{}, {}]
 
-        Xset.openLog(xspec_output_file)
-        try:
-            Xset.abund = xspec_abundance
-        except Exception as e:
-            print(f"Exception occured while setting xspec abundance: {e}")
-            quit()
+    # Error results calculated by shakefit, with parameter indices as keys
+    parameterErrors = {}
+    
+    # Run the commands of the compiled model pipeline
+    runPipeline(modelPipeline, bestModel, nullhypList, logFile, startFixingParameters)
+    
+    #========================================================================================================================================
+    # Record the values of the parameters to be fixed if the current observation belongs to the sample taken for fix_parameters_after_sampling
+    if task["sampling"]:
+        result["sampled"] = sampleFixedParameters(exposure)
 
-        Fit.query = "no"
+        writeBestFittingModel(logFile)
 
-        logFile.write("OBSERVATION ID: " + obsid + "\n\n")
+        modFileName = extractModFileName()
+        # Remove any pre-existing best model files and save a new one
+        removeBestModelFiles(allFiles)
+        saveModel("best_" + modFileName, results_location)
 
-        # Load the necessary files
-        s1 = Spectrum(dataFile=spectrumFile, arfFile=arfFile, respFile=rmfFile, backFile=backgroundFile)
-        Plot.xAxis = "keV"
-        AllData.ignore("bad")
+        result["chi"] = Fit.statistic
+        result["dof"] = Fit.dof
 
-        try:
-            AllData(1).ignore("**-" + Emin + " " + Emax +"-**")
-        except Exception as e:
-            print(f"Exception occured while setting the energy filter due to incorrect format: {e}")
-            quit()
+        closeAllFiles()
 
-        saveData(results_location)
-        
-        # Lists that will store parameter values throughout the script
-        bestModel = [{}, {}]
-        nullhypList = [{}, {}]
-        
-        # Parse the txt file and start processing the commands within
-        foundTargetModel = parseTxt(model_file, bestModel, nullhypList, logFile, startFixingParameters)
+        print("Parameters from observation '" + obsid + "' have been saved.")
+        result["status"] = "sampled"
+        storeInFitCache(task, result, [])
+        return result
+
+    #========================================================================================================================================
+    # Calculate uncertainity boundaries
+    if errorCalculations:
+        shakefit(bestModel, logFile)
+
+    # Save the last model
+    print("Writing the best model parameters to " + fit_file_loc + "...")
+    modFileName = extractModFileName()
+    writeBestFittingModel(logFile)
+
+    print("Saving the best model xspec file...\n")
+    saveModel(modFileName)
+    saveModel(modFileName, commonDirectory)
+    #==========================================================================
+    result["errors"] = {}
+    result["parameters"] = []
+    if errorCalculations:
+        # Save parameter information as (name, unit, value, lower boundary, upper boundary) tuples, which are recorded to the results table
+        # by the main process and written to the parameter file below
+        for comp in AllModels(1).componentNames:
+            compObj = getattr(AllModels(1), comp)
+            for par in compObj.parameterNames:
+                parObj = getattr(compObj, par)
+                parName = parObj.name
+                parValue = parObj.values[0]
+                index = parObj.index
+                fullName = comp + "." + parName
 
-        if foundTargetModel == False:
-            print("\nModel pipeline identifier '" + model_pipeline_name + "' could not be found.")
-            quit()
-        
-        #========================================================================================================================================
-        # Start recording nH values if fix_parameters_after_sampling is set to True.
-        if iteration < iterationMax and takeAverages:
-            for eachPar in parametersToFix:
-                fullName = eachPar
-                eachPar = eachPar.split(".")
-                compName = eachPar[0]
-                parName = eachPar[1]
-                if compName in AllModels(1).expression:
-                    compObj = getattr(AllModels(1), compName)
-                    parObj = getattr(compObj, parName)
-                    parVal = parObj.values[0]
-
-                    valueExposurePair = str(parVal) + "," + str(exposure)
-                    if fullName not in fixedValues:
-                        fixedValues[fullName] = [valueExposurePair]
-                    else:
-                        fixedValues[fullName].append(valueExposurePair)
-                else:
-                    print("\n" + compName + " is not included in the model expression for observation " + obsid)
-                    print("There will not be any value added to the sample for calculating parameter average for " + fullName)
-                    continue
+                if fullName in parametersForShakefit:
+                    errorResult = parameterErrors.get(index, AllModels(1)(index).error)
+                    errorString = errorResult[2]
                     
-            writeBestFittingModel(logFile)
-
-            modFileName = extractModFileName()
-            # Remove any pre-existing best model files and save a new one
-            for eachFile in allFiles:
-                if "best_" in eachFile:
-                    os.system("rm " + eachFile)
+                    lowerBound = errorResult[0]
+                    upperBound = errorResult[1]
+                    if lowerBound == 0:
+                        lowerBound = parValue
+                    
+                    if upperBound == 0:
+                        upperBound = parValue
 
-            saveModel("best_" + modFileName, results_location)
+                    result["errors"][fullName] = (lowerBound, upperBound, errorString)
 
-            current_chi = Fit.statistic
-            current_dof = Fit.dof
+                    if parametersForShakefit[fullName] == "X":
+                        parLabel = fullName
+                    else:
+                        parLabel = parametersForShakefit[fullName].replace("_", " ")
+                    result["parameters"].append((parLabel, "", parValue, lowerBound, upperBound))
+        
+        # Create parameter files that will be used by nicer_plot for creating parameter graphs
+        outputParameterFile = outObsDir + "/parameters_bestmodel.txt"
+        print("Creating", outputParameterFile, "file that will carry the necessary data for creating parameter graphs...\n")
 
+        # Write the parameter information from list to the parameter file
+        if atomicWrite(outputParameterFile, parameterFileLines(result["parameters"])) == False:
             closeAllFiles()
+            return result
+    #===========================================================================
+    # Remove any pre-existing best model files and save a new one
+    removeBestModelFiles(allFiles)
+    saveModel("best_" + modFileName, results_location)
+    saveModel("best_" + modFileName)
+    saveData()
+
+    # Calculate and write equivalent widths of gausses to log file
+    print("Calculating equivalence widths for gaussians in model expression...\n")
+    span = startSpan("eqwidth")
+    calculateGaussEqw(logFile)
+    finishSpan(span)
+
+    result["chi"] = Fit.statistic
+    result["dof"] = Fit.dof
+    result["bestModel"] = bestModel[0]
+    result["expression"] = AllModels(1).expression
+    result["modFileName"] = modFileName
+
+    # Close all log files
+    closeAllFiles()
+
+    # Write an xspec script for analyzing parameter values along with linear-data and residual plots quickly
+    file = open(results_location + "/xspec_bestmod_script.xcm", "w")
+    file.write("@" + results_location + "/data_" + obsid + ".xcm\n")
+    file.write("@"+ results_location +"/best_" + modFileName + "\n")
+    file.write("cpd /xw\n")
+    file.write("setpl e\n")
+    file.write("fit\n")
+    file.write("pl ld chi\n")
+    file.write("show par\n")
+    file.write("show fit\n")
+    file.write("echo OBSID:" + obsid + "\n")
+    file.close()
+
+    result["status"] = "done"
+    storeInFitCache(task, result, ["parameters_bestmodel.txt", modFileName, "best_" + modFileName, "data_" + obsid + ".xcm"])
+    return result
 
-            print("Parameters from observation '" + obsid + "' have been saved.")
-            continue
+#===================================================================================================================
+try:
+    energyLimits = energyFilter.split(" ")
+    Emin = energyLimits[0]
+    Emax = energyLimits[1]
+except Exception as e:
+    print(f"Exception occured while reading 'energyLimits' variable due to incorrect format: {e}")
+    quit()
 
-        elif iteration >= iterationMax and takeAverages:
-            for eachPar in parametersToFix:
-                fullName = eachPar
-                eachPar = eachPar.split(".")
-                compName = eachPar[0]
-                parName = eachPar[1]
-                if compName in AllModels(1).expression:
-                    compObj = getattr(AllModels(1), compName)
-                    parObj = getattr(compObj, parName)
-                    parVal = parObj.values[0]
-
-                    valueExposurePair = str(parVal) + "," + str(exposure)
-                    if fullName not in fixedValues:
-                        fixedValues[fullName] = [valueExposurePair]
-                    else:
-                        fixedValues[fullName].append(valueExposurePair)
-                else:
-                    print("\n" + compName + " is not included in the model expression for observation " + obsid)
-                    print("There will not be any value added to the sample for calculating parameter average for " + fullName)
-                    continue
-            
-            print("Parameters from observation '" + obsid + "' have been saved.")
-            print("=============================================================================================")
-            print("Collecting the sample for calculating parameter averages is now finished.")
-            print("Values from three observations with longest exposures will be used for fixing the target parameters.\n")
-            print()
-
-            startFixingParameters.pop()
-            startFixingParameters.append(True)
-            takeAverages = False
-
-            for eachPar in parametersToFix:
-                fullName = eachPar
-                eachPar = eachPar.split(".")
-                compName = eachPar[0]
-                parName = eachPar[1]
-                if compName in AllModels(1).expression:
-                    compObj = getattr(AllModels(1), compName)
-                    parObj = getattr(compObj, parName)
-                    parVal = parObj.values[0]
-                    
-                    parPairs = {}
-                    for pair in fixedValues[fullName]:
-                        parValue = float(pair.split(",")[0])
-                        expoValue = float(pair.split(",")[1])
-                        if expoValue in parPairs:
-                            parPairs[expoValue].append(parValue)
-                        else:
-                            parPairs[expoValue] = [parValue]
-                    
-                    sortedPairs = {key: parPairs[key] for key in sorted(parPairs, reverse=True)}
+allDir = os.listdir(outputDir)
+commonDirectory = outputDir + "/commonFiles"   # ~/NICER/analysis/commonFiles
+fitCacheDirectory = commonDirectory + "/fit_cache"
+productStoreDirectory = commonDirectory + "/" + productStoreName
+seedDirectory = commonDirectory + "/" + seedDirectoryName
+if makeDirectory(seedDirectory) == False:
+    quit()
 
-                    countPar = 0
-                    totalParValue = 0
+# With '--resume', observations finished by the previous run are not fitted again, and the ones it has left unfinished are fitted
+# again under the same version. The previous run must have used the same parameter.py settings.
+resumeRun = "--resume" in sys.argv[1:]
+journalPath = commonDirectory + "/" + journalFileName
+fitJournal = {}
 
-                    try:
-                        print("Taking the average of " + fullName + " values:")
-                        keyList = list(sortedPairs.keys())
-                        valueList = list(sortedPairs.values())
-                        for i in range(3):
-                            for j in range(len(valueList[i])):
-                                print(fullName + " value:", valueList[i][j], "from an observation with exposure:", keyList[i])
-                                totalParValue += valueList[i][j]
-                                countPar += 1
-                    except:
-                        print("\nWARNING: Average " + fullName + " values will be calculated using data from less than 3 observations.\n")
-                    
-                    avgPar = totalParValue / countPar
-                    fixedValues[fullName] = str(avgPar) + " -1"
-                    print(fullName + " has been fixed to the value:", avgPar, "\n")
-                else:
-                    print("\n" + compName + " is not in the current model expression.")
-                    print("There will not be any parameter fixing applied for this model.")
+# nicer_main.py runs this script for single observations with '--stream --obsid <obsid>', while other observations are fitted by other
+# instances of the script. The journal is then started by nicer_main.py, which also removes the partial results and the model files.
+streamRun = "--stream" in sys.argv[1:]
 
-            # Close all log files
-            writeBestFittingModel(logFile)
+if resumeRun or streamRun:
+    fitJournal = readStage(journalPath, "fit")
+if resumeRun:
+    print("Resuming the previous run, " + str(len([key for key in fitJournal if key != "__fixedValues__" and fitJournal[key]["status"] == "done"])) + " observations have already been fitted.\n")
+elif streamRun == False:
+    # Remove the results folders left unfinished by a previous run that has crashed, then start a new run
+    for entry in readStage(journalPath, "fit").values():
+        if entry["status"] == "allocated" and Path(entry["results_location"]).exists():
+            print("Removing the partial results under " + entry["results_location"] + " left by the previous run\n")
+            removePath(entry["results_location"], recursive=True)
 
-            modFileName = extractModFileName()
-            # Remove any pre-existing best model files and save a new one
-            for eachFile in allFiles:
-                if "best_" in eachFile:
-                    os.system("rm " + eachFile)
+    startStage(journalPath, "fit")
 
-            saveModel("best_" + modFileName, results_location)
+# Time spent on each observation and pipeline command is recorded to commonFiles/telemetry.log
+if use_telemetry:
+    startTelemetry(commonDirectory + "/" + telemetryFileName, "fit")
 
-            current_chi = Fit.statistic
-            current_dof = Fit.dof
+# Digests of the spectral files used by the product store and the fit cache, recalculated only for the files that have changed since the last run
+digestIndex = loadDigestIndex(commonDirectory)
 
-            closeAllFiles()
+# Initializing required variables/dictionaries in case fix_parameters_after_sampling is set to True.
+fixedValues = {}
+startFixingParameters = [False]
+parameterErrors = {}
 
-            print("=============================================================================================\n")
+# If both restartOnce and restartAlways are set to True, set restartAlways to False.
+if restartOnce:
+    restartAlways = False
+
+# restartAlways removes the model files and seeds under commonFiles before every observation, while the other fits running at the same time
+# may be reading them
+if restartAlways and (resolveWorkerCount(fit_worker_count) > 1 or streamRun):
+    print("ERROR: 'restartAlways' can only be used when the observations are fitted one by one. Please set 'fit_worker_count' to 1")
+    print("(and 'stream_stages' to False), or use 'restartOnce' instead. Terminating the script..")
+    quit()
+
+# Switch on/off chatter
+if chatterOn == False:
+    print("Chatter has been disabled.\n") 
+    Xset.chatter = 0
+
+# Set the correct path for the model_file
+model_file = scriptDir + "/" + model_file
+
+# Compile the model pipeline once, so that mistakes in models.txt are reported before any observation is fitted
+modelPipeline, syntaxErrors, undefinedLines = compilePipeline(model_file, model_pipeline_name)
+
+if len(syntaxErrors) != 0:
+    print("\nERROR: The model pipeline '" + model_pipeline_name + "' in " + model_file + " could not be compiled:")
+    for error in syntaxErrors:
+        print(error)
+    print("Terminating the script..")
+    quit()
+
+if len(undefinedLines) != 0:
+    print("\nUndefined commands in the model pipeline '" + model_pipeline_name + "':")
+    for lineNumber, text in undefinedLines:
+        print("'" + text + "' (Line " + str(lineNumber) + ")")
+
+    while (streamRun == False):
+        userInput = input("These lines will not be executed. Would you like to continue executing the script ? (y/n): ")
+        print()
+        if userInput.lower() == "n":
+            print("Terminating the script..")
+            quit()
+        elif userInput.lower() == "y":
+            print("Continuing to the script..")
             break
 
-        #========================================================================================================================================
-        # Calculate uncertainity boundaries
-        if errorCalculations:
-            shakefit(bestModel, logFile)
+try:
+    searchedObsid = readSearchedObsids(scriptDir + "/" + inputTxtFile)
+except Exception as e:
+    print(f"Exception occured while opening {inputTxtFile}: {e}")
+    quit()
 
-        # Save the last model
-        print("Writing the best model parameters to " + fit_file_loc + "...")
-        modFileName = extractModFileName()
-        writeBestFittingModel(logFile)
+searchedObsid = selectObsids(searchedObsid, sys.argv[1:])
 
-        print("Saving the best model xspec file...\n")
-        saveModel(modFileName)
-        saveModel(modFileName, commonDirectory)
-        #==========================================================================
-        if errorCalculations:
-            # Initialize the strings that will be used as seperate lines for parameter file
-            parLines = []
-            parLines.append("Parameter name | Parameter Value | Parameter Uncertainity Lower Boundary | Parameter Uncertainity Upper Boundary\n")
-            
-            # Save parameter information to parLines
-            for comp in AllModels(1).componentNames:
-                compObj = getattr(AllModels(1), comp)
-                for par in compObj.parameterNames:
-                    parObj = getattr(compObj, par)
-                    parName = parObj.name
-                    parValue = parObj.values[0]
-                    index = parObj.index
-                    fullName = comp + "." + parName
-
-                    if fullName in parametersForShakefit:
-                        errorResult = AllModels(1)(index).error
-                        errorString = errorResult[2]
-                        
-                        lowerBound = errorResult[0]
-                        upperBound = errorResult[1]
-                        if lowerBound == 0:
-                            lowerBound = parValue
-                        
-                        if upperBound == 0:
-                            upperBound = parValue
-
-                        if parametersForShakefit[fullName] == "X":
-                            parUnit = fullName
-                        else:
-                            unit = ""
-                            for char in parametersForShakefit[fullName]:
-                                if char == " ":
-                                    unit += "_"
-                                else:
-                                    unit += char
-
-                            parUnit = unit
-                        parLines.append(parUnit + " " + str(parValue) + " " + str(lowerBound) + " " + str(upperBound) +"\n")
-            
-            # Create parameter files that will be used by nicer_plot for creating parameter graphs
-            outputParameterFile = outObsDir + "/parameters_bestmodel.txt"
-            print("Creating", outputParameterFile, "file that will carry the necessary data for creating parameter graphs...\n")
+if len(searchedObsid) == 0:
+    print("\nCould not find any valid observation path given in the observations.txt file.")
+    quit()
 
-            # Create a temporary parameter file that will carry parameter values along with error boundaries
-            if Path(outputParameterFile).exists():
-                os.system("rm " + outputParameterFile)
-            os.system("touch " + outputParameterFile)
+if Path(commonDirectory + "/" + registryFileName).exists() == False and Path(commonDirectory + "/processed_obs.txt").exists() == False:
+    print("\nCould not find the observation registry '" + registryFileName + "' under the 'commonFiles' directory.")
+    print("Please make sure both the 'commonFiles' directory and the registry exist and are constructed as intended by nicer_create.py.\n")
+    quit()
 
-            # Write the parameter information from list to the parameter file
-            try:
-                parFile = open(outputParameterFile, "w")
-            except Exception as e:
-                print(f"Exception occured while opening {outputParameterFile} {e}")
-                continue
+try:
+    searchedObservations = searchObservations(commonDirectory, searchedObsid)
+except Exception as e:
+    print(f"Exception occured while reading the observation registry: {e}")
+    quit()
 
-            for line in parLines:
-                parFile.write(line)
+iterationMax = len(searchedObservations)
 
-            parFile.close()
-        #===========================================================================
-        # Remove any pre-existing best model files and save a new one
-        for eachFile in allFiles:
-            if "best_" in eachFile:
-                os.system("rm " + eachFile)
-        saveModel("best_" + modFileName, results_location)
-        saveModel("best_" + modFileName)
-        saveData()
+if len(searchedObservations) == 0:
+    print("\nCould not find the searched observation paths in the observation registry, most likely due to having low exposure.")
+    quit()
 
-        # Calculate and write equivalent widths of gausses to log file
-        print("Calculating equivalence widths for gaussians in model expression...\n")
-        calculateGaussEqw(logFile)
+if iterationMax > fix_sample_size:
+    iterationMax = fix_sample_size
 
-        current_chi = Fit.statistic
-        current_dof = Fit.dof
+# Streamed observations are written to reduced_chi.log by nicer_main.py, once all of them have been fitted
+try:
+    chi_file = open(os.devnull if streamRun else commonDirectory + "/reduced_chi.log", "w")
+    chi_file.write(model_pipeline_name + "\n")
+except Exception as e:
+    print(f"Exception occured while writing to reduced_chi.log file under commonFiles directory: {e}")
+    quit()
 
-        # Close all log files
-        closeAllFiles()
+# Find the spectral files and create the results folders of all observations before dispatching them to the fit workers,
+# so that the version numbers are assigned in the same order as observations.txt
+# The headers of all spectral files are looked up at once, only new or changed files are opened (see headerindex.py)
+try:
+    registry = openRegistry(commonDirectory)
+    spectralHeaders = lookupHeaders(registry, [path + "/" + fileName for path, obsid, exposure in searchedObservations for fileName in spectralFileNames(obsid)])
+    registry.close()
+except Exception as e:
+    print(f"Exception occured while reading the headers of the spectral files: {e}")
+    quit()
 
-        # Write an xspec script for analyzing parameter values along with linear-data and residual plots quickly
-        os.system("touch " + results_location + "/xspec_bestmod_script.xcm")
-
-        file = open(results_location + "/xspec_bestmod_script.xcm", "w")
-        file.write("@" + results_location + "/data_" + obsid + ".xcm\n")
-        file.write("@"+ results_location +"/best_" + modFileName + "\n")
-        file.write("cpd /xw\n")
-        file.write("setpl e\n")
-        file.write("fit\n")
-        file.write("pl ld chi\n")
-        file.write("show par\n")
-        file.write("show fit\n")
-        file.write("echo OBSID:" + obsid + "\n")
-        file.close()
-        
-        chi_file.write(str(date) + " " + str(current_chi / current_dof) + "\n")
+preparedTasks = []
+for path, obsid, exposure in searchedObservations:
+    task = prepareObservation(path, obsid, exposure)
+    if task is not None:
+        preparedTasks.append(task)
 
-    # The whole fitting process is looped twice for refitting purposes. If fixing nH option is False, do not try to refit
+try:
+    saveDigestIndex(commonDirectory, digestIndex)
+except Exception as e:
+    print(f"WARNING: Digests of the spectral files could not be saved to {commonDirectory}: {e}")
 
-    if fix_parameters_after_sampling == False:
-        break
-    else:
-        if x == 0:
-            print("Restarting the fitting procedure for all observations by fixing the nH parameters...\n")
+if len(preparedTasks) == 0:
+    print("\nNone of the searched observations can be fitted.")
+    quit()
+
+workerCount = min(resolveWorkerCount(fit_worker_count), len(preparedTasks))
+if workerCount > 1:
+    print(f"{len(preparedTasks)} observations will be fitted by {workerCount} workers, each with its own Xspec session.\n")
+
+fixedValuesEntry = fitJournal.get("__fixedValues__")
+if fix_parameters_after_sampling and fixedValuesEntry is not None:
+    # The previous run has already finished the sampling, continue with its averages
+    fixedValues = fixedValuesEntry["fixedValues"]
+    startFixingParameters = [True]
+    print("Using the averaged parameter values of the previous run: " + str(fixedValues) + "\n")
+
+elif fix_parameters_after_sampling:
+    # First pass: fit the sample of observations and record the values of the parameters to be fixed
+    if iterationMax > len(preparedTasks):
+        iterationMax = len(preparedTasks)
+
+    if restartOnce and resumeRun == False and streamRun == False:
+        removeModelFiles()
+
+    sampleTasks = []
+    for task in preparedTasks[:iterationMax]:
+        sampleTask = dict(task)
+        sampleTask["sampling"] = True
+        sampleTask["fixParameters"] = False
+        sampleTask["fixedValues"] = {}
+        sampleTasks.append(sampleTask)
+
+    # runInParallel only returns after every worker has finished, so all samples are collected before taking the averages
+    sampleResults = runFitPass(sampleTasks)
+
+    print("=============================================================================================")
+    print("Collecting the sample for calculating parameter averages is now finished.")
+    print("Values from three observations with longest exposures will be used for fixing the target parameters.\n")
+    print()
+
+    fixedValues = calculateFixedValues(sampleResults)
+    startFixingParameters = [True]
+    recordEntry(journalPath, "fit", "__fixedValues__", "done", fixedValues=fixedValues)
+
+    print("=============================================================================================\n")
+    print("Restarting the fitting procedure for all observations by fixing the nH parameters...\n")
+
+# Second pass (or the only pass if fix_parameters_after_sampling is False): fit all observations, with the averaged
+# values sent to every worker
+if restartOnce and resumeRun == False and streamRun == False:
+    removeModelFiles()
+
+fitTasks = []
+for task in preparedTasks:
+    fitTask = dict(task)
+    fitTask["sampling"] = False
+    fitTask["fixParameters"] = startFixingParameters[0]
+    fitTask["fixedValues"] = fixedValues
+    fitTasks.append(fitTask)
+
+fitResults = runFitPass(fitTasks)
+
+# Write the reduced chi-squared values in the order of observations.txt
+for result in fitResults:
+    if result["status"] == "done":
+        chi_file.write(str(result["date"]) + " " + str(result["chi"] / result["dof"]) + "\n")
 
 try:
     os.chdir(scriptDir)
@@ -1674,6 +1785,29 @@ except Exception as e:
 
 chi_file.close()
 
+# Record the outcome of each observation and the parameters of the finished fits to the observation registry
+try:
+    registry = openRegistry(commonDirectory)
+    setStageStatus(registry, [(result["path"], result["status"]) for result in fitResults], "fit")
+
+    for task, result in zip(fitTasks, fitResults):
+        if result["status"] != "done":
+            continue
+
+        parameters = result.get("parameters")
+        if parameters is None:
+            # Results restored from a fit cache or journal written before the results table existed
+            parameters = []
+            if Path(task["path"] + "/parameters_bestmodel.txt").exists():
+                parameters = readParameterFile(task["path"] + "/parameters_bestmodel.txt")
+
+        recordFitResults(registry, task["results_location"], task["path"], task["obsid"], task["date"], result["chi"], result["dof"], parameters)
+        if result.get("seeds"):
+            recordProvenance(registry, task["results_location"], result["seeds"])
+    registry.close()
+except Exception as e:
+    print(f"Exception occured while updating the observation registry: {e}")
+
 # This file is created after importing variables from another python file
 if Path(scriptDir + "/__pycache__").exists():
-    os.system("rm -rf "+scriptDir+"/__pycache__")
\ No newline at end of file
+    removePath(scriptDir + "/__pycache__", recursive=True)
\ No newline at end of file
@@ -3,6 +3,16 @@
 # Contact: batuhan.bahceci@sabanciuniv.edu
 
 from parameter import *
+from workers import runInParallel, resolveWorkerCount
+from journal import journalFileName, recordEntry, readStage, startStage
+from filesystem import removePath, atomicWrite
+from registry import registryFileName, openRegistry, setStageStatus
+from resultstore import fluxUnit, recordFluxResults, hasFitResults, recordFitResults, readParameterFile, exportParameterFile
+from telemetry import telemetryFileName, startTelemetry, setObservation, countEvent, startSpan, finishSpan
+from bootstrap import scriptDirectory, checkBoolean, checkWorkerCount, readSearchedObsids, selectObsids, searchObservations
+import sys
+import re
+from xspec import *
 
 additive_models = {}
 convolution_models = {}
@@ -78,10 +88,7 @@ print("=========================================================================
 print("\t\t\tRunning " + flux_script_name + "\n")
 
 # Find the script's own path
-scriptPath = os.path.abspath(__file__)
-scriptPathRev = scriptPath[::-1]
-scriptPathRev = scriptPathRev[scriptPathRev.find("/") + 1:]
-scriptDir = scriptPathRev[::-1]
+scriptDir = scriptDirectory(__file__)
 os.chdir(scriptDir)
 
 # Check if outputDir has been assigned to be a spesific directory or not
@@ -101,6 +108,12 @@ if Path(outputDir + "/commonFiles").exists() == False:
     print("Terminating the script...")
     quit()
 
+# Input check for flux_worker_count
+flux_worker_count = checkWorkerCount("flux_worker_count", flux_worker_count, "Please enter the number of fluxes to be calculated at the same time")
+
+# Input check for use_telemetry
+use_telemetry = checkBoolean("use_telemetry", use_telemetry)
+
 # Input check for model_pipeline_name
 if model_pipeline_name == "":
     print("model_pipeline_name is not provided in parameter.py")
@@ -149,6 +162,7 @@ def fitModel():
     Fit.delta = 0.01
     Fit.renorm()
     Fit.perform()
+    countEvent("fits")
 
 def updateParameters(parList):
     # Save the parameters loaded in the xspec model to lists
@@ -266,10 +280,80 @@ def writeParsAfterFlux(line_list):
     
     line_list.append("\n") 
 
-def write_lines_to_file(file_name, line_list):
-    with open(file_name, "a") as file:
-        for line in line_list:
-            file.write(line)
+def restoreSession(dataFile, modFile):
+    # Restores the data and the best fitting model of an observation. The data is only reloaded if the worker has restored a different
+    # observation before, since calculating a flux only changes the model.
+    global restoredDataFile
+
+    AllModels.clear()
+    if restoredDataFile != dataFile:
+        AllData.clear()
+        Xset.restore(dataFile)
+        restoredDataFile = dataFile
+
+    Xset.restore(modFile)
+    Fit.query = "yes"
+
+def calculateFluxTask(task):
+    # Calculates the flux of a single model component for a single observation. This function is run by the flux workers, each of them
+    # owning its own PyXspec session restored from the data_ and best_ xcm files of the observation.
+    global restoredDataFile
+
+    fluxResult = {"obsIndex": task["obsIndex"], "fluxModel": task["fluxModel"], "status": "failed", "flux": [], "lines": []}
+    fluxModel = task["fluxModel"]
+
+    try:
+        os.chdir(task["path"])
+    except Exception as e:
+        print(f"Exception occured while changing directory to {task['path']}: {e}")
+        return fluxResult
+
+    span = startSpan("restore")
+    try:
+        restoreSession(task["dataFile"], task["modFile"])
+    except Exception as e:
+        restoredDataFile = ""
+        print(f"Exception occured while loading data and model files to PyXspec: {e}")
+        fluxResult["status"] = "restore_failed"
+        return fluxResult
+    finishSpan(span)
+
+    parameters = {}
+    updateParameters(parameters)
+    modelName = AllModels(1).expression.replace(" ", "")
+
+    if (fluxModel != "unabsorbed" and fluxModel != "absorbed") and (fluxModel not in modelName):
+        print("\nWARNING: Model '" + fluxModel + "' does not exist in current model expression of observation " + task["obsid"] + ".")
+        print(f"Flux calculation will be skipped for '{fluxModel}'..\n")
+        fluxResult["status"] = "skipped"
+        return fluxResult
+
+    print("Calculating flux for: " + fluxModel + " (observation " + task["obsid"] + ")")
+    span = startSpan("cflux", flux_model=fluxModel)
+    flux = calculateFlux(fluxModel, modelName, parameters)
+    finishSpan(span)
+    if flux == []:
+        print("Could not calculate flux for :" + fluxModel)
+        fluxResult["status"] = "skipped"
+        return fluxResult
+
+    # Lines that will be written to the fit results file
+    fluxResult["lines"].append(energyFilter +" keV " + AllModels(1).expression + "\nFlux: " + listToStr(flux) + "\n")
+    writeParsAfterFlux(fluxResult["lines"])
+
+    fluxResult["flux"] = flux
+    fluxResult["status"] = "done"
+    return fluxResult
+
+def calculateFluxAndRecord(task):
+    # Calculates the flux and records it to the campaign journal, so that a resumed run does not calculate it again
+    setObservation(task["obsid"])
+    span = startSpan("observation", flux_model=task["fluxModel"])
+    fluxResult = calculateFluxTask(task)
+    finishSpan(span, status=fluxResult["status"])
+    if fluxResult["status"] == "done" or fluxResult["status"] == "skipped":
+        recordEntry(journalPath, "flux", task["resultsDir"] + "|" + task["fluxModel"], fluxResult["status"], result=fluxResult)
+    return fluxResult
 
 #===================================================================================================================
 try:
@@ -282,69 +366,63 @@ except Exception as e:
 
 commonDirectory = outputDir + "/commonFiles"   # ~/NICER/analysis/commonFiles
 
-searchedObsid = []
+# With '--resume', the fluxes calculated by the previous run are not calculated again
+resumeRun = "--resume" in sys.argv[1:]
+journalPath = commonDirectory + "/" + journalFileName
+fluxJournal = {}
+
+# nicer_main.py runs this script for single observations with '--stream --obsid <obsid>', after starting the journal itself
+streamRun = "--stream" in sys.argv[1:]
+
+if resumeRun or streamRun:
+    fluxJournal = readStage(journalPath, "flux")
+else:
+    startStage(journalPath, "flux")
+
+# Time spent on each flux calculation is recorded to commonFiles/telemetry.log
+if use_telemetry:
+    startTelemetry(commonDirectory + "/" + telemetryFileName, "flux")
+
 try:
-    with open(scriptDir + "/" + inputTxtFile, "r") as file:
-        allLines = file.readlines()
-        for line in allLines:
-            line = line.replace(" ", "")
-            line = line.strip("\n")
-            if line != "" and Path(line).exists():
-                if line[-1] != "/":
-                    slashIdx = line.rfind("/")
-                    obsid = line[slashIdx+1 :]
-                else:
-                    slashIdx = line[:-1].rfind("/")
-                    obsid = line[slashIdx+1:-1]
-                
-                searchedObsid.append(obsid)
+    searchedObsid = readSearchedObsids(scriptDir + "/" + inputTxtFile)
 except Exception as e:
     print(f"Exception occured while opening {inputTxtFile}: {e}")
     quit()
 
+searchedObsid = selectObsids(searchedObsid, sys.argv[1:])
+
 if len(searchedObsid) == 0:
     print("\nCould not find any valid observation path, as given in the obs.txt file.")
     quit()
 
-iterationMax = 0
-searchedObservations = []
-if Path(commonDirectory + "/processed_obs.txt").exists() == False:
-    print("\nCould not find 'processed_obs.txt' file under the 'commonFiles' directory.")
-    print("Please make sure both the 'commonFiles' directory and the 'processed_obs.txt' files exist and are constructed as intended by nicer_create.py.\n")
+if Path(commonDirectory + "/" + registryFileName).exists() == False and Path(commonDirectory + "/processed_obs.txt").exists() == False:
+    print("\nCould not find the observation registry '" + registryFileName + "' under the 'commonFiles' directory.")
+    print("Please make sure both the 'commonFiles' directory and the registry exist and are constructed as intended by nicer_create.py.\n")
+    quit()
+
+try:
+    searchedObservations = searchObservations(commonDirectory, searchedObsid)
+except Exception as e:
+    print(f"Exception occured while reading the observation registry: {e}")
     quit()
-else:
-    try:
-        with open(commonDirectory + "/processed_obs.txt", "r") as filteredFile:
-            allLines = filteredFile.readlines()
-            for eachObsid in searchedObsid:
-                for line in allLines:
-                    line = line.strip("\n")
-                    lineElements = line.split(" ")
-
-                    if lineElements[1] == eachObsid:
-                        iterationMax += 1
-                        searchedObservations.append((lineElements[0], lineElements[1], lineElements[2]))
-    except Exception as e:
-        print(f"Exception occured while opening processed_obs.txt: {e}")
-        quit()
 
 if len(searchedObservations) == 0:
-    print("\nCould not find the searched observation paths in 'processed_obs.txt', most likely due to having low exposure.")
+    print("\nCould not find the searched observation paths in the observation registry, most likely due to having low exposure.")
     quit()
 
 if chatterOn == False:
     Xset.chatter = 0
 
-# Start calculating fluxes for each valid observation
-for path, obsid, expo in searchedObservations:
-    print("====================================================================")
-    print("Calculating fluxes for observation:", obsid, "\n")
+# Data file restored last by this process, used by restoreSession()
+restoredDataFile = ""
 
+# Find the files of each valid observation, then create one task for every (observation, flux component) pair
+preparedObservations = []
+fluxTasks = []
+for path, obsid, expo in searchedObservations:
     outObsDir = path
-    try:
-        os.chdir(outObsDir)
-    except Exception as e:
-        print(f"Exception occured while changing directory to {outObsDir}: {e}")
+    if Path(outObsDir).exists() == False:
+        print(f"Directory {outObsDir} of observation {obsid} could not be found.")
         continue
 
     version = 0
@@ -360,8 +438,16 @@ for path, obsid, expo in searchedObservations:
     if output_save_name == "":
         output_save_name = model_pipeline_name
 
-    outObsDir = outObsDir + "/results/" + output_save_name +"_" + str(version)
-    allFiles = os.listdir(outObsDir)
+    resultsDir = outObsDir + "/results/" + output_save_name +"_" + str(version)
+    if resultsDir in fluxJournal and fluxJournal[resultsDir]["status"] == "done":
+        print("Fluxes of observation " + obsid + " have already been written by the previous run.\n")
+        continue
+
+    try:
+        allFiles = os.listdir(resultsDir)
+    except Exception as e:
+        print(f"Exception occured while listing the files under {resultsDir}: {e}")
+        continue
 
     # Find the data file and the best fitting model file for the current observation
     missingFiles = True
@@ -369,10 +455,10 @@ for path, obsid, expo in searchedObservations:
     foundDatafile = False
     for file in allFiles:
         if "best_" in file:
-            modFile = outObsDir + "/" + file
+            modFile = resultsDir + "/" + file
             foundModfile = True
         elif "data_" in file:
-            dataFile = outObsDir + "/" + file
+            dataFile = resultsDir + "/" + file
             foundDatafile = True
 
         if foundDatafile and foundModfile:
@@ -380,7 +466,7 @@ for path, obsid, expo in searchedObservations:
             missingFiles = False
             break
     
-    fit_file_loc = outObsDir + "/" + resultsFile
+    fit_file_loc = resultsDir + "/" + resultsFile
     fit_file_lines = []
 
     try:
@@ -409,76 +495,114 @@ for path, obsid, expo in searchedObservations:
             print("->Missing data file")
             fit_file_lines.append("->Missing data file\n")
         
-        write_lines_to_file(fit_file_loc, fit_file_lines)
+        atomicWrite(fit_file_loc, fit_file_lines)
         continue
     
-    print("All the files required for calculating fluxes are found. Please check if the correct files are in use.")
+    print("All the files required for calculating fluxes are found for observation " + obsid + ". Please check if the correct files are in use.")
     print("Model file: ", modFile)
     print("Data file: ", dataFile, "\n")
 
-    try:
-        Xset.restore(dataFile)
-        Xset.restore(modFile)
-    except Exception as e:
-        print(f"Exception occured while loading data and model files to PyXspec: {e}")
-        continue
+    obsIndex = len(preparedObservations)
+    preparedObservations.append({"path": outObsDir, "obsid": obsid, "resultsDir": resultsDir, "fit_file_loc": fit_file_loc, "fit_file_lines": fit_file_lines})
 
-    Fit.query = "yes"
+    for fluxModel in fluxes_to_be_calculated:
+        fluxTasks.append({"obsIndex": obsIndex, "obsid": obsid, "path": outObsDir, "resultsDir": resultsDir, "dataFile": dataFile, "modFile": modFile, "fluxModel": fluxModel})
+
+# Take the fluxes calculated by the resumed run from the journal, and calculate only the remaining ones
+fluxResults = [None] * len(fluxTasks)
+pendingIndices = []
+for i, task in enumerate(fluxTasks):
+    entry = fluxJournal.get(task["resultsDir"] + "|" + task["fluxModel"])
+    if entry is not None:
+        fluxResults[i] = entry["result"]
+        fluxResults[i]["obsIndex"] = task["obsIndex"]
+    else:
+        pendingIndices.append(i)
 
-    parameters = {}
-    updateParameters(parameters)
+workerCount = min(resolveWorkerCount(flux_worker_count), len(pendingIndices))
+if workerCount > 1:
+    print(f"{len(pendingIndices)} flux calculations will be run by {workerCount} workers, each with its own Xspec session.\n")
 
-    # Open the parameter file and extract all non_flux lines
-    all_lines_file = {}
+pendingResults = runInParallel(calculateFluxAndRecord, [fluxTasks[i] for i in pendingIndices], workerCount)
+for i, fluxResult in zip(pendingIndices, pendingResults):
+    fluxResults[i] = fluxResult
 
-    try:
-        par_file = open("parameters_bestmodel.txt", "r")
-    except Exception as e:
-        print(f"Exception occured while opening parameters_bestmodel.txt file for observation {obsid}: {e}")
-        continue
+# Group the results by observation, they are already in the order of fluxes_to_be_calculated
+resultsByObservation = {}
+for fluxResult in fluxResults:
+    if fluxResult["obsIndex"] not in resultsByObservation:
+        resultsByObservation[fluxResult["obsIndex"]] = [fluxResult]
+    else:
+        resultsByObservation[fluxResult["obsIndex"]].append(fluxResult)
 
-    all_lines = par_file.readlines()
-    par_file.close()
+try:
+    registry = openRegistry(commonDirectory)
+except Exception as e:
+    print(f"Exception occured while opening the observation registry: {e}")
+    quit()
 
-    for line in all_lines:
-        if "flux" not in line:
-            all_lines_file[line] = 1
+# Record the fluxes of each observation to the results table, then write them to its parameter file and fit results file
+fluxStatus = []
+for obsIndex in range(len(preparedObservations)):
+    observation = preparedObservations[obsIndex]
+    obsid = observation["obsid"]
+    obsResults = resultsByObservation.get(obsIndex, [])
+
+    print("====================================================================")
+    print("Writing fluxes for observation:", obsid, "\n")
+
+    if any(fluxResult["status"] == "restore_failed" for fluxResult in obsResults):
+        print(f"Data and model files of observation {obsid} could not be loaded, its fluxes will not be written.")
+        fluxStatus.append((observation["path"], "failed"))
+        continue
+
+    fit_file_lines = observation["fit_file_lines"]
+    fluxes = []
 
     fit_file_lines.append("\n===========================================================\n")
     fit_file_lines.append("Fluxes of model components (in 10^-9 ergs/cm^2/s) (90% confidence intervals)\n\n")
-    modelName = AllModels(1).expression.replace(" ", "")
 
-    for fluxModel in fluxes_to_be_calculated:
-        if (fluxModel != "unabsorbed" and fluxModel != "absorbed") and (fluxModel not in modelName):
-            print("\nWARNING: Model '" + fluxModel + "' does not exist in current model expression.")
-            print(f"Flux calculation will be skipped for '{fluxModel}'..\n")
+    for fluxResult in obsResults:
+        if fluxResult["status"] != "done":
             continue
 
-        print("Calculating flux for: " + fluxModel)
-        flux = calculateFlux(fluxModel, modelName, parameters)
-        if flux == []:
-            print("Could not calculate flux for :" + fluxModel)
-            continue
+        # Write flux data to the fit results file
+        fit_file_lines += fluxResult["lines"]
 
-        # Write flux data to 
-        fit_file_lines.append(energyFilter +" keV " + AllModels(1).expression + "\nFlux: " + listToStr(flux) + "\n")
+        flux = fluxResult["flux"]
+        fluxes.append((fluxResult["fluxModel"] + " flux", fluxUnit, flux[0], flux[1], flux[2]))
 
-        writeParsAfterFlux(fit_file_lines)
-        
-        # Add new flux line to the all_lines_file
-        all_lines_file[fluxModel +"_flux " + listToStr(flux)+ " (10^-9_ergs_cm^-2_s^-1)\n"] = 1
-        
-    # Write flux values to parameter file
-    par_file = open("parameters_bestmodel.txt", "w")
-    for line in all_lines_file.keys():
-        par_file.write(line)
-    par_file.close()
+    parameterFile = observation["path"] + "/parameters_bestmodel.txt"
+    try:
+        if hasFitResults(registry, observation["resultsDir"]) == False and Path(parameterFile).exists():
+            # The fit has been made before the results table existed, take its parameters from the parameter file
+            recordFitResults(registry, observation["resultsDir"], observation["path"], obsid, None, None, None, readParameterFile(parameterFile))
 
-    write_lines_to_file(fit_file_loc, fit_file_lines)
+        recordFluxResults(registry, observation["resultsDir"], observation["path"], obsid, fluxes)
+    except Exception as e:
+        print(f"Exception occured while recording the fluxes of observation {obsid} to the observation registry: {e}")
+        fluxStatus.append((observation["path"], "failed"))
+        continue
 
-    AllModels.clear()
-    AllData.clear()
+    # The parameter file and the fit results file are readable exports, they are replaced as a whole
+    exportParameterFile(registry, observation["resultsDir"], parameterFile)
+    atomicWrite(observation["fit_file_loc"], fit_file_lines)
+
+    recordEntry(journalPath, "flux", observation["resultsDir"], "done")
+    fluxStatus.append((observation["path"], "done"))
+
+# Record the outcome of each observation to the observation registry
+try:
+    setStageStatus(registry, fluxStatus, "flux")
+    registry.close()
+except Exception as e:
+    print(f"Exception occured while updating the observation registry: {e}")
+
+try:
+    os.chdir(scriptDir)
+except Exception as e:
+    print(f"Exception occured while trying to change directory to {scriptDir}: {e}")
 
 # This file is created after importing variables from another python file
 if Path(scriptDir + "/__pycache__").exists():
-    os.system("rm -rf "+scriptDir+"/__pycache__")
+    removePath(scriptDir + "/__pycache__", recursive=True)
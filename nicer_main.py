@@ -3,6 +3,14 @@
 # Contact: batuhan.bahceci@sabanciuniv.edu
 
 from parameter import *
+import sys
+import time
+from filesystem import removePath
+from telemetry import telemetryFileName, traceFileName, csvFileName, rotateTelemetry, startTelemetry, startSpan, finishSpan, readSpans, writeChromeTrace, writeCsv, summaryLines
+from journal import journalFileName
+from workers import resolveWorkerCount
+from stream import streamLogDirectoryName, prepareStream, runStream, writeReducedChi
+from bootstrap import scriptDirectory, checkBoolean, runStage, readObservationPaths, obsidOfPath
 
 print("==============================================================================")
 print("\t\t\tRunning nicer_main.py\n")
@@ -10,10 +18,7 @@ print("\t\t\tRunning nicer_main.py\n")
 # Change the script switches below to select which files you would like to run
 
 # Find the script's own path
-scriptPath = os.path.abspath(__file__)
-scriptPathRev = scriptPath[::-1]
-scriptPathRev = scriptPathRev[scriptPathRev.find("/") + 1:]
-scriptDir = scriptPathRev[::-1] 
+scriptDir = scriptDirectory(__file__)
 os.chdir(scriptDir)
 
 # Check if outputDir has been assigned to be a spesific directory or not
@@ -27,6 +32,12 @@ if Path(outputDir).exists() == False:
     print("Directory defined by outputDir could not be found. Terminating the script...")
     quit()
 
+# Input check for use_telemetry
+use_telemetry = checkBoolean("use_telemetry", use_telemetry)
+
+# Input check for stream_stages
+stream_stages = checkBoolean("stream_stages", stream_stages)
+
 stopExecution = False
 # Input checks for sub-scripts
 if Path(scriptDir + "/" + create_script_name).exists() == False:
@@ -50,18 +61,143 @@ if stopExecution:
     quit()
 # ====================================================================================================================
 
+# Running 'python3 nicer_main.py --resume' continues the fit and flux stages from where the previous run has stopped
+resumeArguments = []
+if "--resume" in sys.argv[1:]:
+    resumeArguments = ["--resume"]
+
+# The scripts are run in this process one after another, so that parameter.py, PyXspec and astropy are only imported once and the
+# checked variables and observation lists of a script are reused by the next ones
+stagesToRun = []
 if run_create_script:
-    os.system("python3 " + create_script_name)
+    stagesToRun.append((create_script_name, []))
 if run_fit_script:
-    os.system("python3 " + fit_script_name)
+    stagesToRun.append((fit_script_name, resumeArguments))
 if run_flux_script:
-    os.system("python3 " + flux_script_name)
+    stagesToRun.append((flux_script_name, resumeArguments))
 if run_plot_script:
-    os.system("python3 " + plot_script_name)
+    stagesToRun.append((plot_script_name, []))
+
+# The create, fit and flux scripts are streamed (each observation is passed to the next script as soon as it is ready, see stream.py) if at
+# least two of them are run. The fit must wait for all observations if the parameters are fixed to the averages of a sample.
+streamedStages = []
+if run_create_script:
+    streamedStages.append(("create", scriptDir + "/" + create_script_name, [], create_worker_count))
+if run_fit_script:
+    streamedStages.append(("fit", scriptDir + "/" + fit_script_name, resumeArguments, fit_worker_count))
+if run_flux_script:
+    streamedStages.append(("flux", scriptDir + "/" + flux_script_name, resumeArguments, flux_worker_count))
+streamRun = stream_stages and fix_parameters_after_sampling == False and len(streamedStages) >= 2
+
+# Running 'python3 nicer_main.py --dry-run' only lists the scripts and observations that would be processed. It does not load PyXspec or astropy.
+if "--dry-run" in sys.argv[1:]:
+    try:
+        validPaths = readObservationPaths(scriptDir + "/" + inputTxtFile)
+    except Exception as e:
+        print(f"Exception occured while reading {inputTxtFile}: {e}")
+        quit()
+
+    print("Scripts to be run: " + ", ".join([(scriptName + " " + " ".join(arguments)).strip() for scriptName, arguments in stagesToRun]))
+    if streamRun:
+        print("Each observation is streamed through: " + ", ".join([f"{stageName} ({resolveWorkerCount(processCount)} at a time)" for stageName, scriptPath, arguments, processCount in streamedStages]))
+    print(f"{len(validPaths)} observation directories found in {inputTxtFile}:")
+    for path in validPaths:
+        print("\t" + path)
+    quit()
+
+commonDirectory = outputDir + "/commonFiles"
+telemetryPath = commonDirectory + "/" + telemetryFileName
+runStart = time.time()
+
+# Every run is recorded to a new telemetry.log, so that only the spans of this run are read at the end
+if use_telemetry:
+    rotateTelemetry(telemetryPath)
+
+if streamRun:
+    try:
+        streamedObsids = list(dict.fromkeys([obsidOfPath(path) for path in readObservationPaths(scriptDir + "/" + inputTxtFile)]))
+    except Exception as e:
+        print(f"Exception occured while reading {inputTxtFile}: {e}")
+        quit()
+
+    if len(streamedObsids) == 0:
+        print("Could not find any valid observation path given in the observations.txt file.")
+        quit()
+
+    # The streamed fit scripts cannot ask about the undefined lines of the model pipeline, so the pipeline is checked here once
+    if run_fit_script:
+        from pipeline import compilePipeline
+
+        modelPipeline, syntaxErrors, undefinedLines = compilePipeline(scriptDir + "/" + model_file, model_pipeline_name)
+        if len(syntaxErrors) != 0:
+            print("ERROR: The model pipeline '" + model_pipeline_name + "' in " + model_file + " could not be compiled:")
+            for error in syntaxErrors:
+                print(error)
+            print("Terminating the script..")
+            quit()
+
+        if len(undefinedLines) != 0:
+            print("Undefined commands in the model pipeline '" + model_pipeline_name + "':")
+            for lineNumber, text in undefinedLines:
+                print("'" + text + "' (Line " + str(lineNumber) + ")")
+
+            while (True):
+                userInput = input("These lines will not be executed. Would you like to continue executing the script ? (y/n): ")
+                print()
+                if userInput.lower() == "n":
+                    print("Terminating the script..")
+                    quit()
+                elif userInput.lower() == "y":
+                    break
+
+    stageNames = [stageName for stageName, scriptPath, arguments, processCount in streamedStages]
+    prepareStream(commonDirectory, commonDirectory + "/" + journalFileName, stageNames, resumeArguments != [], restartOnce, clean_obs_history)
+
+    print(f"Streaming {len(streamedObsids)} observations through {', '.join(stageNames)}, the output of each script is saved under {commonDirectory}/{streamLogDirectoryName}\n")
+    span = startSpan("stream")
+    lastSucceeded = runStream([(stageName, scriptPath, arguments, resolveWorkerCount(processCount)) for stageName, scriptPath, arguments, processCount in streamedStages],
+                              streamedObsids, commonDirectory, scriptDir)
+
+    if run_fit_script:
+        writeReducedChi(commonDirectory, streamedObsids, model_pipeline_name, custom_name if custom_name != "" else model_pipeline_name)
+
+    failedObsids = [obsid for obsid, stageName in lastSucceeded.items() if stageName != stageNames[-1]]
+    print(f"\n{len(streamedObsids) - len(failedObsids)} of {len(streamedObsids)} observations have passed all streamed scripts.")
+    if failedObsids != []:
+        print("Observations that have stopped before the end: " + ", ".join([obsid + " (after " + (lastSucceeded[obsid] or "none") + ")" for obsid in failedObsids]))
+
+    if use_telemetry:
+        startTelemetry(telemetryPath, "main")
+        finishSpan(span)
+
+    # Only the plot script is left to be run in this process
+    stagesToRun = [(scriptName, arguments) for scriptName, arguments in stagesToRun if scriptName == plot_script_name]
+
+for scriptName, arguments in stagesToRun:
+    span = startSpan(scriptName)
+    if runStage(scriptDir + "/" + scriptName, arguments) == False:
+        print(f"\n{scriptName} has been terminated before reaching its end, continuing with the next script.")
+
+    # The scripts themselves are recorded as spans of the "main" stage. The scripts run in this process set their own stage names, and
+    # commonFiles only exists after nicer_create.py has been run.
+    if use_telemetry and Path(commonDirectory).exists():
+        startTelemetry(telemetryPath, "main")
+        finishSpan(span)
+
+# Write the telemetry of this run as a Chrome trace and a CSV file, and show where the time has gone
+if use_telemetry:
+    spans = readSpans(telemetryPath, runStart)
+    if spans != []:
+        writeChromeTrace(spans, commonDirectory + "/" + traceFileName)
+        writeCsv(spans, commonDirectory + "/" + csvFileName)
+
+        print("==============================================================================")
+        print("".join(summaryLines(spans)))
+        print(f"Timings of all observations and commands have been saved to {commonDirectory}/{traceFileName} and {csvFileName}")
 
 if Path("__pycache__").exists():
-    os.system("rm -rf __pycache__")
+    removePath("__pycache__", recursive=True)
 
 if Path("1").exists():
     # Sometimes, a file named "1" is created, I haven't figured out why yet
-    os.system("rm 1")
\ No newline at end of file
+    removePath("1")
\ No newline at end of file
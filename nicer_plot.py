@@ -3,17 +3,25 @@
 # Contact: batuhan.bahceci@sabanciuniv.edu
 
 from parameter import *
+import numpy as np
+import matplotlib
+matplotlib.use("Agg")
 import matplotlib.pyplot as plt
 from matplotlib.ticker import MultipleLocator, AutoMinorLocator
+from filesystem import makeDirectory, removePath, clearDirectory, atomicWrite
+from registry import registryFileName, openRegistry, setStageStatus, modeOfPath
+from resultstore import importParameterFiles, readLatestResults, recordOutliers
+from outliers import outlierMethods, outlierMask, applyMask
+from plotpanels import binPanel, renderPanel, savePanels, exportHtml
+from workers import runInParallel
+from headerindex import spectralFileNames, lookupHeaders
+from bootstrap import scriptDirectory, checkBoolean, checkWorkerCount, readSearchedObsids, searchObservations
 
 print("==============================================================================")
 print("\t\t\tRunning " + plot_script_name + "\n")
 
 # Find the script's own path
-scriptPath = os.path.abspath(__file__)
-scriptPathRev = scriptPath[::-1]
-scriptPathRev = scriptPathRev[scriptPathRev.find("/") + 1:]
-scriptDir = scriptPathRev[::-1]
+scriptDir = scriptDirectory(__file__)
 os.chdir(scriptDir)
 
 # Check if outputDir has been assigned to be a spesific directory or not
@@ -48,6 +56,23 @@ if (outlier_lower_threshold >= outlier_upper_threshold):
     print("ERROR: Lower threshold for outlier detection algorithm is larger than upper threshold")
     quit()
 
+# Input check for outlier_detection_method
+if outlier_detection_method not in outlierMethods:
+    print("ERROR: 'outlier_detection_method' variable in parameter.py must be one of: " + ", ".join(outlierMethods))
+    quit()
+
+# Input checks for the graph settings
+plot_worker_count = checkWorkerCount("plot_worker_count", plot_worker_count, "Please enter the number of graph panels to be drawn at the same time")
+export_html = checkBoolean("export_html", export_html)
+
+if (type(plot_page_days) != float and type(plot_page_days) != int) or plot_page_days < 0:
+    print("ERROR: 'plot_page_days' variable in parameter.py must be a number >= 0")
+    quit()
+
+if type(plot_max_points) != int or plot_max_points < 0:
+    print("ERROR: 'plot_max_points' variable in parameter.py must be an integer >= 0")
+    quit()
+
 # Input check for model_pipeline_name
 if model_pipeline_name == "":
     print("model_pipeline_name is not provided in parameter.py")
@@ -64,46 +89,6 @@ def listToStr(array):
     result = result[:-1]
     return result
 
-def enterParameters(parList, fluxPars = {}):
-    # Take the available parameters from the stemList
-    components = AllModels(1).componentNames
-    for comp in components:
-        compObj = getattr(AllModels(1), comp)
-        parameters = compObj.parameterNames
-        for par in parameters:
-            parObj = getattr(compObj, par)
-            indx = parObj.index
-            fullName = comp + "." + par
-            # If the parameter value is stored in previous model's list, take it from there. Otherwise, look whether
-            # it is initialized in current model's list
-            if fullName in parList:
-                AllModels(1)(indx).values = parList[fullName]
-    
-    if fluxPars != {}:
-        compObj = AllModels(1).cflux
-        for key, val in fluxPars.items():
-            parObj = getattr(compObj, key)
-            parObj.values = val
-
-def fitModel():
-    Fit.nIterations = 100
-    Fit.delta = 0.01
-    Fit.perform()
-
-def updateParameters(parList):
-    # Save the parameters loaded in the xspec model to lists
-    components = AllModels(1).componentNames
-    for comp in components:
-        if comp == "vphabs":
-            compObj = getattr(AllModels(1), comp)
-            parameters = compObj.parameterNames
-            for par in parameters:
-                parObj = getattr(compObj, par)
-                if parObj.values[1] > 0:
-                    indx = parObj.index
-                    fullName = comp + "." + par
-                    parList.append((fullName, AllModels(1)(indx).values[0]))
-
 def transferToNewList(sourceList):
     newList = [sourceList[0]]
     newParDict = {}
@@ -125,35 +110,120 @@ def transferToNewList(sourceList):
     
     return newList
 
-def modified_z_score(parameter_dict):
-    for key, all_arrays in parameter_dict.items():
-        data_array = np.array(all_arrays[0])
-        if len(data_array) == 0:
-            continue
+def firstOccurences(array):
+    # Returns the distinct elements of the array in the order they first appear, and the index of each element in that list
+    distinct, firstIndices, inverse = np.unique(array, return_index=True, return_inverse=True)
+    order = np.argsort(firstIndices)
+    rank = np.empty(len(order), dtype=int)
+    rank[order] = np.arange(len(order))
+    return distinct[order], rank[inverse.reshape(-1)]
+
+def pivotResults(rowMask):
+    # Arranges the selected rows of the results table as a table with observations as rows and parameters as columns.
+    # Values missing for an observation are NaN.
+    obsids = results["obsid"][rowMask]
+    modes = results["mode"][rowMask]
+    keys = np.where(modes == "", obsids, np.char.add(np.char.add(obsids, "_"), modes))
+
+    obsKeys, obsIndex = firstOccurences(keys)
+    names, parIndex = firstOccurences(results["name"][rowMask])
+
+    pivot = {"obsKeys": obsKeys, "names": names, "dates": np.full(len(obsKeys), np.nan), "resultsDirs": np.full(len(obsKeys), "", dtype=results["results_dir"].dtype)}
+    pivot["dates"][obsIndex] = np.round(results["mjd"][rowMask], 3)
+    pivot["resultsDirs"][obsIndex] = results["results_dir"][rowMask]
+
+    for column in ["value", "err_low", "err_high"]:
+        pivot[column] = np.full((len(obsKeys), len(names)), np.nan)
+        pivot[column][obsIndex, parIndex] = results[column][rowMask]
+
+    pivot["units"] = np.full(len(names), "", dtype=results["unit"].dtype)
+    pivot["units"][parIndex] = results["unit"][rowMask]
+
+    return pivot
+
+def findOutliers(pivot):
+    # Returns a mask with the same shape as the pivot values that is False for the outliers of each parameter
+    if use_outlier_detection == False:
+        return np.ones(pivot["value"].shape, dtype=bool)
+
+    return outlierMask(pivot["value"], outlier_detection_method, outlier_lower_threshold, outlier_upper_threshold, sigma_clip_threshold, iqr_factor)
+
+def createGraphAndTable(pivot, keptValues, title, graphDirectory, tableDirectory):
+    # Creates the graphs with one panel for each parameter (one graph for each time page if plot_page_days is set), the HTML export if
+    # export_html is True, and the table with the value and the uncertainity boundaries of each parameter.
+    # Values that are not in 'keptValues' are not shown on the graphs. Returns the paths of the graphs, the HTML file and the table.
+    referanceMjd = round((np.nanmin(pivot["dates"]) - 5) / 5) * 5
+    xlabel = f"Time (MJD-{referanceMjd} days)"
+    dates = pivot["dates"] - referanceMjd
+    lastPanel = len(pivot["names"]) - 1
+
+    # Construct the file names of the graphs and the table
+    if enable_versioning:
+        baseName = output_save_name + "_" + str(current_version)
+    else:
+        baseName = output_save_name
+    table_file_name = tableDirectory + "/" + baseName + ".txt"
+
+    # Split the observations into pages of plot_page_days days
+    pageOf = np.zeros(len(dates), dtype=int)
+    if plot_page_days > 0:
+        pageOf = np.floor((dates - np.min(dates)) / plot_page_days).astype(int)
+    pages = np.unique(pageOf)
+
+    pageFiles = []
+    panelTasks = []
+    for page in pages:
+        if len(pages) > 1:
+            pageFiles.append(graphDirectory + "/" + baseName + "_page" + str(page + 1) + ".png")
+            xlim = (np.min(dates) + page * plot_page_days, np.min(dates) + (page + 1) * plot_page_days)
+        else:
+            pageFiles.append(graphDirectory + "/" + baseName + ".png")
+            padding = max(0.02 * (np.max(dates) - np.min(dates)), 0.5)
+            xlim = (np.min(dates) - padding, np.max(dates) + padding)
+
+        for i, par_name in enumerate(pivot["names"]):
+            shown = keptValues[:, i] & (np.isnan(pivot["value"][:, i]) == False) & (pageOf == page)
+            x_axis, y_axis, err_low, err_high, keys = applyMask([dates, pivot["value"][:, i], pivot["err_low"][:, i], pivot["err_high"][:, i], pivot["obsKeys"]], shown)
+
+            panelTasks.append({"panel": binPanel(x_axis, y_axis, err_low, err_high, keys, plot_max_points), "label": par_name, "unit": pivot["units"][i],
+                               "xlim": xlim, "xlabel": xlabel, "showXLabel": i == lastPanel})
+
+    # Panels are drawn by the plot workers, then stacked into one image for each page
+    panelImages = runInParallel(renderPanel, panelTasks, plot_worker_count)
+    for pageIndex, png_name in enumerate(pageFiles):
+        # Delete any existing file with the same name, and create a new file
+        removePath(png_name)
+        savePanels(png_name, title, panelImages[pageIndex * len(pivot["names"]):(pageIndex + 1) * len(pivot["names"])])
+
+    html_name = ""
+    if export_html:
+        htmlPanels = []
+        for i, par_name in enumerate(pivot["names"]):
+            shown = keptValues[:, i] & (np.isnan(pivot["value"][:, i]) == False)
+            panel = binPanel(*applyMask([dates, pivot["value"][:, i], pivot["err_low"][:, i], pivot["err_high"][:, i], pivot["obsKeys"]], shown), plot_max_points)
+            panel["label"] = par_name
+            panel["unit"] = pivot["units"][i]
+            htmlPanels.append(panel)
+
+        html_name = graphDirectory + "/" + baseName + ".html"
+        exportHtml(html_name, title, xlabel, htmlPanels)
+
+    # Each parameter has three columns: value, lower and upper uncertainity boundaries
+    header = ["Obsid", "MJD"]
+    for par_name in pivot["names"]:
+        par_name = par_name.replace(" ", "_")
+        header += [par_name, par_name + "_errlow", par_name + "_errhigh"]
+
+    boundaries = np.stack([pivot["value"], pivot["value"] - pivot["err_low"], pivot["value"] + pivot["err_high"]], axis=2)
+    columns = np.column_stack([pivot["dates"], boundaries.reshape(len(pivot["obsKeys"]), -1)])
+    rows = np.column_stack([pivot["obsKeys"], np.char.mod("%s", columns)])
+
+    # Override the table file's contents in one go
+    table = " ".join(header) + "\n" + "".join(" ".join(row) + "\n" for row in rows)
+    atomicWrite(table_file_name, table)
+
+    return pageFiles, html_name, table_file_name
 
-        median = np.median(data_array)
-        mean = np.mean(data_array)
-        mad = np.median(np.abs(data_array - median))
-        mean_ad = np.abs(data_array - mean)
-        mean_ad = np.sum(mean_ad) / len(data_array)
-
-        mod_z_scores = []
-        for x in data_array:
-            if mad == 0:
-                mod_z_scores.append((x - median) / (1.253314 * mean_ad))
-            else:
-                mod_z_scores.append((x - median) / (1.486 * mad))
-
-        idx_counter = 0
-        for i in mod_z_scores:
-            if i  <= outlier_lower_threshold  or i >= outlier_upper_threshold:
-                all_arrays[0].pop(idx_counter)
-                all_arrays[1].pop(idx_counter)
-                all_arrays[2].pop(idx_counter)
-                all_arrays[3].pop(idx_counter)
-            else:
-                idx_counter += 1
-        
 #===================================================================================================================
 
 try:
@@ -164,56 +234,25 @@ except Exception as e:
     print(f"Exception occured while reading 'energyLimits' variable due to incorrect format: {e}")
     quit()
 
-otherParsDict = {}
-fluxValuesDict = {}
 commonDirectory = outputDir + "/commonFiles"   # ~/NICER/analysis/commonFiles
 
 #===========================================================================================
 # Create output directories of not created already
-if Path(commonDirectory + "/results").exists() == False:
-    os.system("mkdir " + commonDirectory + "/results")
-
-if Path(commonDirectory + "/results/model_graphs").exists() == False:
-    os.system("mkdir " + commonDirectory + "/results/model_graphs")
-
-if Path(commonDirectory + "/results/flux_graphs").exists() == False:
-    os.system("mkdir " + commonDirectory + "/results/flux_graphs")
-
-if Path(commonDirectory + "/results/flux_tables").exists() == False:
-    os.system("mkdir " + commonDirectory + "/results/flux_tables")
-
-if Path(commonDirectory + "/results/model_tables").exists() == False:
-    os.system("mkdir " + commonDirectory + "/results/model_tables")
-
-if Path(commonDirectory + "/results/chi_squared_graphs").exists() == False:
-    os.system("mkdir " + commonDirectory + "/results/chi_squared_graphs")
+for eachDir in ["model_graphs", "flux_graphs", "flux_tables", "model_tables", "chi_squared_graphs"]:
+    if makeDirectory(commonDirectory + "/results/" + eachDir) == False:
+        quit()
 
 if Path(commonDirectory + "/version_counter.txt").exists() == False:
-    os.system("touch " + commonDirectory + "/version_counter.txt")
-
-    temp_file = open(commonDirectory + "/version_counter.txt", "w")
-    temp_file.write("CREATED BY NICER_PLOT.PY, DO NOT MODIFY, DO NOT CHANGE THE FILE PATH\n")
-    temp_file.write("0\n")
-    temp_file.close()
+    atomicWrite(commonDirectory + "/version_counter.txt", ["CREATED BY NICER_PLOT.PY, DO NOT MODIFY, DO NOT CHANGE THE FILE PATH\n", "0\n"])
 #===========================================================================================
 # If clear variable is True, clear the contents of the output directories
 if delete_previous_files:
     print("Deleting all the previous graph and table files under 'results' directory..\n")
 
-    os.system("rm -r " + commonDirectory + "/results/model_graphs/*")
-    
-    os.system("rm -r " + commonDirectory + "/results/model_tables/*" )
-    
-    os.system("rm -r " + commonDirectory + "/results/flux_graphs/*")
-
-    os.system("rm -r " + commonDirectory + "/results/flux_tables/*")
-
-    os.system("rm -r " + commonDirectory + "/results/chi_squared_graphs/*")
+    for eachDir in ["model_graphs", "model_tables", "flux_graphs", "flux_tables", "chi_squared_graphs"]:
+        clearDirectory(commonDirectory + "/results/" + eachDir)
     
-    temp_file = open(commonDirectory + "/version_counter.txt", "w")
-    temp_file.write("CREATED BY NICER_PLOT.PY, DO NOT MODIFY, DO NOT CHANGE THE FILE PATH\n")
-    temp_file.write("0\n")
-    temp_file.close()
+    atomicWrite(commonDirectory + "/version_counter.txt", ["CREATED BY NICER_PLOT.PY, DO NOT MODIFY, DO NOT CHANGE THE FILE PATH\n", "0\n"])
 
 #===========================================================================================
 # Check whether enable_versioning is True, update the version file and extract the current version if that is the case.
@@ -266,23 +305,8 @@ for line in all_lines[1:]:
 
 #===========================================================================================
 # Open the input txt file, and extract the obsid numbers to a list
-searchedObsid = []
-
 try:
-    with open(scriptDir + "/" + inputTxtFile, "r") as file:
-        allLines = file.readlines()
-        for line in allLines:
-            line = line.replace(" ", "")
-            line = line.strip("\n")
-            if line != "" and Path(line).exists():
-                if line[-1] != "/":
-                    slashIdx = line.rfind("/")
-                    obsid = line[slashIdx+1 :]
-                else:
-                    slashIdx = line[:-1].rfind("/")
-                    obsid = line[slashIdx+1:-1]
-                
-                searchedObsid.append(obsid)
+    searchedObsid = readSearchedObsids(scriptDir + "/" + inputTxtFile)
 except Exception as e:
     print(f"Exception occured while opening {inputTxtFile}: {e}")
     quit()
@@ -292,530 +316,116 @@ if len(searchedObsid) == 0:
     quit()
 
 # Check whether any of the searched observations are processed, extract the necessary data if that is the case.
-iterationMax = 0
-searchedObservations = []
-if Path(commonDirectory + "/processed_obs.txt").exists() == False:
-    print("\nERROR: Could not find 'processed_obs.txt' file under the 'commonFiles' directory.")
-    print("Please make sure both the 'commonFiles' directory and the 'processed_obs.txt' files exist and are constructed as intended by nicer_create.py.\n")
+if Path(commonDirectory + "/" + registryFileName).exists() == False and Path(commonDirectory + "/processed_obs.txt").exists() == False:
+    print("\nERROR: Could not find the observation registry '" + registryFileName + "' under the 'commonFiles' directory.")
+    print("Please make sure both the 'commonFiles' directory and the registry exist and are constructed as intended by nicer_create.py.\n")
     quit()
-else:
-    try:
-        with open(commonDirectory + "/processed_obs.txt", "r") as filteredFile:
-            allLines = filteredFile.readlines()
-            for eachObsid in searchedObsid:
-                for line in allLines:
-                    line = line.strip("\n")
-                    lineElements = line.split(" ")
-
-                    if lineElements[1] == eachObsid:
-                        iterationMax += 1
-                        searchedObservations.append((lineElements[0], lineElements[1], lineElements[2]))
-    except Exception as e:
-        print(f"Exception occured while opening processed_obs.txt: {e}")
-        quit()
 
-if len(searchedObservations) == 0:
-    print("\nCould not find any matching observation paths in 'processed_obs.txt' with those in 'observations.txt', most likely them being filtered out due to having low exposure.")
+try:
+    searchedObservations = searchObservations(commonDirectory, searchedObsid)
+except Exception as e:
+    print(f"Exception occured while reading the observation registry: {e}")
     quit()
 
+if len(searchedObservations) == 0:
+    print("\nCould not find any matching observation paths in the observation registry with those in 'observations.txt', most likely them being filtered out due to having low exposure.")
+    quit()
 
-# Iterate through each of the observation data, and extract the necessary data from the parameter files
-for path, obsid, expo in searchedObservations:
-    outObsDir = path
 
-    try:
-        os.chdir(outObsDir)
-    except Exception as e:
-        print(f"Exception occured while changing directory to {outObsDir}: {e}")
-        continue
+# Read the parameters and fluxes of the latest fit of every searched observation from the results table with a single query
+model_folder_name = custom_name
+if model_folder_name == "":
+    model_folder_name = model_pipeline_name
 
-    allFiles = os.listdir(outObsDir)
-
-    additional_info = ""
-    if path[-3:] == "day":
-        additional_info = "day"
-    elif path[-5:] == "night":
-        additional_info = "night"
-
-    dict_key = str(obsid)
-    if additional_info != "":
-        dict_key += "_" + additional_info
-
-    # Find the data file and the best fitting model file for the current observation
-    missingFiles = True
-    foundParameterfile = False
-    foundModfile = False
-    foundSpectrum = False
-    for file in allFiles:
-        if "parameters_" in file:
-            parFile = file
-            foundParameterfile = True
-        elif "best_" in file:
-            modFile = file
-            foundModfile = True
-        elif file == "ni" + obsid + "mpu7_sr3c50.pha":
-            spectrumFile = file
-            foundSpectrum = True
-        
-        if foundSpectrum and foundModfile and foundParameterfile:
-            missingFiles = False
-            break
-    
-    # Check if there are any missing files
-    if missingFiles:
-        print("\nWARNING: Necessary files for retrieving parameters and plotting are missing for observation: " + obsid)
-        if foundSpectrum == False:
-            print("Missing spectrum file")
-        if foundModfile == False:
-            print("Missing model file")
-        if foundParameterfile == False:
-            print("Missing parameter file")
-        continue
-    
-    try:
-        hdu = fits.open(spectrumFile)
-    except Exception as e:
-        print(f"Exception occured while opening {spectrumFile}: {e}")
-        continue
-    
-    # Extract MJD
-    date = float(format(hdu[1].header["MJD-OBS"], ".3f"))
-    hdu.close()
+try:
+    registry = openRegistry(commonDirectory)
 
-    Xset.chatter = 0
-    try:
-        Xset.restore(modFile)
-    except Exception as e:
-        print(f"Exception occured while loading {modFile} to PyXspec")
-        continue
+    # Observations fitted before the results table existed only have their parameters_bestmodel.txt files
+    importedCount = importParameterFiles(registry, [(path, obsid) for path, obsid, expo in searchedObservations], model_folder_name)
+    if importedCount > 0:
+        print(f"The results of {importedCount} observations have been imported from their parameters_bestmodel.txt files.\n")
 
+    results = readLatestResults(registry, [(obsid, modeOfPath(path)) for path, obsid, expo in searchedObservations], model_folder_name)
+    registry.close()
+except Exception as e:
+    print(f"Exception occured while reading the fit results from the observation registry: {e}")
+    quit()
 
+# Observations fitted before their date was recorded, take the date from the header index of the spectrum files
+observationPaths = {(obsid, modeOfPath(path)): path for path, obsid, expo in searchedObservations}
+undatedKeys = sorted(set(zip(results["obsid"][np.isnan(results["mjd"])], results["mode"][np.isnan(results["mjd"])])))
+if undatedKeys != []:
+    spectrumFiles = {key: observationPaths[key] + "/" + spectralFileNames(key[0])[0] for key in undatedKeys}
     try:
-        file = open(parFile)
+        registry = openRegistry(commonDirectory)
+        spectrumHeaders = lookupHeaders(registry, list(spectrumFiles.values()))
+        registry.close()
     except Exception as e:
-        print(f"Exception occured while opening {parFile}: {e}")
-        continue
-
-    allLines = file.readlines()
-    for line in allLines[1:]:
-        # Extract the parameter values with associated uncertainities
-        line = line.strip("\n")
-        line = line.split(" ")
-        for i in range(len(line)):
-            line[i] = line[i].replace("_", " ")
-
-        line[1] = float(line[1])    # Parameter value
-        line[2] = line[1] - float(line[2])  # Error low
-        line[3] = float(line[3]) - line[1]  # Error high
-
-        # Check whether the parameter has a given unit in parameter file.
-        try:
-            test = line[4]
-        except:
-            line.append("")
+        print(f"Exception occured while reading the headers of the spectrum files: {e}")
+        spectrumHeaders = {}
 
-        par_list = [line[0], line[1], line[2], line[3], line[4], date]
-
-        if "flux" in par_list[0]:
-            if dict_key in fluxValuesDict:
-                fluxValuesDict[dict_key].append(par_list)
-            else:
-                fluxValuesDict[dict_key] = [par_list]
-        else:
-            if dict_key in otherParsDict:
-                otherParsDict[dict_key].append(par_list)
-            else:
-                otherParsDict[dict_key] = [par_list]
+    for key, spectrumFile in spectrumFiles.items():
+        headers = spectrumHeaders.get(spectrumFile)
+        if headers is None or headers["mjd"] is None:
+            print(f"Exception occured while reading 'MJD-OBS' from {spectrumFile}: {headers['error'] if headers is not None and headers['error'] != '' else 'keyword not found'}")
+            continue
+        results["mjd"][(results["obsid"] == key[0]) & (results["mode"] == key[1])] = headers["mjd"]
 
-otherpars_ref = 0
-fluxes_ref = 0
-empty_flag = True
+usableRows = np.isnan(results["mjd"]) == False
+parameterRows = usableRows & (results["kind"] == "parameter")
+fluxRows = usableRows & (results["kind"] == "flux")
 
 print("\n")
 
-#Find the referance point for the x-axis (date) for model parameters
-if len(otherParsDict) != 0:
-    empty_flag = False
-    dates = []
-
-    # Extract all dates in MJD
-    for obs_list in otherParsDict.values():
-        for value_list in obs_list:
-            dates.append(value_list[5])
-
-    referanceMjd = round((min(dates) - 5) / 5) * 5
-    otherpars_ref = referanceMjd
-
-    for key, obs_list in otherParsDict.items():
-        for value_list in obs_list:
-            value_list[5] = value_list[5] - referanceMjd
-else:
-    print("WARNING: Could not find any model parameters inside the parameter_bestmodel.txt file.")
+if np.any(parameterRows) == False:
+    print("WARNING: Could not find any model parameters in the results table of the observation registry.")
     print("Creating graph and table files will be skipped..\n")
 
-
-#Find the referance point for the x-axis (date) for flux values
-if len(fluxValuesDict) != 0:
-    empty_flag = False
-    dates = []
-
-    # Extract all dates in MJD
-    for obs_list in fluxValuesDict.values():
-        for value_list in obs_list:
-            dates.append(value_list[5])
-
-    referanceMjd = round((min(dates) - 5) / 5) * 5
-    fluxes_ref = referanceMjd
-
-    for key, obs_list in fluxValuesDict.items():
-        for value_list in obs_list:
-            value_list[5] = value_list[5] - referanceMjd
-else:
-    print("WARNING: Could not find any flux values inside the parameter_bestmodel.txt file.")
+if np.any(fluxRows) == False:
+    print("WARNING: Could not find any flux values in the results table of the observation registry.")
     print("Creating graph and table files will be skipped..\n")
 
-# Both flux dictionary and model dictionary are empty.
-if empty_flag:
-    print("\nERROR: Both dictionaries (parameter/flux) are empty. There is no data to create any graph.\n")
+# Both model parameters and fluxes are missing
+if np.any(parameterRows) == False and np.any(fluxRows) == False:
+    print("\nERROR: There are neither model parameters nor flux values. There is no data to create any graph.\n")
     quit()
 
+if use_outlier_detection:
+    print("="*100)
+    print(f"Outlier detection ({outlier_detection_method}) will be applied for model parameters and flux values")
+    print("="*100, "\n")
 
-# If otherParsDict is not empty, create the model parameter graphs and the table file
-if len(otherParsDict) != 0:
-    parameter_dict = {}
-
-    # Extract the the data from each observation to parameter_dict, where each key will be parameter names whereas values will be lists of parameter values
-    for obs_identifier, obs_list in otherParsDict.items():
-        for value_list in obs_list:
-            if value_list[0] not in parameter_dict:
-                parameter_dict[value_list[0]] = [[value_list[1]], [value_list[2]], [value_list[3]], [value_list[5]], value_list[4]]
-            else:
-                parameter_dict[value_list[0]][0].append(value_list[1])  # Value
-                parameter_dict[value_list[0]][1].append(value_list[2])  # Error low
-                parameter_dict[value_list[0]][2].append(value_list[3])  # Error high
-                parameter_dict[value_list[0]][3].append(value_list[5])  # Date
-
-    if use_outlier_detection:
-        print("="*100)
-        print("Modified z-score algorithm will be applied for model parameters")
-        print("="*100, "\n")
-
-        modified_z_score(parameter_dict)
-
-
-    fig, axs = plt.subplots(len(parameter_dict), 1, figsize=(8, 14), sharex=True)
-
-    shared_yaxis_flag = False
-    all_parameters = []
-    ax_num = 0
-    for par_name, par_list in parameter_dict.items():
-
-        # Add all unique parameters to all_parameters list
-        if par_name not in all_parameters:
-            all_parameters.append(par_name)
-
-        # Extract all lists necessary for graphs
-        x_axis = par_list[3]
-        y_axis = par_list[0]
-        err_low = par_list[1]
-        err_high = par_list[2]
-
-        # Check if shared y-axis title is given
-        shared_yaxis_title = par_list[4]
-        if shared_yaxis_title != "":
-            shared_yaxis_flag = True
-
-        axs[ax_num].errorbar(x_axis, y_axis, yerr=[err_low, err_high], fmt='o', color='black', ecolor="black", markersize=4, capsize=0)
-
-        axs[ax_num].tick_params(which = "both", direction="in")
-        axs[ax_num].yaxis.tick_left()
-
-        axs[ax_num].set_ylabel(par_name)
-        axs[ax_num].set_xlabel(f"Time (MJD-{otherpars_ref} days)")
-
-        ax_num += 1
-    
-    # Set minor ticks, also hide x-axis tick labels from all graphs except the last one
-    for ax in axs:
-        ax.xaxis.set_minor_locator(AutoMinorLocator())
-
-        if ax != axs[-1]:
-            ax.xaxis.set_tick_params(labelbottom=False)
-
-    # Set the title of the figure
-    fig.suptitle('Model Parameters', fontsize=20, y=0.95)
-
-    # Set a shared y-axis title, if it is given
-    if shared_yaxis_flag:
-        fig.text(0.9, 0.5, shared_yaxis_title, va='center', rotation='vertical')
-
-    plt.subplots_adjust(wspace=0, hspace=0, right=0.85)  
-
-    # Construct the file name of the graph
-    if enable_versioning:
-        png_name = commonDirectory + "/results/model_graphs/" + output_save_name + "_" + str(current_version) + ".png"
-    else:
-        png_name = commonDirectory + "/results/model_graphs/" + output_save_name + ".png"
-
-    # Delete any existing file with the same name, and create a new file
-    if Path(png_name).exists():
-        os.system("rm " + png_name)
-
-    # Save the graph file
-    plt.savefig(png_name)
-
-    # Initialize the table structure with lists, where each list denotes a column 
-    table_columns = []
-    for i in range(len(all_parameters)*3 + 2):
-        table_columns.append([])
-
-    # Column name of the first two columns
-    table_columns[0].append("Obsid")
-    table_columns[1].append("MJD")
-
-    # Column names of the rest of the columns
-    start_index = 2
-    for par in all_parameters:
-        par = par.replace(" ", "_")
-        table_columns[start_index].append(par)
-        table_columns[start_index + 1].append(par + "_errlow")
-        table_columns[start_index + 2].append(par + "_errhigh")
-        start_index += 3
-
-    # Create the obsid column
-    for obsid in otherParsDict.keys():
-        table_columns[0].append(obsid)
-
-    # Create the date column
-    for val in otherParsDict.values():
-        table_columns[1].append(val[0][5] + otherpars_ref)
-
-    # Create the rest of the columns
-    start_index = 2
-    for i in range(len(all_parameters)):
-        # Calculate the current column index (each parameter will have three columns: value, low error, high error)
-        current_index = start_index  + i*3
-
-        # Change the parameter name from the column to match with the name format in the dictionary
-        searched_par = table_columns[current_index][0].replace("_", " ")
-
-        for key, obs_list in otherParsDict.items():
-            added_par_flag = False
-
-            for val in obs_list:
-
-                par_name = val[0]
-                if par_name == searched_par:
-                    # The current parameter in the dictionary matches with the column name, extract the parameter values and set the flag to True
-                    added_par_flag = True
-
-                    table_columns[current_index].append(val[1])
-                    table_columns[current_index + 1].append(val[1] - val[2])
-                    table_columns[current_index + 2].append(val[1] + val[3])
-                    break
-            
-            # If the flag has not been set to True, it means the current observation does not have the searched parameter of the column. Set values as "-"
-            if added_par_flag == False:
-                table_columns[current_index].append("0")
-                table_columns[current_index + 1].append("0")
-                table_columns[current_index + 2].append("0")
-
-    # Set the table file name according to enable_versioning variable
-    table_file_name = ""
-    if enable_versioning:
-        table_file_name = commonDirectory + "/results/model_tables/" + output_save_name + "_" + str(current_version) + ".txt"
-    else:
-        table_file_name = commonDirectory + "/results/model_tables/" + output_save_name + ".txt"
-    
-    # Create the table file if it has not been already created
-    if Path(table_file_name).exists() == False:
-        os.system("touch " + table_file_name)
-    
-    # Override the table file's contents with the columns created within table_columns
-    with open(table_file_name, "w") as file:
-        for i in range(len(table_columns[0])):
-            line = ""
-            for each_line in table_columns:
-                line += str(each_line[i]) + " "
-        
-            line = line[:-1]
-            line += "\n"
-
-            file.write(line)
-
-    print("Graph and table files for model parameters have been successfully created:")
-    print("Graph path: " + png_name)
-    print("Table path: " + table_file_name + "\n")
-
-
-
-# If fluxValuesDict is not empty, create the model parameter graphs and the table file
-if len(fluxValuesDict) != 0:
-    parameter_dict = {}
+# Create the graphs and the table files of model parameters and fluxes
+for rowMask, title, graphName, tableName, description in [(parameterRows, "Model Parameters", "model_graphs", "model_tables", "model parameters"),
+                                                          (fluxRows, "Flux Values", "flux_graphs", "flux_tables", "flux values")]:
+    if np.any(rowMask) == False:
+        continue
 
-    # Extract the the data from each observation to parameter_dict, where each key will be parameter names whereas values will be lists of parameter values
-    for obs_identifier, obs_list in fluxValuesDict.items():
-        for value_list in obs_list:
-            if value_list[0] not in parameter_dict:
-                parameter_dict[value_list[0]] = [[value_list[1]], [value_list[2]], [value_list[3]], [value_list[5]], value_list[4]]
-            else:
-                parameter_dict[value_list[0]][0].append(value_list[1])  # Value
-                parameter_dict[value_list[0]][1].append(value_list[2])  # Error low
-                parameter_dict[value_list[0]][2].append(value_list[3])  # Error high
-                parameter_dict[value_list[0]][3].append(value_list[5])  # Date
+    pivot = pivotResults(rowMask)
+    keptValues = findOutliers(pivot)
 
     if use_outlier_detection:
-        print("="*100)
-        print("Modified z-score algorithm will be applied for flux values")
-        print("="*100, "\n")
-
-        modified_z_score(parameter_dict)
-
-    fig, axs = plt.subplots(len(parameter_dict), 1, figsize=(8, 14), sharex=True)
-
-    shared_yaxis_flag = False
-    all_parameters = []
-    ax_num = 0
-    for par_name, par_list in parameter_dict.items():
-
-        # Add all unique parameters to all_parameters list
-        if par_name not in all_parameters:
-            all_parameters.append(par_name)
-
-        # Extract all lists necessary for graphs
-        x_axis = par_list[3]
-        y_axis = par_list[0]
-        err_low = par_list[1]
-        err_high = par_list[2]
-
-        # Check if shared y-axis title is given
-        shared_yaxis_title = par_list[4]
-        if shared_yaxis_title != "":
-            shared_yaxis_flag = True
-
-        axs[ax_num].errorbar(x_axis, y_axis, yerr=[err_low, err_high], fmt='o', color='black', ecolor="black", markersize=4, capsize=0)
-
-        axs[ax_num].tick_params(which = "both", direction="in")
-        axs[ax_num].yaxis.tick_left()
-
-        axs[ax_num].set_ylabel(par_name)
-        axs[ax_num].set_xlabel(f"Time (MJD-{fluxes_ref} days)")
-
-        ax_num += 1
-    
-    # Set minor ticks, also hide x-axis tick labels from all graphs except the last one
-    for ax in axs:
-        ax.xaxis.set_minor_locator(AutoMinorLocator())
-
-        if ax != axs[-1]:
-            ax.xaxis.set_tick_params(labelbottom=False)
-
-    # Set the title of the figure
-    fig.suptitle('Flux Values', fontsize=20, y=0.95)
-
-    # Set a shared y-axis title, if it is given
-    if shared_yaxis_flag:
-        fig.text(0.9, 0.5, shared_yaxis_title, va='center', rotation='vertical')
+        # Outliers are only left out of the graph, they are kept in the table and flagged in the results table of the registry
+        flaggedObs, flaggedPars = np.nonzero((keptValues == False) & (np.isnan(pivot["value"]) == False))
+        flaggedValues = list(zip(pivot["resultsDirs"][flaggedObs], pivot["names"][flaggedPars]))
+        print(f"{len(flaggedValues)} {description} have been flagged as outliers and will not be shown on the graph.")
+        for obsIndex, parIndex in zip(flaggedObs, flaggedPars):
+            print("\t" + pivot["obsKeys"][obsIndex] + ": " + pivot["names"][parIndex] + " = " + str(pivot["value"][obsIndex, parIndex]))
 
-    plt.subplots_adjust(wspace=0, hspace=0, right=0.85)  
-
-    # Construct the file name of the graph
-    if enable_versioning:
-        png_name = commonDirectory + "/results/flux_graphs/" + output_save_name + "_" + str(current_version) + ".png"
-    else:
-        png_name = commonDirectory + "/results/flux_graphs/" + output_save_name + ".png"
-
-    # Delete any existing file with the same name, and create a new file
-    if Path(png_name).exists():
-        os.system("rm " + png_name)
-
-    # Save the graph file
-    plt.savefig(png_name)
-
-    # Initialize the table structure with lists, where each list denotes a column 
-    table_columns = []
-    for i in range(len(all_parameters)*3 + 2):
-        table_columns.append([])
-
-    # Column name of the first two columns
-    table_columns[0].append("Obsid")
-    table_columns[1].append("MJD")
-
-    # Column names of the rest of the columns
-    start_index = 2
-    for par in all_parameters:
-        par = par.replace(" ", "_")
-
-        table_columns[start_index].append(par)
-        table_columns[start_index + 1].append(par + "_errlow")
-        table_columns[start_index + 2].append(par + "_errhigh")
-        start_index += 3
-
-    # Create the obsid column
-    for obsid in fluxValuesDict.keys():
-        table_columns[0].append(obsid)
-
-    # Create the date column
-    for val in fluxValuesDict.values():
-        table_columns[1].append(val[0][5] + fluxes_ref)
-
-    # Create the rest of the columns
-    start_index = 2
-    for i in range(len(all_parameters)):
-        # Calculate the current column index (each parameter will have three columns: value, low error, high error)
-        current_index = start_index  + i*3
-
-        # Change the parameter name from the column to match with the name format in the dictionary
-        searched_par = table_columns[current_index][0]
-
-        for key, obs_list in fluxValuesDict.items():
-            added_par_flag = False
-
-            for val in obs_list:
-                
-                # Fix the parameter name to match searched parameter name format
-                par_name = val[0].replace(" ", "_")
-
-                if par_name == searched_par:
-                    # The current parameter in the dictionary matches with the column name, extract the parameter values and set the flag to True
-                    added_par_flag = True
-
-                    table_columns[current_index].append(val[1])
-                    table_columns[current_index + 1].append(val[1] - val[2])
-                    table_columns[current_index + 2].append(val[1] + val[3])
-                    break
-            
-            # If the flag has not been set to True, it means the current observation does not have the searched parameter of the column. Set values as "0"
-            if added_par_flag == False:
-                table_columns[current_index].append("0")
-                table_columns[current_index + 1].append("0")
-                table_columns[current_index + 2].append("0")
-
-    # Set the table file name according to enable_versioning variable
-    table_file_name = ""
-    if enable_versioning:
-        table_file_name = commonDirectory + "/results/flux_tables/" + output_save_name + "_" + str(current_version) + ".txt"
-    else:
-        table_file_name = commonDirectory + "/results/flux_tables/" + output_save_name + ".txt"
-    
-    # Create the table file if it has not been already created
-    if Path(table_file_name).exists() == False:
-        os.system("touch " + table_file_name)
-    
-    # Override the table file's contents with the columns created within table_columns
-    with open(table_file_name, "w") as file:
-        for i in range(len(table_columns[0])):
-            line = ""
-            for each_line in table_columns:
-                line += str(each_line[i]) + " "
-        
-            line = line[:-1]
-            line += "\n"
-
-            file.write(line)
-
-    print("Graph and table files for flux values have been successfully created:")
-    print("Graph path: " + png_name)
+        try:
+            registry = openRegistry(commonDirectory)
+            recordOutliers(registry, results["kind"][rowMask][0], pivot["resultsDirs"], flaggedValues, outlier_detection_method)
+            registry.close()
+        except Exception as e:
+            print(f"Exception occured while recording the outliers to the observation registry: {e}")
+
+    pageFiles, html_name, table_file_name = createGraphAndTable(pivot, keptValues, title, commonDirectory + "/results/" + graphName, commonDirectory + "/results/" + tableName)
+
+    print("Graph and table files for " + description + " have been successfully created:")
+    for png_name in pageFiles:
+        print("Graph path: " + png_name)
+    if html_name != "":
+        print("HTML path: " + html_name)
     print("Table path: " + table_file_name + "\n")
 
 #==========================================================================================
@@ -843,3 +453,11 @@ else:
     plt.savefig(commonDirectory + "/results/chi_squared_graphs/" + output_save_name + ".png")
 
 print("Chi-squared graph has been successfully created under '" + outputDir + "/commonFiles/results/chi_squared_graphs'")
+
+# Record the plotted observations to the observation registry
+try:
+    registry = openRegistry(commonDirectory)
+    setStageStatus(registry, [(path, "done") for path, obsid, expo in searchedObservations], "plot")
+    registry.close()
+except Exception as e:
+    print(f"Exception occured while updating the observation registry: {e}")
@@ -0,0 +1,135 @@
+# This is a NICER script for maintaining the product store under commonFiles, which holds the spectral files linked into the results folders
+# of nicer_fit.py. Usage:
+#   python3 nicer_store.py dedupe           -> replaces the copies of spectral files in old results folders with links to the store
+#   python3 nicer_store.py gc [--keep N]    -> removes all but the N latest results folders of each observation (if --keep is given),
+#                                              then removes the stored files that are no longer used by any results folder
+# Authors: Batuhan Bahçeci
+# Contact: batuhan.bahceci@sabanciuniv.edu
+
+from parameter import *
+from productstore import productStoreName, ingestProduct, placeProduct, collectGarbage
+from fitcache import loadDigestIndex, saveDigestIndex
+from filesystem import removePath
+from registry import registryFileName, openRegistry, allObservations
+from bootstrap import scriptDirectory
+import sys
+
+print("==============================================================================")
+print("\t\t\tRunning nicer_store.py\n")
+
+# Find the script's own path
+scriptDir = scriptDirectory(__file__)
+os.chdir(scriptDir)
+
+if outputDir == "":
+    outputDir = scriptDir
+
+commonDirectory = outputDir + "/commonFiles"
+productStoreDirectory = commonDirectory + "/" + productStoreName
+
+#========================================================== Input Checks ===========================================================
+arguments = sys.argv[1:]
+if len(arguments) == 0 or arguments[0] not in ["dedupe", "gc"]:
+    print("Usage: python3 nicer_store.py dedupe")
+    print("       python3 nicer_store.py gc [--keep N]")
+    quit()
+
+command = arguments[0]
+
+keepVersions = 0
+if "--keep" in arguments:
+    try:
+        keepVersions = int(arguments[arguments.index("--keep") + 1])
+        if keepVersions <= 0:
+            raise Exception()
+    except:
+        print("'--keep' must be followed by a positive integer, the number of latest results folders to be kept for each observation.")
+        quit()
+
+if Path(commonDirectory + "/" + registryFileName).exists() == False and Path(commonDirectory + "/processed_obs.txt").exists() == False:
+    print("\nCould not find the observation registry '" + registryFileName + "' under the 'commonFiles' directory.")
+    print(f"You need to create output files/directories by running {create_script_name} first.")
+    quit()
+#===================================================================================================================================
+
+#===================================================================================================================================
+# Functions
+def versionFoldersOf(path):
+    # Returns the results folders of an observation (e.g. model_2_5) as (version, folder path) tuples, from the latest to the oldest
+    folders = []
+    try:
+        allFiles = os.listdir(path + "/results")
+    except OSError:
+        return folders
+
+    for eachFile in allFiles:
+        versionText = eachFile[eachFile.rfind("_") + 1:]
+        if versionText.isnumeric() and os.path.isdir(path + "/results/" + eachFile):
+            folders.append((int(versionText), path + "/results/" + eachFile))
+
+    return sorted(folders, reverse=True)
+
+def isSpectralProduct(fileName):
+    return fileName.endswith(".pha") or fileName.endswith(".arf") or fileName.endswith(".rmf")
+#===================================================================================================================================
+
+try:
+    registry = openRegistry(commonDirectory)
+    observationPaths = [path for path, obsid, exposure in allObservations(registry)]
+    registry.close()
+except Exception as e:
+    print(f"Exception occured while reading the observation registry: {e}")
+    quit()
+
+if command == "dedupe":
+    digestIndex = loadDigestIndex(commonDirectory)
+    replacedFiles = 0
+    savedBytes = 0
+
+    for path in observationPaths:
+        for version, folder in versionFoldersOf(path):
+            for eachFile in os.listdir(folder):
+                filePath = folder + "/" + eachFile
+                if isSpectralProduct(eachFile) == False or os.path.islink(filePath):
+                    continue
+
+                stored = ingestProduct(productStoreDirectory, filePath, digestIndex)
+                if stored == "" or os.path.samefile(stored, filePath):
+                    continue
+
+                size = os.path.getsize(filePath)
+                method = placeProduct(stored, filePath)
+                if method == "":
+                    print(f"ERROR: Could not replace {filePath} with a link to the product store")
+                elif method != "copy":
+                    replacedFiles += 1
+                    savedBytes += size
+
+    saveDigestIndex(commonDirectory, digestIndex)
+    print(f"{replacedFiles} spectral files have been replaced with links to the product store, {savedBytes / 1024**2:.1f} MB has been freed.")
+
+elif command == "gc":
+    if keepVersions > 0:
+        removedFolders = 0
+        for path in observationPaths:
+            for version, folder in versionFoldersOf(path)[keepVersions:]:
+                if removePath(folder, recursive=True):
+                    removedFolders += 1
+
+        print(f"{removedFolders} old results folders have been removed, the latest {keepVersions} of each observation are kept.")
+
+    # Stored files that are still referenced through symbolic links
+    referencedObjects = set()
+    for path in observationPaths:
+        for version, folder in versionFoldersOf(path):
+            for eachFile in os.listdir(folder):
+                if os.path.islink(folder + "/" + eachFile):
+                    referencedObjects.add(os.path.realpath(folder + "/" + eachFile))
+
+    if Path(productStoreDirectory).exists():
+        removedObjects, freedBytes = collectGarbage(productStoreDirectory, referencedObjects)
+        print(f"{removedObjects} unused files have been removed from the product store, {freedBytes / 1024**2:.1f} MB has been freed.")
+
+# This file is created after importing variables from another python file
+if Path(scriptDir + "/__pycache__").exists():
+    removePath(scriptDir + "/__pycache__", recursive=True)
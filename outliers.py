@@ -0,0 +1,61 @@
+# This is a helper module for detecting outliers in fit results. Every function takes a 1D array, or a 2D array whose columns are
+# checked separately (e.g. observations as rows and parameters as columns), and returns a boolean mask of the same shape that is
+# True for the values to be kept. NaN values stand for missing values and are always kept.
+# Authors: Batuhan Bahçeci
+# Contact: batuhan.bahceci@sabanciuniv.edu
+
+import numpy as np
+
+outlierMethods = ["modified_z", "sigma_clip", "iqr"]
+
+def modifiedZScoreMask(values, lowerThreshold, upperThreshold):
+    # Modified z-score (Iglewicz & Hoaglin), using the mean absolute deviation for columns whose median absolute deviation is 0
+    values = np.asarray(values, dtype=float)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        median = np.nanmedian(values, axis=0)
+        mad = np.nanmedian(np.abs(values - median), axis=0)
+        meanAd = np.nanmean(np.abs(values - np.nanmean(values, axis=0)), axis=0)
+        scores = (values - median) / np.where(mad == 0, 1.253314 * meanAd, 1.486 * mad)
+
+    # Scores of constant columns are NaN, their values are kept
+    return np.logical_not((scores <= lowerThreshold) | (scores >= upperThreshold))
+
+def sigmaClipMask(values, threshold=3, maxIterations=10):
+    # Removes the values further than 'threshold' standard deviations from the mean, and repeats it with the remaining values until
+    # no more values are removed
+    values = np.asarray(values, dtype=float)
+    mask = np.isnan(values) == False
+
+    with np.errstate(invalid="ignore"):
+        for i in range(maxIterations):
+            remaining = np.where(mask, values, np.nan)
+            mean = np.nanmean(remaining, axis=0)
+            std = np.nanstd(remaining, axis=0)
+            newMask = mask & ((np.abs(values - mean) <= threshold * std) | (std == 0))
+            if np.array_equal(newMask, mask):
+                break
+            mask = newMask
+
+    return mask | np.isnan(values)
+
+def iqrMask(values, factor=1.5):
+    # Tukey's fences: keeps the values within [Q1 - factor * IQR, Q3 + factor * IQR]
+    values = np.asarray(values, dtype=float)
+    with np.errstate(invalid="ignore"):
+        q1, q3 = np.nanpercentile(values, [25, 75], axis=0)
+        iqr = q3 - q1
+        return ((values >= q1 - factor * iqr) & (values <= q3 + factor * iqr)) | np.isnan(values)
+
+def outlierMask(values, method, lowerThreshold=-10, upperThreshold=10, sigmaThreshold=3, iqrFactor=1.5):
+    if method == "modified_z":
+        return modifiedZScoreMask(values, lowerThreshold, upperThreshold)
+    elif method == "sigma_clip":
+        return sigmaClipMask(values, sigmaThreshold)
+    elif method == "iqr":
+        return iqrMask(values, iqrFactor)
+
+    raise ValueError(f"Unknown outlier detection method '{method}', use one of: " + ", ".join(outlierMethods))
+
+def applyMask(columns, mask):
+    # Applies the same mask to all columns, e.g. applyMask([dates, values, errLow, errHigh], mask)
+    return [np.asarray(column)[mask] for column in columns]
@@ -1,12 +1,7 @@
-import subprocess
+# This file only holds the configuration of the NICER scripts. PyXspec, astropy, numpy and matplotlib are imported by the scripts that use them,
+# so that reading the configuration (nicer_main.py, dry runs, input checks) does not load them.
 import os
 from pathlib import Path
-from xspec import *
-import numpy as np
-from astropy.io import fits
-import numpy as np
-import math
-import re
 #============================================ Common variables for all scripts =================================================
 
 # The directory where the output files will be created at (Leave it blank [outputDir = ""] if you want output files to be created under the same directory as all scripts)
@@ -21,6 +16,13 @@ resultsFile = "fit_results.log"
 # Write it in XSpec format
 energyFilter = "0.8 10."
 
+# If set to True, nicer_fit.py and nicer_flux.py record the time spent on each observation and each command (with the fit statistic before and after it,
+# and the number of fits and error calculations it has run) to commonFiles/telemetry.log. At its end, nicer_main.py writes the records of its run to
+# commonFiles/telemetry_trace.json (Chrome trace format, can be opened at chrome://tracing or https://ui.perfetto.dev) and commonFiles/telemetry.csv,
+# and prints the slowest observations and commands. Every run of nicer_main.py starts a new telemetry.log, the logs of the last 3 runs are kept as
+# telemetry.log.1, telemetry.log.2 and telemetry.log.3.
+use_telemetry = True
+
 #=============================================== nicer.main spesific variables =================================================
 # Script switches
 run_create_script = False
@@ -28,6 +30,14 @@ run_fit_script = True
 run_flux_script = True
 run_plot_script = True
 
+# If set to True, nicer_main.py runs nicer_create.py, nicer_fit.py and nicer_flux.py for each observation as soon as the previous script of that observation
+# has finished, instead of running each script for all observations before starting the next one. create_worker_count, fit_worker_count and flux_worker_count
+# are then the numbers of observations processed by each script at the same time, each in its own process. nicer_plot.py is run once at the end.
+# The scripts are run one after another for all observations if fix_parameters_after_sampling is True, since the sample must be fitted first.
+# Every script of every observation is run in a new Python process that imports PyXspec and astropy again (about 3 start-ups per observation instead
+# of one for the whole run), so streaming only pays off when the Nicer tasks and fits of an observation take much longer than these start-ups.
+stream_stages = False
+
 # Script names
 create_script_name = "nicer_create.py"
 fit_script_name = "nicer_fit.py"
@@ -51,6 +61,25 @@ createHighResLightCurves = True
 # Below variables will only be used if createHighResLightCurves is set to True, otherwise pirange=50-1000 and time resolution=1s will be set for all observations
 highResLcPiRanges = ["50-200", "200-600", "600-1000"]   # Please do not forget to give each interval in string form, and seperate them by comma
 highResLcTimeResInPwrTwo = -8    # Enter a value as a power of two smaller or equal than 0. Lc files will be names as such: 2^0 -> dt0.lc, 2^-8 -> dt8.lc etc.
+                                 # A list such as [-8, -4] creates the light curves of every PI range with each time resolution.
+highResLcConcurrency = 3   # Number of energy band light curves of an observation created at the same time (0 creates all of them at once)
+highResLcRetries = 1   # Number of times a light curve is created again if nicerl3-lc fails
+
+# If set to True, all light curves of an observation (the 1 second 50-1000 light curve and the high resolution ones) are binned by nicer_create.py
+# in a single pass over the cleaned event file, instead of running nicerl3-lc once for each of them. Time bins are aligned to the start of the first GTI,
+# and only the bins inside the GTIs are written.
+use_native_lightcurves = False
+
+# Observations (or day/night sub-directories of observations made after the light leak) with an exposure below minimum_exposure seconds are not fitted.
+# If prescreen_exposure is True, the exposure is estimated from the GTIs of the cleaned event file right after nicerl2 (and, for day/night
+# sub-directories, from the orbits in the mkf file before nicerl2), and the spectral and light curve tasks are not run for the observations below
+# minimum_exposure. The estimated exposure and the reason of each skipped observation are kept in the screening table of commonFiles/registry.sqlite.
+prescreen_exposure = True
+minimum_exposure = 100
+
+# Number of observations (or day/night sub-directories of observations made after the light leak) that will be processed by Nicer tasks at the same time.
+# Each observation runs in its own process with its own PFILES directory. Set it to 1 to process observations one by one, or to 0 to use all available cores.
+create_worker_count = 1
 
 #================================================= nicer.fit spesific variables ================================================
 # Nicer_fit will save all fit results under $output_dir/results directory with versioning.
@@ -83,9 +112,33 @@ ftestSignificance = 0.05
 
 chatterOn = False
 
+# If set to True, fit results are kept under commonFiles/fit_cache together with a hash of the spectral files, the model pipeline and the fit settings.
+# Observations whose files and settings have not changed since they were last fitted are restored from the cache instead of being fitted again.
+# The model files under commonFiles that the fits start from are also a part of the hash, so results are mostly restored when the model files are
+# removed before the fits (restartOnce). Nothing is restored if restartAlways is True. The cache can also be deleted safely at any time.
+use_fit_cache = False
+
+# If set to True, every model saved under commonFiles is also kept as a seed of its observation, and the fits start from the seed of the
+# observation closest in time (MJD) that has been fitted with the same model components, instead of the last saved model file.
+# If warm_start_interpolation is also True and there are seeds before and after an observation, the free parameters start from the values
+# linearly interpolated between them. Observations are sent to the fit workers in the order of their dates.
+# The seeds an observation starts from depend on which observations have already been fitted. With fit_worker_count > 1 or stream_stages = True this
+# depends on which fits finish first, so the results may change slightly from one run to the next. Set fit_worker_count = 1 for repeatable results.
+use_warm_start = False
+warm_start_interpolation = True
+
+# Number of observations that will be fitted at the same time. Each worker process owns its own Xspec session.
+# Set it to 1 to fit observations one by one, or to 0 to use all available cores.
+fit_worker_count = 1
+
 # If set to True, the script will run "shakefit" function to calculate the error boundaries and possibly converge the fit to better parameter values.
 errorCalculations = True
 
+# Number of parameters whose errors will be calculated at the same time by shakefit. Each worker restores the best fitting model from an xcm file
+# into its own Xspec session. Set it to 1 to calculate the errors one by one, or to 0 to use all available cores.
+# Note that every fit worker (fit_worker_count) starts its own shakefit workers.
+shakefit_worker_count = 1
+
 # If set to True, shakefit function will check whether powerlaw exists; if so, check whether its xspec error is bigger than 1 or not. If so, freeze its value at 'powerlawIndexToFreezeAt'
 checkPowerlawErrorAndFreeze = False
 powerlawIndexToFreezeAt = 1.7
@@ -116,6 +169,11 @@ last_absorption_model = "TBabs"
 # If set to true, bottom and top limits of parameters will be set to (value +/- 0.1) before fitting with cflux.
 restrict_parameters = True
 
+# Number of fluxes that will be calculated at the same time. Every (observation, flux component) pair is a separate task, run in a worker
+# that restores the data_ and best_ xcm files of the observation into its own Xspec session.
+# Set it to 1 to calculate the fluxes one by one, or to 0 to use all available cores.
+flux_worker_count = 1
+
 #================================================ nicer.plot spesific variables =================================================
 # If set to True, the script will create new graphs with a count/version number at the end instead of updating only one file.
 # e.g. model_parameters_1.png, model_parameters_2.png, ... As you continue to run the script, previous files will not be deleted.
@@ -130,10 +188,32 @@ delete_previous_files = False
 # e.g: custom_name = "", graph name: model_simpl_edge_1.png OR custom_name = "nH_fixed", graph name = nH_fixed_1.png
 custom_name = ""
 
-# Modified z-score algorithm will be used for outlier detection
+# Number of graph panels (one for each parameter) that will be drawn at the same time. Set it to 0 to use all available cores.
+plot_worker_count = 1
+
+# If set to a number of days, the graphs will be split into pages covering that many days each (e.g. model_2_3_page1.png, model_2_3_page2.png...).
+# Set it to 0 to put all observations on a single graph.
+plot_page_days = 0
+
+# Panels with more points than this are drawn as time bins (mean value, with error bars covering the lowest and the highest value in the bin).
+# Set it to 0 to always draw every point.
+plot_max_points = 1000
+
+# If set to True, an HTML file where each point can be inspected by hovering over it is created next to each graph
+export_html = False
+
+# If set to True, outliers will not be shown on the graphs. Flagged values are recorded in the results table of the observation registry.
 # Possibility of removing "good" data always exists, turn it on or off accordingly
 use_outlier_detection = False
 
+# Method used for outlier detection, applied to each parameter separately:
+# "modified_z" -> modified z-score outside of (outlier_lower_threshold, outlier_upper_threshold)
+# "sigma_clip" -> further than 'sigma_clip_threshold' standard deviations from the mean, repeated until no more values are removed
+# "iqr"        -> outside of [Q1 - iqr_factor * IQR, Q3 + iqr_factor * IQR]
+outlier_detection_method = "modified_z"
+sigma_clip_threshold = 3
+iqr_factor = 1.5
+
 # Lower threshold value for modified z-score algorithm (Change it according to your needs)
 outlier_lower_threshold = -10
 
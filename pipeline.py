@@ -0,0 +1,372 @@
+# This is a helper module that compiles a model pipeline defined in models.txt into a list of commands that nicer_fit.py executes
+# for every observation
+# Authors: Batuhan Bahçeci
+# Contact: batuhan.bahceci@sabanciuniv.edu
+
+import operator
+
+operator_mapping = {
+    ">": operator.gt,
+    ">=": operator.ge,
+    "<": operator.lt,
+    "<=": operator.le,
+    "==": operator.eq,
+    "!=": operator.ne
+}
+
+class PipelineSyntaxError(Exception):
+    pass
+
+#===================================================================================================================
+# Commands
+class PipelineCommand:
+    # Base class of all commands. 'lineNumber' and 'text' point to the line in models.txt that the command is compiled from.
+    name = ""
+
+    def __init__(self, lineNumber, text):
+        self.lineNumber = lineNumber
+        self.text = text
+
+class LoadCommand(PipelineCommand):
+    name = "load"
+
+    def __init__(self, lineNumber, text, expression):
+        super().__init__(lineNumber, text)
+        self.expression = expression
+
+class AssignCommand(PipelineCommand):
+    # Each assignment is a (component name, n'th occurence of the component, (parameter name, parameter value)) tuple.
+    # If 'useLast' is True, the occurence is taken from the last component added by addcomp while running the pipeline.
+    name = "assign"
+
+    def __init__(self, lineNumber, text, assignments, useLast):
+        super().__init__(lineNumber, text)
+        self.assignments = assignments
+        self.useLast = useLast
+
+class SearchCommand(PipelineCommand):
+    name = "search"
+
+    def __init__(self, lineNumber, text, path):
+        super().__init__(lineNumber, text)
+        self.path = path
+
+class FitCommand(PipelineCommand):
+    name = "fit"
+
+class SaveCommand(PipelineCommand):
+    name = "save"
+
+    def __init__(self, lineNumber, text, saveType):
+        super().__init__(lineNumber, text)
+        self.saveType = saveType
+
+class FtestCommand(PipelineCommand):
+    name = "ftest"
+
+    def __init__(self, lineNumber, text, option, infoTxt):
+        super().__init__(lineNumber, text)
+        self.option = option
+        self.infoTxt = infoTxt
+
+class AddcompCommand(PipelineCommand):
+    name = "addcomp"
+
+    def __init__(self, lineNumber, text, compName, placement, targetComp, calcChar, encapsulate):
+        super().__init__(lineNumber, text)
+        self.compName = compName
+        self.placement = placement
+        self.targetComp = targetComp
+        self.calcChar = calcChar
+        self.encapsulate = encapsulate
+
+class DelcompCommand(PipelineCommand):
+    name = "delcomp"
+
+    def __init__(self, lineNumber, text, compName, compNum):
+        super().__init__(lineNumber, text)
+        self.compName = compName
+        self.compNum = compNum
+
+class IfCommand(PipelineCommand):
+    # 'jump' is the index of the command right after the matching endif. If the condition is evaluated to False, execution continues from there.
+    # For model conditions, 'target' is the component name and 'condition' is either "exists" or "missing".
+    # For parameter conditions, 'target' is the (component name, parameter name) tuple and 'condition' is an (operator, value) tuple.
+    name = "if"
+
+    def __init__(self, lineNumber, text, checkModel, target, condition):
+        super().__init__(lineNumber, text)
+        self.checkModel = checkModel
+        self.target = target
+        self.condition = condition
+        self.jump = -1
+
+class SetpointCommand(PipelineCommand):
+    name = "setpoint"
+
+class ShakefitCommand(PipelineCommand):
+    name = "shakefit"
+
+class CompiledPipeline:
+    def __init__(self, pipelineName, commands):
+        self.pipelineName = pipelineName
+        self.commands = commands
+
+    def signature(self):
+        # Normalized text of all commands, which changes only if the pipeline itself changes
+        return self.pipelineName + "\n" + "\n".join(command.text for command in self.commands)
+
+#===================================================================================================================
+# Functions
+def splitComponentNumber(fullText):
+    # Splits an entry in the form of (n)name into n and name. Entries without the (n) prefix belong to the first occurence.
+    if fullText[0] != "(":
+        return 1, fullText
+
+    bracketIdx = fullText.find(")")
+    if bracketIdx == -1:
+        raise PipelineSyntaxError("Missing closing bracket in '" + fullText + "'")
+
+    try:
+        compNum = int(fullText[1:bracketIdx])
+    except ValueError:
+        raise PipelineSyntaxError("Component number in '" + fullText + "' is not an integer")
+
+    return compNum, fullText[bracketIdx + 1:]
+
+def splitParameterName(fullName):
+    nameParts = fullName.split(".")
+    if len(nameParts) != 2 or nameParts[0] == "" or nameParts[1] == "":
+        raise PipelineSyntaxError("'" + fullName + "' is not in the format component_name.parameter_name")
+
+    return nameParts[0], nameParts[1]
+
+def compileAssign(lineNumber, text, line):
+    useLast = False
+    entries = line[1:]
+    if len(entries) > 0 and entries[0] == "-last":
+        useLast = True
+        entries = entries[1:]
+
+    if len(entries) == 0:
+        raise PipelineSyntaxError("No parameters are given to assign")
+
+    assignments = []
+    for eachPar in entries:
+        colonIdx = eachPar.find(":")
+        if colonIdx == -1:
+            raise PipelineSyntaxError("'" + eachPar + "' is not in the format component_name.parameter_name:value")
+
+        if useLast:
+            compNum = 0
+            fullName = eachPar[:colonIdx]
+        else:
+            compNum, fullName = splitComponentNumber(eachPar[:colonIdx])
+
+        compName, parName = splitParameterName(fullName)
+        assignments.append((compName, compNum, (parName, eachPar[colonIdx + 1:])))
+
+    return AssignCommand(lineNumber, text, assignments, useLast)
+
+def compileSearch(lineNumber, text, line):
+    if len(line) < 2 or line[1] != "premodel":
+        raise PipelineSyntaxError("Only 'search premodel' is supported")
+
+    modelString = "".join(line[2:])
+    if modelString != "" and modelString[-1] == "/":
+        modelString = modelString[:-1]
+
+    return SearchCommand(lineNumber, text, modelString)
+
+def compileSave(lineNumber, text, line):
+    if len(line) != 2 or (line[1] != "model" and line[1] != "data"):
+        raise PipelineSyntaxError("Invalid parameter for the 'save' command, use 'save model' or 'save data'")
+
+    return SaveCommand(lineNumber, text, line[1])
+
+def compileFtest(lineNumber, text, line):
+    if len(line) < 2:
+        raise PipelineSyntaxError("Missing parameter for the 'ftest' command, use 'ftest nullhyp' or 'ftest perform'")
+
+    if line[1] == "nullhyp" or line[1] == "null" or line[1] == "nullhypothesis":
+        return FtestCommand(lineNumber, text, "nullhyp", "")
+
+    if line[1] == "perform":
+        infoTxt = ""
+        if len(line) > 2:
+            newStr = " ".join(line[2:])
+            if (newStr[0] != "\"" and newStr[0] != "'") or (newStr[-1] != "\"" and newStr[-1] != "'") or (newStr[0] != newStr[-1]) or len(newStr) < 2:
+                raise PipelineSyntaxError("Invalid parameter entry for 'ftest' command, the information text must be quoted")
+            infoTxt = newStr[1:-1]
+
+        return FtestCommand(lineNumber, text, "perform", infoTxt)
+
+    raise PipelineSyntaxError("Unknown parameter '" + line[1] + "' for the 'ftest' command")
+
+def compileAddcomp(lineNumber, text, line):
+    # addcomp edge after TBabs * [-wrap]
+    if len(line) > 6:
+        raise PipelineSyntaxError("addcomp function takes 6 parameters at maximum, more than 6 inputs were given.")
+    if len(line) < 5:
+        raise PipelineSyntaxError("addcomp function takes at least 5 parameters, e.g. 'addcomp edge after TBabs *'")
+
+    encapsulate = False
+    if len(line) == 6:
+        if line[5] != "-wrap":
+            raise PipelineSyntaxError("Invalid input for the the optional 'wrap' parameter.")
+        encapsulate = True
+
+    if line[2] != "before" and line[2] != "after":
+        raise PipelineSyntaxError("Incorrect entry for the placement of new component around the target component, use 'before' or 'after'")
+
+    if line[4] != "*" and line[4] != "+":
+        raise PipelineSyntaxError("Incorrect character for model expression, use '*' or '+'")
+
+    return AddcompCommand(lineNumber, text, line[1], line[2], line[3], line[4], encapsulate)
+
+def compileDelcomp(lineNumber, text, line):
+    if len(line) != 2:
+        raise PipelineSyntaxError("delcomp takes a single component name, e.g. 'delcomp (2)gaussian'")
+
+    compNum, compName = splitComponentNumber(line[1])
+    return DelcompCommand(lineNumber, text, compName, compNum)
+
+def compileIf(lineNumber, text, line):
+    if len(line) != 4:
+        raise PipelineSyntaxError("if statements are in the format 'if model name exists/missing' or 'if component.parameter operator value'")
+
+    if line[1] == "model":
+        if line[3].lower() != "exists" and line[3].lower() != "missing":
+            raise PipelineSyntaxError("Unknown parameter for checking models. Enter either 'missing' or 'exists'.")
+
+        return IfCommand(lineNumber, text, True, line[2], line[3].lower())
+
+    compName, parName = splitParameterName(line[1])
+    if line[2] not in operator_mapping:
+        raise PipelineSyntaxError("Unknown operator '" + line[2] + "', use one of: " + " ".join(operator_mapping.keys()))
+
+    try:
+        rhs = float(line[3])
+    except ValueError:
+        raise PipelineSyntaxError("'" + line[3] + "' is not a number")
+
+    return IfCommand(lineNumber, text, False, (compName, parName), (line[2], rhs))
+
+def compileSetpoint(lineNumber, text, line):
+    if len(line) != 2 or line[1] != "fix":
+        raise PipelineSyntaxError("Only 'setpoint fix' is supported")
+
+    return SetpointCommand(lineNumber, text)
+
+def compileSingleWord(commandClass):
+    def compileCommand(lineNumber, text, line):
+        if len(line) != 1:
+            raise PipelineSyntaxError("'" + line[0] + "' does not take any parameters")
+        return commandClass(lineNumber, text)
+    return compileCommand
+
+def compileLoad(lineNumber, text, line):
+    if len(line) < 2:
+        raise PipelineSyntaxError("Missing model expression for the 'load' command")
+
+    return LoadCommand(lineNumber, text, "".join(line[1:]))
+
+commandCompilers = {
+    "load": compileLoad,
+    "assign": compileAssign,
+    "search": compileSearch,
+    "fit": compileSingleWord(FitCommand),
+    "save": compileSave,
+    "ftest": compileFtest,
+    "addcomp": compileAddcomp,
+    "addc": compileAddcomp,
+    "delcomp": compileDelcomp,
+    "delc": compileDelcomp,
+    "if": compileIf,
+    "setpoint": compileSetpoint,
+    "shakefit": compileSingleWord(ShakefitCommand)
+}
+
+def compilePipeline(source, pipelineName):
+    # Compiles the pipeline named 'pipelineName' in the file 'source'. Returns (pipeline, errors, undefinedLines), where pipeline is
+    # None if there are any errors. Lines with undefined commands are returned separately, since the user may choose to skip them.
+    errors = []
+    undefinedLines = []
+
+    try:
+        with open(source, "r") as sourcefile:
+            lines = sourcefile.readlines()
+    except Exception as e:
+        return None, [f"Exception occured while opening {source}: {e}"], []
+
+    commands = []
+    if_stack = []
+    foundPipeline = False
+    foundEnd = False
+
+    lineCount = 0
+    for line in lines:
+        lineCount += 1
+        #===============    Preprocess the line    =======================
+        line = line.strip("\n\t ")
+
+        if len(line) == 0 or line[0] == "#":
+            continue
+
+        # Split the line into words, ignoring repeated spaces
+        line = [word for word in line.split(" ") if word != ""]
+        text = " ".join(line)
+        #=======================================
+
+        if line[0].lower() == "model":
+            if foundPipeline and not foundEnd:
+                errors.append("Line " + str(lineCount) + ": Trying to process another model pipeline, probably due to not using ENDMODEL keyword.")
+                break
+            if len(line) > 1 and line[1] == pipelineName:
+                # Found the target model name
+                foundPipeline = True
+            continue
+
+        if foundPipeline == False or foundEnd:
+            # The current line does not belong to the target pipeline
+            continue
+
+        if line[0].lower() == "endmodel":
+            # End of model pipeline
+            foundEnd = True
+            continue
+
+        if line[0] == "endif":
+            if len(if_stack) == 0:
+                errors.append("Line " + str(lineCount) + ": 'endif' without a matching 'if' statement")
+                continue
+
+            # Commands after endif are where a False if statement continues from
+            commands[if_stack.pop()].jump = len(commands)
+            continue
+
+        if line[0] not in commandCompilers:
+            undefinedLines.append((lineCount, text))
+            continue
+
+        try:
+            command = commandCompilers[line[0]](lineCount, text, line)
+        except PipelineSyntaxError as e:
+            errors.append("Line " + str(lineCount) + ": Invalid implementation of '" + line[0] + "' command: " + str(e))
+            continue
+
+        if command.name == "if":
+            if_stack.append(len(commands))
+
+        commands.append(command)
+
+    if foundPipeline == False or foundEnd == False:
+        errors.append("Model pipeline identifier '" + pipelineName + "' could not be found, or its definition does not end with ENDMODEL.")
+
+    for ifIndex in if_stack:
+        errors.append("Line " + str(commands[ifIndex].lineNumber) + ": 'if' statement without a matching 'endif'")
+
+    if len(errors) != 0:
+        return None, errors, undefinedLines
+
+    return CompiledPipeline(pipelineName, commands), errors, undefinedLines
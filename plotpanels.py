@@ -0,0 +1,128 @@
+# This is a helper module for drawing the parameter and flux graphs of nicer_plot.py. Each parameter panel is drawn separately with the
+# non-interactive Agg backend, so that the panels can be drawn by parallel worker processes and stacked into a single image afterwards.
+# Panels with more points than a given limit are drawn as time bins, and the same arrays can be exported to an interactive HTML file.
+# Authors: Batuhan Bahçeci
+# Contact: batuhan.bahceci@sabanciuniv.edu
+
+import html
+import numpy as np
+from matplotlib.figure import Figure
+from matplotlib.backends.backend_agg import FigureCanvasAgg
+from matplotlib.ticker import AutoMinorLocator
+import matplotlib.image
+from filesystem import atomicWrite
+
+# Size of a panel in inches, and the margins shared by all panels so that their axes line up when stacked
+panelWidth = 8
+panelHeight = 2
+panelDpi = 100
+panelMargins = {"left": 0.15, "right": 0.85}
+
+def binPanel(x, y, errLow, errHigh, keys, maxPoints):
+    # Returns the points of a panel, reduced to at most 'maxPoints' time bins if there are more points than that. A bin is drawn at the mean
+    # date and value of its points, with error bars covering the lowest and the highest value in the bin. 'maxPoints' = 0 disables binning.
+    panel = {"x": x, "y": y, "errLow": errLow, "errHigh": errHigh, "keys": keys, "count": len(x), "binned": False}
+    if maxPoints <= 0 or len(x) <= maxPoints:
+        return panel
+
+    edges = np.linspace(np.min(x), np.max(x), maxPoints + 1)
+    binIndex = np.clip(np.searchsorted(edges, x, side="right") - 1, 0, maxPoints - 1)
+
+    order = np.argsort(binIndex, kind="stable")
+    sortedBins = binIndex[order]
+    starts = np.flatnonzero(np.concatenate(([True], sortedBins[1:] != sortedBins[:-1])))
+    counts = np.diff(np.concatenate((starts, [len(order)])))
+
+    meanX = np.add.reduceat(x[order], starts) / counts
+    meanY = np.add.reduceat(y[order], starts) / counts
+    lowest = np.minimum.reduceat(y[order], starts)
+    highest = np.maximum.reduceat(y[order], starts)
+
+    panel.update({"x": meanX, "y": meanY, "errLow": meanY - lowest, "errHigh": highest - meanY, "binned": True,
+                  "keys": np.char.add(counts.astype(str), " observations")})
+    return panel
+
+def figureToArray(fig):
+    canvas = FigureCanvasAgg(fig)
+    canvas.draw()
+    return np.asarray(canvas.buffer_rgba()).copy()
+
+def renderPanel(task):
+    # Draws a single panel and returns it as an RGBA image array. This function is run by the plot workers.
+    height = panelHeight
+    if task["showXLabel"]:
+        height += 0.5
+
+    fig = Figure(figsize=(panelWidth, height), dpi=panelDpi)
+    # Panels are stacked without a gap, like subplots with hspace=0
+    fig.subplots_adjust(left=panelMargins["left"], right=panelMargins["right"], top=1, bottom=0.5 / height if task["showXLabel"] else 0)
+    ax = fig.add_subplot(1, 1, 1)
+
+    panel = task["panel"]
+    ax.errorbar(panel["x"], panel["y"], yerr=[panel["errLow"], panel["errHigh"]], fmt='o', color='black', ecolor="black", markersize=4 if panel["binned"] == False else 3, capsize=0)
+
+    ax.set_xlim(task["xlim"])
+    ax.tick_params(which = "both", direction="in")
+    ax.yaxis.tick_left()
+    ax.xaxis.set_minor_locator(AutoMinorLocator())
+    ax.set_ylabel(task["label"])
+
+    if task["unit"] != "":
+        ax.text(1.02, 0.5, task["unit"], transform=ax.transAxes, va='center', rotation='vertical')
+
+    if panel["binned"]:
+        ax.text(0.99, 0.95, f"{panel['count']} points in {len(panel['x'])} bins", transform=ax.transAxes, ha='right', va='top', fontsize=8)
+
+    if task["showXLabel"]:
+        ax.set_xlabel(task["xlabel"])
+    else:
+        ax.xaxis.set_tick_params(labelbottom=False)
+
+    return figureToArray(fig)
+
+def renderTitle(title):
+    fig = Figure(figsize=(panelWidth, 0.8), dpi=panelDpi)
+    fig.text(0.5, 0.4, title, fontsize=20, ha='center', va='center')
+    return figureToArray(fig)
+
+def savePanels(fileName, title, panelImages):
+    # Stacks the title and the panels on top of each other and saves them as a single image
+    matplotlib.image.imsave(fileName, np.vstack([renderTitle(title)] + list(panelImages)))
+
+def exportHtml(fileName, title, xlabel, panels):
+    # Writes the panels to a self-contained HTML file with one SVG graph for each parameter. Hovering over a point shows its observation,
+    # date and value. 'panels' are the dictionaries returned by binPanel, with the "label" and "unit" of the parameter added.
+    width, height, margin = 900, 220, 60
+    lines = ["<!DOCTYPE html>\n<html><head><meta charset='utf-8'><title>" + html.escape(title) + "</title>\n",
+             "<style>body{font-family:sans-serif} svg{display:block;margin-bottom:8px} circle:hover{fill:red}</style></head><body>\n",
+             "<h2>" + html.escape(title) + "</h2>\n"]
+
+    allX = np.concatenate([panel["x"] for panel in panels])
+    xMin, xMax = float(np.min(allX)), float(np.max(allX))
+    if xMax == xMin:
+        xMax = xMin + 1
+
+    for panel in panels:
+        lower = panel["y"] - panel["errLow"]
+        upper = panel["y"] + panel["errHigh"]
+        yMin, yMax = float(np.min(lower)), float(np.max(upper))
+        if yMax == yMin:
+            yMax = yMin + 1
+
+        px = margin + (panel["x"] - xMin) / (xMax - xMin) * (width - 2 * margin)
+        py = lambda values: height - margin / 2 - (values - yMin) / (yMax - yMin) * (height - margin)
+
+        lines.append(f"<svg width='{width}' height='{height}' xmlns='http://www.w3.org/2000/svg'>\n")
+        lines.append(f"<rect x='{margin}' y='{margin / 2}' width='{width - 2 * margin}' height='{height - margin}' fill='none' stroke='black'/>\n")
+        lines.append(f"<text x='5' y='15' font-size='12'>{html.escape(panel['label'] + ' ' + panel['unit'])}</text>\n")
+        lines.append(f"<text x='{margin}' y='{height - 5}' font-size='10'>{xMin:.3f}</text><text x='{width - margin}' y='{height - 5}' font-size='10' text-anchor='end'>{xMax:.3f}</text>\n")
+        lines.append(f"<text x='{margin - 4}' y='{margin / 2 + 10}' font-size='10' text-anchor='end'>{yMax:.4g}</text><text x='{margin - 4}' y='{height - margin / 2}' font-size='10' text-anchor='end'>{yMin:.4g}</text>\n")
+
+        for x, y, yLow, yHigh, key, date, value in zip(px, py(panel["y"]), py(lower), py(upper), panel["keys"], panel["x"], panel["y"]):
+            lines.append(f"<line x1='{x:.1f}' x2='{x:.1f}' y1='{yLow:.1f}' y2='{yHigh:.1f}' stroke='black'/>")
+            lines.append(f"<circle cx='{x:.1f}' cy='{y:.1f}' r='3'><title>{html.escape(str(key))} ({date:.3f}): {value:.6g}</title></circle>\n")
+
+        lines.append("</svg>\n")
+
+    lines.append("<p>" + html.escape(xlabel) + "</p></body></html>\n")
+    return atomicWrite(fileName, lines)
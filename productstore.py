@@ -0,0 +1,126 @@
+# This is a helper module that keeps a single copy of every spectral product (spectrum, background, arf and rmf files) under
+# commonFiles/product_store, named after the sha256 digest of its contents. The results folders of nicer_fit.py only hold links to it.
+# Authors: Batuhan Bahçeci
+# Contact: batuhan.bahceci@sabanciuniv.edu
+
+import os
+import fcntl
+from fitcache import fileDigest
+from filesystem import makeDirectory, removePath, copyFile
+
+productStoreName = "product_store"
+
+# ioctl request of Linux for cloning a file on copy-on-write file systems (btrfs, XFS...)
+FICLONE = 0x40049409
+
+def objectPath(storeDir, digest, extension):
+    return storeDir + "/" + digest[:2] + "/" + digest + extension
+
+def reflinkFile(source, destination):
+    # Creates a copy-on-write clone of the file. The clone shares the data blocks of the source until one of them is modified.
+    try:
+        with open(source, "rb") as sourceFile, open(destination, "wb") as destinationFile:
+            fcntl.ioctl(destinationFile.fileno(), FICLONE, sourceFile.fileno())
+    except OSError:
+        removePath(destination)
+        return False
+
+    return True
+
+def ingestProduct(storeDir, path, digestIndex=None):
+    # Adds the file to the store if a file with the same contents is not there yet, and returns the path of the stored object.
+    # Returns an empty string on failure.
+    try:
+        digest = fileDigest(path, digestIndex)
+    except OSError as e:
+        print(f"ERROR: Could not read {path}: {e}")
+        return ""
+
+    stored = objectPath(storeDir, digest, os.path.splitext(path)[1])
+    if os.path.exists(stored):
+        return stored
+
+    if makeDirectory(os.path.dirname(stored)) == False:
+        return ""
+
+    # The object is never linked to the original file, since the original may be modified in place when the observation is reprocessed
+    tempPath = stored + "." + str(os.getpid()) + ".tmp"
+    if reflinkFile(path, tempPath) == False and copyFile(path, tempPath) == False:
+        return ""
+
+    # Objects are shared by many results folders, make them read-only
+    os.chmod(tempPath, 0o444)
+    os.replace(tempPath, stored)
+
+    return stored
+
+def placeProduct(stored, destination):
+    # Makes the stored object available at 'destination' with the cheapest method the file system supports.
+    # Returns the name of the method used, or an empty string on failure.
+    removePath(destination)
+
+    try:
+        os.link(stored, destination)
+        return "hardlink"
+    except OSError:
+        pass
+
+    if reflinkFile(stored, destination):
+        return "reflink"
+
+    try:
+        os.symlink(os.path.relpath(stored, os.path.dirname(os.path.abspath(destination))), destination)
+        return "symlink"
+    except OSError:
+        pass
+
+    if copyFile(stored, destination):
+        return "copy"
+
+    return ""
+
+def linkFromStore(storeDir, path, destination, digestIndex=None):
+    # Adds the file to the store and places it at 'destination'. Returns False on failure.
+    stored = ingestProduct(storeDir, path, digestIndex)
+    if stored == "":
+        return False
+
+    if placeProduct(stored, destination) == "":
+        print(f"ERROR: Could not place {stored} at {destination}")
+        return False
+
+    return True
+
+def collectGarbage(storeDir, referencedObjects):
+    # Removes the objects that are not used by any results folder anymore. An object is in use if one of the results folders holds a hard link
+    # to it (its link count is above 1), or a symbolic link to it (listed in 'referencedObjects'). Returns the number of objects and bytes freed.
+    removedObjects = 0
+    freedBytes = 0
+
+    for shardDir, dirNames, fileNames in os.walk(storeDir):
+        for fileName in fileNames:
+            stored = shardDir + "/" + fileName
+            if fileName.endswith(".tmp"):
+                # Object that is being added by a running script
+                continue
+
+            try:
+                stat = os.stat(stored)
+            except OSError:
+                continue
+
+            if stat.st_nlink > 1 or os.path.realpath(stored) in referencedObjects:
+                continue
+
+            if removePath(stored):
+                removedObjects += 1
+                freedBytes += stat.st_size
+
+    # Remove the empty shard directories
+    for eachDir in os.listdir(storeDir):
+        try:
+            os.rmdir(storeDir + "/" + eachDir)
+        except OSError:
+            pass
+
+    return removedObjects, freedBytes
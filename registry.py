@@ -0,0 +1,198 @@
+# This is a helper module for the observation registry under commonFiles. The registry is a single SQLite file that keeps the output
+# directory, exposure, date (MJD-OBS) and the status of each script for every processed observation, keyed by the obsid and the
+# observation mode ("" for observations made before the light leak, "day" or "night" for the ones made after it). The fit results are kept in
+# the same file (see resultstore.py), as well as the seeds of the fits (see seeds.py) and the headers of the spectral files (see headerindex.py).
+# nicer_create.py fills the registry, the other scripts look up the observations they need from it.
+# Authors: Batuhan Bahçeci
+# Contact: batuhan.bahceci@sabanciuniv.edu
+
+import os
+import time
+import sqlite3
+from filesystem import atomicWrite
+
+registryFileName = "registry.sqlite"
+
+def openRegistry(commonDirectory):
+    # Opens (and creates if necessary) the registry. If the registry is empty but a processed_obs.txt file created by an older version of
+    # nicer_create.py exists, the observations in it are imported.
+    connection = sqlite3.connect(commonDirectory + "/" + registryFileName, timeout=60)
+    connection.execute("PRAGMA journal_mode=WAL")
+
+    with connection:
+        connection.execute("""CREATE TABLE IF NOT EXISTS observations (
+                                obsid TEXT NOT NULL,
+                                mode TEXT NOT NULL,
+                                path TEXT NOT NULL UNIQUE,
+                                exposure REAL,
+                                mjd REAL,
+                                PRIMARY KEY (obsid, mode))""")
+        connection.execute("""CREATE TABLE IF NOT EXISTS stages (
+                                obsid TEXT NOT NULL,
+                                mode TEXT NOT NULL,
+                                stage TEXT NOT NULL,
+                                status TEXT,
+                                updated REAL,
+                                PRIMARY KEY (obsid, mode, stage))""")
+        # Parameters and fluxes of the fitted observations, see resultstore.py
+        connection.execute("""CREATE TABLE IF NOT EXISTS results (
+                                results_dir TEXT NOT NULL,
+                                obsid TEXT NOT NULL,
+                                mode TEXT NOT NULL,
+                                mjd REAL,
+                                model TEXT NOT NULL,
+                                version INTEGER NOT NULL,
+                                kind TEXT NOT NULL,
+                                name TEXT NOT NULL,
+                                unit TEXT,
+                                value REAL,
+                                err_low REAL,
+                                err_high REAL,
+                                chi REAL,
+                                dof INTEGER,
+                                recorded REAL,
+                                outlier TEXT,
+                                PRIMARY KEY (results_dir, kind, name))""")
+        # Results tables created before outliers were recorded
+        resultsColumns = [row[1] for row in connection.execute("PRAGMA table_info(results)")]
+        if "outlier" not in resultsColumns:
+            connection.execute("ALTER TABLE results ADD COLUMN outlier TEXT")
+        connection.execute("CREATE INDEX IF NOT EXISTS results_by_observation ON results (obsid, mode, model, version)")
+        # Fit statistic of every recorded fit, which is kept even if the fit has no parameter rows (e.g. errorCalculations=False)
+        fitsExisted = connection.execute("SELECT COUNT(*) FROM sqlite_master WHERE type = 'table' AND name = 'fits'").fetchone()[0] > 0
+        connection.execute("""CREATE TABLE IF NOT EXISTS fits (
+                                results_dir TEXT NOT NULL PRIMARY KEY,
+                                obsid TEXT NOT NULL,
+                                mode TEXT NOT NULL,
+                                mjd REAL,
+                                model TEXT NOT NULL,
+                                version INTEGER NOT NULL,
+                                chi REAL,
+                                dof INTEGER,
+                                recorded REAL)""")
+        connection.execute("CREATE INDEX IF NOT EXISTS fits_by_observation ON fits (obsid, mode, model, version)")
+        if fitsExisted == False:
+            # Registries created before the fits table existed have the fit statistic only on the parameter rows
+            connection.execute("""INSERT OR IGNORE INTO fits (results_dir, obsid, mode, mjd, model, version, chi, dof, recorded)
+                                  SELECT results_dir, obsid, mode, mjd, model, version, chi, dof, MAX(recorded) FROM results
+                                  WHERE kind = 'parameter' GROUP BY results_dir""")
+        # Models saved by the fits as starting points for the other observations, and where the starting point of each fit came from (see seeds.py)
+        connection.execute("""CREATE TABLE IF NOT EXISTS seeds (
+                                path TEXT NOT NULL,
+                                modfile TEXT NOT NULL,
+                                obsid TEXT NOT NULL,
+                                mjd REAL NOT NULL,
+                                seed_file TEXT NOT NULL,
+                                parameters TEXT NOT NULL,
+                                recorded REAL,
+                                PRIMARY KEY (path, modfile))""")
+        connection.execute("CREATE INDEX IF NOT EXISTS seeds_by_date ON seeds (modfile, mjd)")
+        connection.execute("""CREATE TABLE IF NOT EXISTS seed_provenance (
+                                results_dir TEXT NOT NULL,
+                                modfile TEXT NOT NULL,
+                                method TEXT NOT NULL,
+                                sources TEXT,
+                                mjd_distance REAL,
+                                recorded REAL,
+                                PRIMARY KEY (results_dir, modfile))""")
+        # Exposure estimated by nicer_create.py before running the spectral and light curve tasks, and why an observation has been skipped
+        connection.execute("""CREATE TABLE IF NOT EXISTS screening (
+                                path TEXT NOT NULL PRIMARY KEY,
+                                obsid TEXT NOT NULL,
+                                mode TEXT NOT NULL,
+                                exposure REAL,
+                                source TEXT,
+                                reason TEXT,
+                                recorded REAL)""")
+        # Keywords read from the headers of the spectral files, valid until the size or modification time of a file changes (see headerindex.py)
+        connection.execute("""CREATE TABLE IF NOT EXISTS headers (
+                                path TEXT NOT NULL PRIMARY KEY,
+                                size INTEGER,
+                                mtime INTEGER,
+                                digest TEXT,
+                                valid INTEGER,
+                                error TEXT,
+                                extension TEXT,
+                                exposure REAL,
+                                mjd REAL,
+                                date_obs TEXT,
+                                counts REAL,
+                                recorded REAL)""")
+
+    registeredCount = connection.execute("SELECT COUNT(*) FROM observations").fetchone()[0]
+    if registeredCount == 0 and os.path.exists(commonDirectory + "/processed_obs.txt"):
+        importProcessedObs(connection, commonDirectory + "/processed_obs.txt")
+
+    return connection
+
+def modeOfPath(path):
+    # Observations made after the light leak are processed under 'day' and 'night' sub-directories
+    lastDirectory = os.path.basename(os.path.normpath(path))
+    if lastDirectory == "day" or lastDirectory == "night":
+        return lastDirectory
+    return ""
+
+def importProcessedObs(connection, processedObsFile):
+    rows = []
+    with open(processedObsFile, "r") as file:
+        for line in file.readlines():
+            lineElements = line.strip("\n").split(" ")
+            if len(lineElements) < 3:
+                continue
+            rows.append((lineElements[1], modeOfPath(lineElements[0]), lineElements[0], float(lineElements[2]), None))
+
+    registerObservations(connection, rows)
+
+def registerObservations(connection, rows, replaceAll=False):
+    # Adds or updates the observations given as (obsid, mode, path, exposure, mjd) tuples in a single transaction.
+    # If replaceAll is True, the observations that are not in 'rows' are removed from the registry.
+    with connection:
+        if replaceAll:
+            connection.execute("DELETE FROM observations")
+            connection.execute("DELETE FROM stages")
+
+        connection.executemany("""INSERT INTO observations (obsid, mode, path, exposure, mjd) VALUES (?, ?, ?, ?, ?)
+                                  ON CONFLICT (obsid, mode) DO UPDATE SET path=excluded.path, exposure=excluded.exposure, mjd=excluded.mjd""", rows)
+
+def lookupObservations(connection, obsidList):
+    # Returns the registered observations of the given obsids as (path, obsid, exposure) tuples, in the order of obsidList.
+    # Day and night sub-directories of the same obsid follow each other.
+    observations = []
+    for obsid in obsidList:
+        for path, exposure in connection.execute("SELECT path, exposure FROM observations WHERE obsid = ? ORDER BY mode", (obsid,)):
+            observations.append((path, obsid, exposure))
+
+    return observations
+
+def allObservations(connection):
+    # Returns all registered observations as (path, obsid, exposure) tuples, sorted by obsid
+    return connection.execute("SELECT path, obsid, exposure FROM observations ORDER BY CAST(obsid AS INTEGER), mode").fetchall()
+
+def setStageStatus(connection, statusList, stage):
+    # Records the status of a script for the observations given as (path, status) tuples, in a single transaction
+    with connection:
+        for path, status in statusList:
+            row = connection.execute("SELECT obsid, mode FROM observations WHERE path = ?", (path,)).fetchone()
+            if row is None:
+                continue
+
+            connection.execute("""INSERT INTO stages (obsid, mode, stage, status, updated) VALUES (?, ?, ?, ?, ?)
+                                  ON CONFLICT (obsid, mode, stage) DO UPDATE SET status=excluded.status, updated=excluded.updated""",
+                               (row[0], row[1], stage, status, time.time()))
+
+def recordScreening(connection, screeningList):
+    # Records the screened exposure of the processed directories, given as (path, obsid, exposure, source, reason) tuples. 'reason' is an
+    # empty string if the directory has passed the screening.
+    with connection:
+        connection.executemany("""INSERT INTO screening (path, obsid, mode, exposure, source, reason, recorded) VALUES (?, ?, ?, ?, ?, ?, ?)
+                                  ON CONFLICT (path) DO UPDATE SET exposure=excluded.exposure, source=excluded.source, reason=excluded.reason,
+                                  recorded=excluded.recorded""",
+                               [(path, obsid, modeOfPath(path), exposure, source, reason, time.time()) for path, obsid, exposure, source, reason in screeningList])
+
+def exportProcessedObs(connection, processedObsFile):
+    # Writes the registered observations to processed_obs.txt in its old "path obsid exposure" format, for reading it by eye or with other tools
+    lines = []
+    for path, obsid, exposure in allObservations(connection):
+        lines.append(path + " " + obsid + " " + str(exposure) + "\n")
+
+    return atomicWrite(processedObsFile, lines)
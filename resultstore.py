@@ -0,0 +1,176 @@
+# This is a helper module for the results table of the observation registry. nicer_fit.py and nicer_flux.py record every parameter and
+# flux as a typed row (obsid, mode, MJD, name, value, errors, chi-squared, dof, results folder version...), and nicer_plot.py reads the
+# rows of all observations with a single query instead of parsing the parameters_bestmodel.txt file of each observation. The chi-squared and
+# dof of every fit are also kept in the fits table, since a fit without error calculations has no parameter rows.
+# parameters_bestmodel.txt is still written as a readable export of the rows.
+# Authors: Batuhan Bahçeci
+# Contact: batuhan.bahceci@sabanciuniv.edu
+
+import os
+import time
+import numpy as np
+from filesystem import atomicWrite
+from registry import modeOfPath
+
+fluxUnit = "(10^-9 ergs cm^-2 s^-1)"
+
+# Columns returned by readLatestResults, in the order of the SELECT statement. 'outlier' is the name of the method that has flagged the value
+# as an outlier, or an empty string.
+resultColumns = ["results_dir", "obsid", "mode", "mjd", "model", "version", "kind", "name", "unit", "value", "err_low", "err_high", "chi", "dof", "outlier"]
+
+def resultsFolderOf(resultsDir):
+    # e.g. .../results/model_2_5 -> ("model_2", 5)
+    folderName = os.path.basename(os.path.normpath(resultsDir))
+    return folderName[:folderName.rfind("_")], int(folderName[folderName.rfind("_") + 1:])
+
+def insertRows(connection, resultsDir, obsid, mode, mjd, chi, dof, kind, rows):
+    # 'rows' are (name, unit, value, lower boundary, upper boundary) tuples, the boundaries are saved as the errors below and above the value
+    model, version = resultsFolderOf(resultsDir)
+    recorded = time.time()
+
+    records = []
+    for name, unit, value, lowerBound, upperBound in rows:
+        records.append((resultsDir, obsid, mode, mjd, model, version, kind, name, unit, value, value - min(lowerBound, upperBound),
+                        max(lowerBound, upperBound) - value, chi, dof, recorded))
+
+    connection.executemany("""INSERT INTO results (results_dir, obsid, mode, mjd, model, version, kind, name, unit, value, err_low, err_high, chi, dof, recorded)
+                              VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+                              ON CONFLICT (results_dir, kind, name) DO UPDATE SET value=excluded.value, err_low=excluded.err_low, err_high=excluded.err_high,
+                              unit=excluded.unit, mjd=excluded.mjd, chi=excluded.chi, dof=excluded.dof, recorded=excluded.recorded, outlier=NULL""", records)
+
+def recordFitResults(connection, resultsDir, path, obsid, mjd, chi, dof, parameters):
+    # Records the fit statistic and the parameters of a finished fit. The statistic is recorded to the fits table even if there are no
+    # parameters (e.g. with errorCalculations=False). The previous rows of the same results folder (including its fluxes) are removed, since
+    # they belong to an older fit of the same version.
+    if mjd is None:
+        row = connection.execute("SELECT mjd FROM observations WHERE path = ?", (path,)).fetchone()
+        if row is not None:
+            mjd = row[0]
+
+    model, version = resultsFolderOf(resultsDir)
+    with connection:
+        connection.execute("""INSERT OR REPLACE INTO fits (results_dir, obsid, mode, mjd, model, version, chi, dof, recorded)
+                              VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)""", (resultsDir, obsid, modeOfPath(path), mjd, model, version, chi, dof, time.time()))
+        connection.execute("DELETE FROM results WHERE results_dir = ?", (resultsDir,))
+        insertRows(connection, resultsDir, obsid, modeOfPath(path), mjd, chi, dof, "parameter", parameters)
+
+def hasFitResults(connection, resultsDir):
+    return connection.execute("SELECT COUNT(*) FROM fits WHERE results_dir = ?", (resultsDir,)).fetchone()[0] > 0
+
+def recordFluxResults(connection, resultsDir, path, obsid, fluxes):
+    # Replaces the fluxes of a results folder. The date and fit statistics are taken from the fit of the same folder, or from the
+    # observation registry if the fit has not been recorded.
+    row = connection.execute("SELECT mjd, chi, dof FROM fits WHERE results_dir = ?", (resultsDir,)).fetchone()
+    if row is None:
+        row = connection.execute("SELECT mjd, NULL, NULL FROM observations WHERE path = ?", (path,)).fetchone()
+    if row is None:
+        row = (None, None, None)
+
+    with connection:
+        connection.execute("DELETE FROM results WHERE results_dir = ? AND kind = 'flux'", (resultsDir,))
+        insertRows(connection, resultsDir, obsid, modeOfPath(path), row[0], row[1], row[2], "flux", fluxes)
+
+def readParameterFile(fileName, kind="parameter"):
+    # Reads a parameters_bestmodel.txt file written before the results table existed, and returns its parameters (or its fluxes if kind
+    # is "flux") as (name, unit, value, lower boundary, upper boundary) tuples
+    parameters = []
+    with open(fileName, "r") as file:
+        for line in file.readlines()[1:]:
+            lineElements = line.strip("\n").split(" ")
+            if len(lineElements) < 4 or ("flux" in lineElements[0]) != (kind == "flux"):
+                continue
+
+            unit = ""
+            if len(lineElements) > 4:
+                unit = lineElements[4].replace("_", " ")
+            parameters.append((lineElements[0].replace("_", " "), unit, float(lineElements[1]), float(lineElements[2]), float(lineElements[3])))
+
+    return parameters
+
+def parameterFileLines(rows):
+    # Lines of parameters_bestmodel.txt for the given (name, unit, value, lower boundary, upper boundary) tuples
+    lines = ["Parameter name | Parameter Value | Parameter Uncertainity Lower Boundary | Parameter Uncertainity Upper Boundary\n"]
+    for name, unit, value, lowerBound, upperBound in rows:
+        line = name.replace(" ", "_") + " " + str(value) + " " + str(lowerBound) + " " + str(upperBound)
+        if unit != "":
+            line += " " + unit.replace(" ", "_")
+        lines.append(line + "\n")
+
+    return lines
+
+def exportParameterFile(connection, resultsDir, fileName):
+    # Writes the parameters and fluxes of a results folder to a parameters_bestmodel.txt file
+    rows = []
+    for name, unit, value, errLow, errHigh in connection.execute("""SELECT name, unit, value, err_low, err_high FROM results WHERE results_dir = ?
+                                                                    ORDER BY kind DESC, rowid""", (resultsDir,)):
+        rows.append((name, unit, value, value - errLow, value + errHigh))
+
+    return atomicWrite(fileName, parameterFileLines(rows))
+
+def importParameterFiles(connection, observations, model):
+    # Records the parameters and fluxes of the observations given as (path, obsid) tuples that have no recorded fit of 'model' in the fits table,
+    # from the parameters_bestmodel.txt files written before the results table existed. The results folder is the latest version in
+    # results/version_counter.txt, as it was read by nicer_flux.py. Returns the number of imported observations.
+    importedCount = 0
+    for path, obsid in observations:
+        parameterFile = path + "/parameters_bestmodel.txt"
+        if os.path.exists(parameterFile) == False:
+            continue
+        if connection.execute("SELECT COUNT(*) FROM fits WHERE obsid = ? AND mode = ? AND model = ?", (obsid, modeOfPath(path), model)).fetchone()[0] > 0:
+            continue
+
+        try:
+            with open(path + "/results/version_counter.txt", "r") as file:
+                version = max(int(file.readlines()[1].strip("\n")) - 1, 0)
+        except Exception:
+            version = 0
+
+        resultsDir = path + "/results/" + model + "_" + str(version)
+        try:
+            recordFitResults(connection, resultsDir, path, obsid, None, None, None, readParameterFile(parameterFile))
+            fluxes = readParameterFile(parameterFile, "flux")
+            if fluxes != []:
+                recordFluxResults(connection, resultsDir, path, obsid, fluxes)
+        except Exception as e:
+            print(f"Exception occured while importing {parameterFile}: {e}")
+            continue
+
+        importedCount += 1
+
+    return importedCount
+
+def readLatestResults(connection, observations, model):
+    # Returns the rows of the latest results folder of 'model' for each of the observations given as (obsid, mode) tuples, as a dictionary of
+    # numpy arrays with resultColumns as keys. Rows are in the order of 'observations'.
+    order = {}
+    for obsid, mode in observations:
+        if (obsid, mode) not in order:
+            order[(obsid, mode)] = len(order)
+
+    rows = connection.execute("""SELECT r.results_dir, r.obsid, r.mode, r.mjd, r.model, r.version, r.kind, r.name, r.unit, r.value, r.err_low, r.err_high,
+                                 r.chi, r.dof, IFNULL(r.outlier, '')
+                                 FROM results r
+                                 WHERE r.model = ? AND r.version = (SELECT MAX(version) FROM results WHERE obsid = r.obsid AND mode = r.mode AND model = r.model)
+                                 ORDER BY r.kind DESC, r.rowid""", (model,)).fetchall()
+    rows = [row for row in rows if (row[1], row[2]) in order]
+    rows.sort(key=lambda row: order[(row[1], row[2])])
+
+    columns = {}
+    for i, column in enumerate(resultColumns):
+        values = [row[i] for row in rows]
+        if column in ["mjd", "value", "err_low", "err_high", "chi", "dof"]:
+            columns[column] = np.array([np.nan if value is None else value for value in values], dtype=float)
+        elif column == "version":
+            columns[column] = np.array(values, dtype=int)
+        else:
+            columns[column] = np.array(values, dtype=str)
+
+    return columns
+
+def recordOutliers(connection, kind, resultsDirs, flaggedValues, method):
+    # Flags the values given as (results folder, name) tuples as outliers found by 'method', and clears the previous flags of the other
+    # values of the same kind in the given results folders
+    with connection:
+        connection.executemany("UPDATE results SET outlier = NULL WHERE results_dir = ? AND kind = ?", [(resultsDir, kind) for resultsDir in resultsDirs])
+        connection.executemany("UPDATE results SET outlier = ? WHERE results_dir = ? AND kind = ? AND name = ?",
+                               [(method, resultsDir, kind, name) for resultsDir, name in flaggedValues])
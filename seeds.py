@@ -0,0 +1,75 @@
+# This is a helper module for starting the fits of nicer_fit.py from the results of the observations closest in time. Every model saved
+# to commonFiles by a fit is also kept as a seed under commonFiles/seeds, together with the date of its observation and its parameter
+# values in the seeds table of the observation registry. A fit searching for a model with the same components starts from the seed
+# of the nearest observation, or from the values interpolated between the nearest observations before and after it.
+# Authors: Batuhan Bahçeci
+# Contact: batuhan.bahceci@sabanciuniv.edu
+
+import os
+import json
+import time
+from filesystem import clearDirectory
+from registry import modeOfPath
+
+seedDirectoryName = "seeds"
+
+def seedFileName(seedDirectory, path, obsid, modFileName):
+    # e.g. commonFiles/seeds/6130010120_day_model_diskbbedgepowTBa.xcm
+    mode = modeOfPath(path)
+    if mode != "":
+        obsid += "_" + mode
+    return seedDirectory + "/" + obsid + "_" + modFileName
+
+def recordSeed(connection, path, obsid, mjd, modFileName, seedFile, parameters):
+    # 'parameters' are the Xspec values (value, delta, min, bottom, top, max) of each parameter, with component.parameter names as keys
+    with connection:
+        connection.execute("""INSERT INTO seeds (path, modfile, obsid, mjd, seed_file, parameters, recorded) VALUES (?, ?, ?, ?, ?, ?, ?)
+                              ON CONFLICT (path, modfile) DO UPDATE SET mjd=excluded.mjd, seed_file=excluded.seed_file, parameters=excluded.parameters,
+                              recorded=excluded.recorded""", (path, modFileName, obsid, mjd, seedFile, json.dumps(parameters), time.time()))
+
+def findNeighbours(connection, path, mjd, modFileName):
+    # Returns the seeds of the nearest other observations before and after 'mjd' with the same model components, as
+    # {"path", "obsid", "mjd", "seed_file", "parameters"} dictionaries (None if there is no such observation)
+    neighbours = []
+    for condition, order in [("mjd <= ?", "DESC"), ("mjd > ?", "ASC")]:
+        row = connection.execute(f"""SELECT path, obsid, mjd, seed_file, parameters FROM seeds WHERE modfile = ? AND path != ? AND {condition}
+                                     ORDER BY mjd {order} LIMIT 1""", (modFileName, path, mjd)).fetchone()
+        if row is None or os.path.exists(row[3]) == False:
+            neighbours.append(None)
+        else:
+            neighbours.append({"path": row[0], "obsid": row[1], "mjd": row[2], "seed_file": row[3], "parameters": json.loads(row[4])})
+
+    return neighbours[0], neighbours[1]
+
+def interpolateParameters(before, after, mjd):
+    # Linearly interpolates the values of the parameters that are free in both seeds. Returns {name: value}.
+    weight = (mjd - before["mjd"]) / (after["mjd"] - before["mjd"])
+
+    values = {}
+    for name, beforeValues in before["parameters"].items():
+        afterValues = after["parameters"].get(name)
+        if afterValues is None or len(beforeValues) < 6 or len(afterValues) < 6:
+            continue
+
+        # A negative delta means the parameter is frozen
+        if beforeValues[1] < 0 or afterValues[1] < 0:
+            continue
+
+        value = beforeValues[0] + weight * (afterValues[0] - beforeValues[0])
+        values[name] = min(max(value, beforeValues[2]), beforeValues[5])
+
+    return values
+
+def recordProvenance(connection, resultsDir, seedEntries):
+    # Records where the starting point of each searched model of a fit came from
+    with connection:
+        connection.execute("DELETE FROM seed_provenance WHERE results_dir = ?", (resultsDir,))
+        connection.executemany("""INSERT INTO seed_provenance (results_dir, modfile, method, sources, mjd_distance, recorded) VALUES (?, ?, ?, ?, ?, ?)
+                                  ON CONFLICT (results_dir, modfile) DO UPDATE SET method=excluded.method, sources=excluded.sources,
+                                  mjd_distance=excluded.mjd_distance, recorded=excluded.recorded""",
+                               [(resultsDir, entry["modfile"], entry["method"], " ".join(entry["sources"]), entry["distance"], time.time()) for entry in seedEntries])
+
+def clearSeeds(connection, seedDirectory):
+    with connection:
+        connection.execute("DELETE FROM seeds")
+    return clearDirectory(seedDirectory)
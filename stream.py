@@ -0,0 +1,116 @@
+# This is a helper module for nicer_main.py that runs nicer_create.py, nicer_fit.py and nicer_flux.py for each observation as soon as the
+# previous script of that observation has finished, instead of waiting for every observation at the end of each script. Each script is run
+# for a single observation with '--stream --obsid <obsid>', in its own process, and every script has its own number of processes that may run
+# at the same time. The output of each process is written to commonFiles/stream_logs/<obsid>_<stage>.log.
+# Authors: Batuhan Bahçeci
+# Contact: batuhan.bahceci@sabanciuniv.edu
+
+import os
+import sys
+import time
+import subprocess
+from collections import deque
+from filesystem import makeDirectory, removePath, removeMatching, atomicWrite
+from journal import readStage, startStage
+from registry import openRegistry, registerObservations
+from seeds import seedDirectoryName, clearSeeds
+
+streamLogDirectoryName = "stream_logs"
+
+def prepareStream(commonDirectory, journalPath, stageNames, resumeRun, restartModels, cleanObservations):
+    # Does the work that the scripts do once at their start when they are run for all observations: starting the journal of the fit and flux
+    # stages (unless the run is resumed), removing the results left unfinished by a crashed fit, the model files and seeds (restartOnce) and
+    # the registered observations (clean_obs_history)
+    makeDirectory(commonDirectory)
+
+    if "create" in stageNames and cleanObservations:
+        registry = openRegistry(commonDirectory)
+        registerObservations(registry, [], replaceAll=True)
+        registry.close()
+
+    if "create" in stageNames:
+        removePath(commonDirectory + "/pipeline_summary.log")
+
+    if "fit" in stageNames and resumeRun == False:
+        for entry in readStage(journalPath, "fit").values():
+            if entry["status"] == "allocated" and os.path.exists(entry["results_location"]):
+                print("Removing the partial results under " + entry["results_location"] + " left by the previous run\n")
+                removePath(entry["results_location"], recursive=True)
+        startStage(journalPath, "fit")
+
+        if restartModels:
+            print("Removing all model files under '" + commonDirectory + "'\n")
+            removeMatching(commonDirectory + "/mod*")
+            registry = openRegistry(commonDirectory)
+            clearSeeds(registry, commonDirectory + "/" + seedDirectoryName)
+            registry.close()
+
+    if "flux" in stageNames and resumeRun == False:
+        startStage(journalPath, "flux")
+
+def stageSucceeded(commonDirectory, obsid, stage, since):
+    # True if the script has recorded a "done" status for the observation (or for one of its day/night sub-directories) since 'since'
+    registry = openRegistry(commonDirectory)
+    row = registry.execute("SELECT COUNT(*) FROM stages WHERE obsid = ? AND stage = ? AND status = 'done' AND updated >= ?", (obsid, stage, since)).fetchone()
+    registry.close()
+    return row[0] > 0
+
+def runStream(stages, obsids, commonDirectory, scriptDir):
+    # 'stages' are (stage name, script path, arguments, number of processes) tuples in the order the scripts must be run. Every observation is
+    # started at the first stage, and moves to the next stage only if the script has succeeded for it. Returns the last stage each observation
+    # has succeeded at ("" if none).
+    logDirectory = commonDirectory + "/" + streamLogDirectoryName
+    makeDirectory(logDirectory)
+
+    queues = [deque() for stage in stages]
+    queues[0].extend(obsids)
+    running = [[] for stage in stages]
+    lastSucceeded = {obsid: "" for obsid in obsids}
+
+    while any(len(queue) > 0 for queue in queues) or any(len(processes) > 0 for processes in running):
+        for i, (stageName, scriptPath, arguments, processCount) in enumerate(stages):
+            # Collect the finished processes of this stage, and pass the successful observations to the next stage
+            stillRunning = []
+            for process, obsid, startTime, logFile in running[i]:
+                if process.poll() is None:
+                    stillRunning.append((process, obsid, startTime, logFile))
+                    continue
+
+                logFile.close()
+                succeeded = process.returncode == 0 and stageSucceeded(commonDirectory, obsid, stageName, startTime)
+                elapsed = time.time() - startTime
+                if succeeded:
+                    lastSucceeded[obsid] = stageName
+                    if i + 1 < len(stages):
+                        queues[i + 1].append(obsid)
+                    print(f"{stageName:<7} {obsid}: finished in {elapsed:.1f} s")
+                else:
+                    print(f"{stageName:<7} {obsid}: failed after {elapsed:.1f} s, see {logFile.name}")
+            running[i] = stillRunning
+
+            # Start new processes while there are free slots
+            while len(queues[i]) > 0 and len(running[i]) < processCount:
+                obsid = queues[i].popleft()
+                logFile = open(logDirectory + "/" + obsid + "_" + stageName + ".log", "w")
+                process = subprocess.Popen([sys.executable, scriptPath, "--stream", "--obsid", obsid] + list(arguments), cwd=scriptDir,
+                                           stdin=subprocess.DEVNULL, stdout=logFile, stderr=subprocess.STDOUT)
+                running[i].append((process, obsid, time.time(), logFile))
+
+        time.sleep(0.2)
+
+    return lastSucceeded
+
+def writeReducedChi(commonDirectory, obsids, modelName, resultsName):
+    # Writes reduced_chi.log (read by nicer_plot.py) from the latest fit of each observation in the fits table, in the same format as
+    # nicer_fit.py writes it when it fits all observations at once
+    lines = [modelName + "\n"]
+    registry = openRegistry(commonDirectory)
+    for obsid in obsids:
+        for mjd, chi, dof in registry.execute("""SELECT f.mjd, f.chi, f.dof FROM fits f WHERE f.obsid = ? AND f.model = ?
+                                                 AND f.version = (SELECT MAX(version) FROM fits WHERE obsid = f.obsid AND mode = f.mode AND model = f.model)
+                                                 ORDER BY f.mode""", (obsid, resultsName)):
+            if mjd is not None and chi is not None and dof:
+                lines.append(str(mjd) + " " + str(chi / dof) + "\n")
+    registry.close()
+
+    return atomicWrite(commonDirectory + "/reduced_chi.log", lines)
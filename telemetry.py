@@ -0,0 +1,162 @@
+# This is a helper module for measuring where the time of a campaign goes. The fit and flux scripts record a span for every observation and
+# for every command they run on it (wall time, fit statistic before and after, number of fits and error calculation calls), as JSON lines
+# appended to commonFiles/telemetry.log. nicer_main.py converts the spans of its run to a Chrome trace (open it at chrome://tracing or
+# https://ui.perfetto.dev) and a CSV file, and prints the slowest observations and commands.
+# Authors: Batuhan Bahçeci
+# Contact: batuhan.bahceci@sabanciuniv.edu
+
+import os
+import csv
+import json
+import time
+import fcntl
+from filesystem import atomicWrite
+
+telemetryFileName = "telemetry.log"
+# nicer_main.py starts a new telemetry.log at the start of every run, and the logs of the previous runs are kept as telemetry.log.1,
+# telemetry.log.2... A log that has grown larger than telemetryMaxBytes (e.g. by running the scripts on their own) is also started again.
+telemetryKeptLogs = 3
+telemetryMaxBytes = 50 * 1024 * 1024
+traceFileName = "telemetry_trace.json"
+csvFileName = "telemetry.csv"
+
+# Counters that are increased by the scripts (e.g. "fits" after each Fit.perform) and reported as the difference between the start and the
+# end of each span. Each process (and each worker) has its own copy.
+counters = {}
+
+# Where the spans of this process are recorded. An empty path disables telemetry.
+telemetryState = {"path": "", "stage": "", "obsid": ""}
+
+spanColumns = ["stage", "obsid", "name", "start", "duration", "pid", "status", "line", "flux_model", "stat_before", "stat_after", "fits", "error_calls", "draws"]
+
+def rotateTelemetry(telemetryPath, keep=telemetryKeptLogs):
+    # telemetry.log -> telemetry.log.1 -> ... -> telemetry.log.<keep>, the oldest log is overwritten
+    if os.path.exists(telemetryPath) == False:
+        return
+
+    try:
+        for i in range(keep, 0, -1):
+            source = telemetryPath if i == 1 else telemetryPath + "." + str(i - 1)
+            if os.path.exists(source):
+                os.replace(source, telemetryPath + "." + str(i))
+    except OSError as e:
+        print(f"WARNING: {telemetryPath} could not be rotated: {e}")
+
+def startTelemetry(telemetryPath, stage):
+    try:
+        if os.path.getsize(telemetryPath) > telemetryMaxBytes:
+            rotateTelemetry(telemetryPath)
+    except OSError:
+        pass
+
+    telemetryState["path"] = telemetryPath
+    telemetryState["stage"] = stage
+    telemetryState["obsid"] = ""
+
+def setObservation(obsid):
+    telemetryState["obsid"] = obsid
+
+def countEvent(name, amount=1):
+    counters[name] = counters.get(name, 0) + amount
+
+def startSpan(name, **info):
+    span = {"name": name, "start": time.time(), "clock": time.perf_counter(), "counters": dict(counters)}
+    span.update(info)
+    return span
+
+def finishSpan(span, **info):
+    # Records the span with its duration and the counters increased since it was started
+    if telemetryState["path"] == "":
+        return
+
+    entry = {"stage": telemetryState["stage"], "obsid": telemetryState["obsid"], "pid": os.getpid(), "duration": time.perf_counter() - span["clock"]}
+    for key, value in span.items():
+        if key not in ["clock", "counters"]:
+            entry[key] = value
+    for key, value in counters.items():
+        if value != span["counters"].get(key, 0):
+            entry[key] = value - span["counters"].get(key, 0)
+    entry.update(info)
+
+    try:
+        appendLine(telemetryState["path"], json.dumps(entry) + "\n")
+    except Exception as e:
+        print(f"WARNING: Telemetry could not be written to {telemetryState['path']}: {e}")
+
+def appendLine(fileName, line):
+    # Lines written by different worker processes never get mixed up since each one is written with one call under an exclusive lock
+    fd = os.open(fileName, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+    try:
+        fcntl.flock(fd, fcntl.LOCK_EX)
+        os.write(fd, line.encode())
+    finally:
+        os.close(fd)
+
+def readSpans(telemetryPath, since=0):
+    # Returns the spans that have been started after 'since' (seconds since the epoch)
+    spans = []
+    try:
+        with open(telemetryPath, "r") as file:
+            for line in file:
+                try:
+                    span = json.loads(line)
+                except Exception:
+                    continue
+                if span.get("start", 0) >= since:
+                    spans.append(span)
+    except FileNotFoundError:
+        pass
+
+    return spans
+
+def writeChromeTrace(spans, fileName):
+    # Each process is shown as a separate track, with the command spans nested under the observation spans
+    events = []
+    for span in spans:
+        args = {key: value for key, value in span.items() if key not in ["name", "start", "duration", "pid"]}
+        events.append({"name": span["name"], "cat": span.get("stage", ""), "ph": "X", "ts": span["start"] * 1e6, "dur": span["duration"] * 1e6,
+                       "pid": span.get("pid", 0), "tid": span.get("pid", 0), "args": args})
+
+    return atomicWrite(fileName, [json.dumps({"traceEvents": events, "displayTimeUnit": "ms"})])
+
+def writeCsv(spans, fileName):
+    tempFileName = fileName + ".tmp" + str(os.getpid())
+    try:
+        with open(tempFileName, "w", newline="") as file:
+            writer = csv.DictWriter(file, fieldnames=spanColumns, extrasaction="ignore")
+            writer.writeheader()
+            for span in spans:
+                writer.writerow(span)
+        os.replace(tempFileName, fileName)
+    except Exception as e:
+        print(f"Exception occured while writing {fileName}: {e}")
+        return False
+
+    return True
+
+def summaryLines(spans, count=10):
+    # Table of the slowest observations (total time of their observation spans in each stage) and the slowest commands (total time of
+    # each command in all observations)
+    observations = {}
+    commands = {}
+    for span in spans:
+        if span["name"] == "observation":
+            key = (span.get("stage", ""), span.get("obsid", ""))
+            observations[key] = observations.get(key, 0) + span["duration"]
+        else:
+            key = (span.get("stage", ""), span["name"])
+            total, calls, longest, fits, errorCalls = commands.get(key, (0, 0, 0, 0, 0))
+            commands[key] = (total + span["duration"], calls + 1, max(longest, span["duration"]), fits + span.get("fits", 0), errorCalls + span.get("error_calls", 0))
+
+    lines = []
+    if observations != {}:
+        lines.append(f"Slowest observations:\n{'Stage':<10} {'Obsid':<20} {'Time (s)':>10}\n")
+        for (stage, obsid), duration in sorted(observations.items(), key=lambda item: item[1], reverse=True)[:count]:
+            lines.append(f"{stage:<10} {obsid:<20} {duration:>10.2f}\n")
+
+    if commands != {}:
+        lines.append(f"\nSlowest commands:\n{'Stage':<10} {'Command':<20} {'Calls':>7} {'Total (s)':>10} {'Mean (s)':>10} {'Max (s)':>10} {'Fits':>7} {'Errors':>7}\n")
+        for (stage, name), (total, calls, longest, fits, errorCalls) in sorted(commands.items(), key=lambda item: item[1][0], reverse=True)[:count]:
+            lines.append(f"{stage:<10} {name:<20} {calls:>7} {total:>10.2f} {total / calls:>10.2f} {longest:>10.2f} {fits:>7} {errorCalls:>7}\n")
+
+    return lines
@@ -0,0 +1,10 @@
+# The NICER scripts and their helper modules are top-level files of the repository, so the repository root is added to the module path
+# Authors: Batuhan Bahçeci
+# Contact: batuhan.bahceci@sabanciuniv.edu
+
+import os
+import sys
+
+repositoryDir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if repositoryDir not in sys.path:
+    sys.path.insert(0, repositoryDir)
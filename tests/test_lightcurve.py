@@ -0,0 +1,141 @@
+# Tests of the native light curve builder in lightcurve.py, compared against a brute-force binning of the events
+# Authors: Batuhan Bahçeci
+# Contact: batuhan.bahceci@sabanciuniv.edu
+
+import os
+import numpy as np
+from astropy.io import fits
+from lightcurve import binsInGtis, buildLightCurves, lightCurveSuffix, findCleanedEventFile
+
+def bruteForceBins(gtiStarts, gtiStops, startTime, binSize, eventTimes):
+    # Loops over every bin between the first GTI start and the last GTI stop. Returns {bin index: (exposure, [event times])} for the
+    # bins with a positive exposure, where an event belongs to the bin [start + k * binSize, start + (k + 1) * binSize).
+    binCount = int(np.ceil((max(gtiStops) - startTime) / binSize)) + 1
+    bins = {}
+    for k in range(binCount):
+        binStart = startTime + k * binSize
+        binStop = binStart + binSize
+        exposure = sum(max(0.0, min(binStop, gtiStop) - max(binStart, gtiStart)) for gtiStart, gtiStop in zip(gtiStarts, gtiStops))
+        if exposure > 0:
+            bins[k] = (exposure, [time for time in eventTimes if binStart <= time < binStop])
+    return bins
+
+def writeEventFile(fileName, eventTimes, eventPis, gtiStarts, gtiStops):
+    events = fits.BinTableHDU.from_columns([fits.Column(name="TIME", format="D", array=np.asarray(eventTimes, dtype=float)),
+                                            fits.Column(name="PI", format="J", array=np.asarray(eventPis))], name="EVENTS")
+    events.header["TELESCOP"] = "NICER"
+    events.header["OBS_ID"] = "1234567890"
+    events.header["TSTART"] = float(min(gtiStarts))
+    events.header["TSTOP"] = float(max(gtiStops))
+    gti = fits.BinTableHDU.from_columns([fits.Column(name="START", format="D", array=np.asarray(gtiStarts, dtype=float)),
+                                         fits.Column(name="STOP", format="D", array=np.asarray(gtiStops, dtype=float))], name="GTI")
+    fits.HDUList([fits.PrimaryHDU(), events, gti]).writeto(fileName)
+
+def readLightCurve(fileName):
+    with fits.open(fileName) as hdu:
+        data = hdu["RATE"].data
+        return np.array(data["TIME"]), np.array(data["RATE"]), np.array(data["ERROR"]), np.array(data["FRACEXP"]), hdu["RATE"].header.copy()
+
+def test_bins_of_gtis_sharing_a_bin():
+    # Both GTIs overlap with the bin [4, 8) by 1 second each, and the second GTI starts in the middle of a bin
+    gtiStarts = np.array([0.0, 7.0])
+    gtiStops = np.array([5.0, 13.0])
+    bins, exposures = binsInGtis(gtiStarts, gtiStops, 0.0, 4.0)
+
+    assert np.array_equal(bins, [0, 1, 2, 3])
+    assert np.allclose(exposures, [4.0, 2.0, 4.0, 1.0])
+
+def test_bins_of_gtis_on_bin_edges():
+    # A GTI that ends on a bin edge does not add an empty bin after it, and a GTI shorter than a bin gets a single bin
+    gtiStarts = np.array([10.0, 30.0, 41.5])
+    gtiStops = np.array([20.0, 40.0, 41.75])
+    bins, exposures = binsInGtis(gtiStarts, gtiStops, 10.0, 2.0)
+
+    assert np.array_equal(bins, [0, 1, 2, 3, 4, 10, 11, 12, 13, 14, 15])
+    assert np.allclose(exposures, [2.0] * 10 + [0.25])
+
+def test_bins_match_brute_force():
+    generator = np.random.default_rng(7)
+    edges = np.sort(generator.uniform(100.0, 400.0, 20))
+    gtiStarts, gtiStops = edges[0::2], edges[1::2]
+    # Two GTIs that touch each other and one inside the same 1/8 s bin as the end of the previous one
+    gtiStarts = np.append(gtiStarts, [500.0, 510.0, 520.05])
+    gtiStops = np.append(gtiStops, [510.0, 520.0, 521.0])
+
+    for binSize in [2.0 ** -3, 1.0, 16.0]:
+        bins, exposures = binsInGtis(gtiStarts, gtiStops, gtiStarts[0], binSize)
+        expected = bruteForceBins(gtiStarts, gtiStops, gtiStarts[0], binSize, [])
+
+        assert list(bins) == sorted(expected.keys())
+        assert np.allclose(exposures, [expected[k][0] for k in bins])
+
+def test_light_curves_match_brute_force(tmp_path):
+    generator = np.random.default_rng(11)
+    gtiStarts = np.array([1000.0, 1023.3, 1030.0, 1100.0])
+    gtiStops = np.array([1020.5, 1030.0, 1064.0, 1100.2])
+
+    # Random events inside the GTIs, plus events exactly on the GTI edges
+    eventTimes = np.concatenate([generator.uniform(gtiStart, gtiStop, 200) for gtiStart, gtiStop in zip(gtiStarts, gtiStops)])
+    eventTimes = np.sort(np.concatenate([eventTimes, gtiStarts, gtiStops[:-1]]))
+    eventPis = generator.integers(0, 1200, len(eventTimes))
+    eventPis[:4] = [50, 200, 49, 201]
+
+    eventFile = str(tmp_path / "ni1234567890_0mpu7_cl.evt")
+    writeEventFile(eventFile, eventTimes, eventPis, gtiStarts, gtiStops)
+    assert findCleanedEventFile(str(tmp_path), "1234567890") == eventFile
+
+    curves = [("50-200", 0), ("200-1000", 0), ("50-200", -3), ("30 - 1200", 2)]
+    writtenFiles = buildLightCurves(eventFile, str(tmp_path), "1234567890", curves)
+    assert sorted(writtenFiles) == sorted([str(tmp_path) + "/ni1234567890mpu7_sr" + lightCurveSuffix(piRange, power) + ".lc" for piRange, power in curves])
+
+    for piRange, power in curves:
+        binSize = 2.0 ** power
+        piMin, piMax = [int(value) for value in piRange.replace(" ", "").split("-")]
+        bandTimes = eventTimes[(eventPis >= piMin) & (eventPis <= piMax)]
+        expected = bruteForceBins(gtiStarts, gtiStops, gtiStarts[0], binSize, bandTimes)
+        expectedBins = sorted(expected.keys())
+        expectedCounts = np.array([len(expected[k][1]) for k in expectedBins], dtype=float)
+        expectedExposures = np.array([expected[k][0] for k in expectedBins])
+
+        times, rates, errors, fracexp, header = readLightCurve(str(tmp_path) + "/ni1234567890mpu7_sr" + lightCurveSuffix(piRange, power) + ".lc")
+
+        assert np.allclose(times, gtiStarts[0] + (np.array(expectedBins) + 0.5) * binSize)
+        assert np.allclose(fracexp, expectedExposures / binSize, rtol=1e-6)
+        assert np.allclose(rates * fracexp * binSize, expectedCounts, rtol=1e-5)
+        assert np.allclose(errors, np.sqrt(expectedCounts) / expectedExposures, rtol=1e-5)
+        assert header["TIMEDEL"] == binSize
+        assert header["TIMEPIXR"] == 0.5
+        assert header["CHANMIN"] == piMin and header["CHANMAX"] == piMax
+        assert np.isclose(header["EXPOSURE"], (gtiStops - gtiStarts).sum())
+
+        # Every event in the band is counted once, except those on the stop of a GTI followed by a gap, whose bin has no exposure
+        lostEvents = [time for time in bandTimes if not any(binStart <= time < binStop for binStart, binStop in
+                      [(gtiStarts[0] + k * binSize, gtiStarts[0] + (k + 1) * binSize) for k in expectedBins])]
+        assert expectedCounts.sum() == len(bandTimes) - len(lostEvents)
+        assert all(np.isclose(time, gtiStops).any() for time in lostEvents)
+
+def test_events_on_gti_edges(tmp_path):
+    # GTIs [0, 2) and [3, 4) with 1 s bins: events on the starts are counted, the event on the stop at 2 falls into the bin [2, 3)
+    # which has no exposure, and the event at 3 is in the bin that starts with the second GTI
+    eventTimes = [0.0, 1.999, 2.0, 3.0, 3.5]
+    eventFile = str(tmp_path / "events_cl.evt")
+    writeEventFile(eventFile, eventTimes, [100] * len(eventTimes), [0.0, 3.0], [2.0, 4.0])
+    assert findCleanedEventFile(str(tmp_path), "0000000000") == eventFile
+
+    lightCurve, = buildLightCurves(eventFile, str(tmp_path), "0000000000", [("50-200", 0)])
+    times, rates, errors, fracexp, header = readLightCurve(lightCurve)
+
+    assert np.allclose(times, [0.5, 1.5, 3.5])
+    assert np.allclose(fracexp, [1.0, 1.0, 1.0])
+    assert np.allclose(rates, [1.0, 1.0, 2.0])
+
+def test_existing_light_curve_is_replaced(tmp_path):
+    eventFile = str(tmp_path / "ni0000000001_0mpu7_cl.evt")
+    writeEventFile(eventFile, [0.5, 1.5], [100, 100], [0.0], [2.0])
+    lightCurve = str(tmp_path / ("ni0000000001mpu7_sr" + lightCurveSuffix("50-200", 0) + ".lc"))
+    with open(lightCurve, "w") as file:
+        file.write("left behind by a failed run")
+
+    assert buildLightCurves(eventFile, str(tmp_path), "0000000001", [("50-200", 0)]) == [lightCurve]
+    assert np.allclose(readLightCurve(lightCurve)[1], [1.0, 1.0])
+    assert [name for name in os.listdir(tmp_path) if ".tmp" in name] == []
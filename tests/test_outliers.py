@@ -0,0 +1,112 @@
+# Tests of the outlier masks in outliers.py
+# Authors: Batuhan Bahçeci
+# Contact: batuhan.bahceci@sabanciuniv.edu
+
+import numpy as np
+import pytest
+from outliers import outlierMethods, outlierMask, modifiedZScoreMask, sigmaClipMask, iqrMask, applyMask
+
+# 19 well-behaved values around 10 and a single outlier at the end
+regularValues = np.linspace(9, 11, 19)
+valuesWithOutlier = np.append(regularValues, 50.0)
+
+def maskOf(values, method):
+    return outlierMask(values, method, lowerThreshold=-3.5, upperThreshold=3.5)
+
+@pytest.mark.parametrize("method", outlierMethods)
+def test_known_outlier_is_removed(method):
+    mask = maskOf(valuesWithOutlier, method)
+
+    assert mask.shape == valuesWithOutlier.shape
+    assert mask.dtype == bool
+    assert mask[:-1].all()
+    assert mask[-1] == False
+
+@pytest.mark.parametrize("method", outlierMethods)
+def test_low_outlier_is_removed(method):
+    values = np.append(regularValues, -30.0)
+    mask = maskOf(values, method)
+
+    assert mask[:-1].all()
+    assert mask[-1] == False
+
+@pytest.mark.parametrize("method", outlierMethods)
+def test_values_without_outliers_are_kept(method):
+    assert maskOf(regularValues, method).all()
+
+@pytest.mark.parametrize("method", outlierMethods)
+def test_nan_values_are_kept_and_ignored(method):
+    values = np.concatenate([[np.nan], valuesWithOutlier[:10], [np.nan], valuesWithOutlier[10:]])
+    mask = maskOf(values, method)
+
+    assert mask[0] == True
+    assert mask[11] == True
+    assert mask[-1] == False
+    assert mask.sum() == len(values) - 1
+
+    # The NaN values do not change the decision for the other values
+    assert np.array_equal(mask[~np.isnan(values)], maskOf(valuesWithOutlier, method))
+
+@pytest.mark.parametrize("method", outlierMethods)
+def test_constant_column_is_kept(method):
+    # The median absolute deviation, the standard deviation and the IQR are all 0
+    values = np.full(12, 4.2)
+
+    assert maskOf(values, method).all()
+
+def test_modified_z_uses_mean_absolute_deviation_when_mad_is_zero():
+    # More than half of the values are equal, so the MAD is 0 and the mean absolute deviation is used instead
+    values = np.append(np.full(9, 1.0), 100.0)
+    mask = modifiedZScoreMask(values, -3.5, 3.5)
+
+    assert mask[:-1].all()
+    assert mask[-1] == False
+
+    # 99 / (1.253314 * 17.82) is about 4.43, which is below a threshold of 10
+    assert modifiedZScoreMask(values, -10, 10).all()
+
+def test_modified_z_thresholds_are_inclusive():
+    values = np.array([0.0, 1.0, 2.0, 3.0, 4.0])
+    # median 2, MAD 1, so the scores are (x - 2) / 1.486
+    scores = (values - 2) / 1.486
+
+    assert np.array_equal(modifiedZScoreMask(values, scores[0], scores[-1]), [False, True, True, True, False])
+
+def test_sigma_clip_iterates_until_stable():
+    # The second outlier is only found after the first one has been removed
+    values = np.concatenate([regularValues, [14.0, 1000.0]])
+    mask = sigmaClipMask(values, threshold=3)
+
+    assert mask[:-2].all()
+    assert mask[-2] == False
+    assert mask[-1] == False
+
+def test_iqr_fences_are_inclusive():
+    # Q1 = 2 and Q3 = 4 whatever the largest value is, so the upper fence is at 7
+    values = np.array([1.0, 2.0, 2.0, 3.0, 3.0, 3.0, 4.0, 4.0])
+
+    assert iqrMask(np.append(values, 7.0)).all()
+    assert np.array_equal(iqrMask(np.append(values, 7.01)), [True] * 8 + [False])
+
+@pytest.mark.parametrize("method", outlierMethods)
+def test_columns_are_checked_separately(method):
+    # The outlier of each column is at a different row, and the constant column with NaN values is kept
+    values = np.column_stack([valuesWithOutlier, np.roll(valuesWithOutlier, 5), np.where(np.arange(20) % 4 == 0, np.nan, 3.0)])
+    mask = maskOf(values, method)
+
+    assert mask.shape == values.shape
+    assert np.array_equal(np.where(~mask[:, 0])[0], [19])
+    assert np.array_equal(np.where(~mask[:, 1])[0], [4])
+    assert mask[:, 2].all()
+
+def test_unknown_method():
+    with pytest.raises(ValueError):
+        outlierMask(regularValues, "grubbs")
+
+def test_apply_mask_to_all_columns():
+    dates = np.arange(20)
+    mask = maskOf(valuesWithOutlier, "iqr")
+    keptDates, keptValues = applyMask([dates, list(valuesWithOutlier)], mask)
+
+    assert np.array_equal(keptDates, np.arange(19))
+    assert np.array_equal(keptValues, regularValues)
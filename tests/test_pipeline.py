@@ -0,0 +1,140 @@
+# Tests of the models.txt compiler in pipeline.py
+# Authors: Batuhan Bahçeci
+# Contact: batuhan.bahceci@sabanciuniv.edu
+
+import os
+import operator
+from conftest import repositoryDir
+from pipeline import operator_mapping, compilePipeline, LoadCommand, AssignCommand, SearchCommand, FitCommand, SaveCommand, FtestCommand, AddcompCommand, IfCommand, SetpointCommand
+
+modelsFile = os.path.join(repositoryDir, "models.txt")
+
+def writeModels(tmp_path, text, fileName="models.txt"):
+    source = tmp_path / fileName
+    source.write_text(text)
+    return str(source)
+
+def commandTypes(pipeline):
+    return [type(command) for command in pipeline.commands]
+
+def test_model_1_compiles_with_if_jump():
+    pipeline, errors, undefinedLines = compilePipeline(modelsFile, "model_1")
+
+    assert errors == []
+    assert undefinedLines == []
+    assert pipeline.pipelineName == "model_1"
+    assert commandTypes(pipeline)[:8] == [LoadCommand, AssignCommand, SearchCommand, AssignCommand, SetpointCommand, FitCommand, SaveCommand, FtestCommand]
+    assert pipeline.commands[0].expression == "TBabs*pcfabs(gaussian+diskbb)"
+
+    # 'if edge.MaxTau < 1e-4' jumps over its single assign to the 'fit' after 'endif'
+    ifIndices = [i for i, command in enumerate(pipeline.commands) if isinstance(command, IfCommand)]
+    assert len(ifIndices) == 1
+    ifCommand = pipeline.commands[ifIndices[0]]
+    assert ifCommand.checkModel == False
+    assert ifCommand.target == ("edge", "MaxTau")
+    assert ifCommand.condition == ("<", 1e-4)
+    assert ifCommand.jump == ifIndices[0] + 2
+    assert isinstance(pipeline.commands[ifCommand.jump - 1], AssignCommand)
+    assert isinstance(pipeline.commands[ifCommand.jump], FitCommand)
+
+    # 'assign -last' refers to the component added by the previous addcomp
+    lastAssigns = [command for command in pipeline.commands if isinstance(command, AssignCommand) and command.useLast]
+    assert len(lastAssigns) == 3
+    assert lastAssigns[0].assignments[0] == ("gaussian", 0, ("LineE", "6.98,,6.8,6.8,7.5,7.5"))
+
+    addcomps = [command for command in pipeline.commands if isinstance(command, AddcompCommand)]
+    assert [(command.compName, command.placement, command.targetComp, command.calcChar, command.encapsulate) for command in addcomps][:2] == \
+           [("edge", "after", "TBabs", "*", False), ("gaussian", "before", "diskbb", "+", True)]
+
+def test_model_2_compiles():
+    pipeline, errors, undefinedLines = compilePipeline(modelsFile, "model_2")
+
+    assert errors == []
+    assert undefinedLines == []
+    assert commandTypes(pipeline) == [LoadCommand, AssignCommand, SearchCommand, SetpointCommand, FitCommand, SaveCommand, FtestCommand,
+                                      AddcompCommand, AssignCommand, SearchCommand, IfCommand, AssignCommand, FitCommand, SaveCommand,
+                                      FtestCommand, FitCommand, SaveCommand]
+
+    ifCommand = pipeline.commands[10]
+    assert ifCommand.target == ("powerlaw", "PhoIndex")
+    assert ifCommand.condition == (">", 8.0)
+    assert ifCommand.jump == 12
+    assert pipeline.commands[14].option == "perform"
+    assert pipeline.commands[6].option == "nullhyp"
+
+def test_signature_depends_only_on_the_commands(tmp_path):
+    source = writeModels(tmp_path, "MODEL a\n\nload  TBabs*powerlaw\n# comment\nfit\nENDMODEL\n")
+    otherSource = writeModels(tmp_path, "MODEL a\nload TBabs*powerlaw\nfit\nENDMODEL\n", "other_models.txt")
+
+    assert compilePipeline(source, "a")[0].signature() == compilePipeline(otherSource, "a")[0].signature()
+
+def test_unknown_model():
+    pipeline, errors, undefinedLines = compilePipeline(modelsFile, "model_does_not_exist")
+
+    assert pipeline is None
+    assert len(errors) == 1
+    assert "model_does_not_exist" in errors[0]
+
+def test_missing_endmodel(tmp_path):
+    source = writeModels(tmp_path, "MODEL a\nload TBabs*powerlaw\nfit\nMODEL b\nfit\nENDMODEL\n")
+    pipeline, errors, undefinedLines = compilePipeline(source, "a")
+
+    assert pipeline is None
+    assert any("ENDMODEL" in error for error in errors)
+
+def test_if_without_endif(tmp_path):
+    source = writeModels(tmp_path, "MODEL a\nload TBabs*powerlaw\nif powerlaw.PhoIndex > 3\nfit\nENDMODEL\n")
+    pipeline, errors, undefinedLines = compilePipeline(source, "a")
+
+    assert pipeline is None
+    assert errors == ["Line 3: 'if' statement without a matching 'endif'"]
+
+def test_endif_without_if(tmp_path):
+    source = writeModels(tmp_path, "MODEL a\nload TBabs*powerlaw\nfit\nendif\nENDMODEL\n")
+    pipeline, errors, undefinedLines = compilePipeline(source, "a")
+
+    assert pipeline is None
+    assert errors == ["Line 4: 'endif' without a matching 'if' statement"]
+
+def test_nested_if_jumps(tmp_path):
+    source = writeModels(tmp_path, "\n".join(["MODEL a",
+                                              "load TBabs*powerlaw",       # 0
+                                              "if model powerlaw exists",  # 1
+                                              "if powerlaw.norm <= 0.5",   # 2
+                                              "assign powerlaw.norm:1",    # 3
+                                              "endif",
+                                              "fit",                       # 4
+                                              "endif",
+                                              "save model",                # 5
+                                              "ENDMODEL"]))
+    pipeline, errors, undefinedLines = compilePipeline(source, "a")
+
+    assert errors == []
+    assert pipeline.commands[1].checkModel == True
+    assert pipeline.commands[1].target == "powerlaw"
+    assert pipeline.commands[1].condition == "exists"
+    assert pipeline.commands[1].jump == 5
+    assert pipeline.commands[2].jump == 4
+    assert pipeline.commands[2].condition == ("<=", 0.5)
+
+def test_undefined_command_is_reported_separately(tmp_path):
+    source = writeModels(tmp_path, "MODEL a\nload TBabs*powerlaw\nrenormalize now\nfit\nENDMODEL\n")
+    pipeline, errors, undefinedLines = compilePipeline(source, "a")
+
+    assert errors == []
+    assert undefinedLines == [(3, "renormalize now")]
+    assert commandTypes(pipeline) == [LoadCommand, FitCommand]
+
+def test_syntax_errors_point_to_their_lines(tmp_path):
+    source = writeModels(tmp_path, "MODEL a\nload TBabs*powerlaw\nsave everything\nif powerlaw.PhoIndex ~ 2\nfit extra\nendif\nENDMODEL\n")
+    pipeline, errors, undefinedLines = compilePipeline(source, "a")
+
+    assert pipeline is None
+    # The 'if' on line 4 is not compiled, so its 'endif' on line 6 is reported as well
+    assert [error.split(":")[0] for error in errors] == ["Line 3", "Line 4", "Line 5", "Line 6"]
+
+def test_operator_mapping_is_used_for_conditions():
+    pipeline, errors, undefinedLines = compilePipeline(modelsFile, "model_2")
+    ifCommand = [command for command in pipeline.commands if isinstance(command, IfCommand)][0]
+
+    assert operator_mapping[ifCommand.condition[0]] is operator.gt
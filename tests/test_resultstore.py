@@ -0,0 +1,79 @@
+# Tests of the fit statistics recorded by resultstore.py
+# Authors: Batuhan Bahçeci
+# Contact: batuhan.bahceci@sabanciuniv.edu
+
+import sqlite3
+from registry import openRegistry, registerObservations, registryFileName
+from resultstore import recordFitResults, recordFluxResults, hasFitResults, importParameterFiles, parameterFileLines, readLatestResults
+
+def observationPath(tmp_path, obsid, mode=""):
+    path = tmp_path / "observations" / obsid
+    if mode != "":
+        path = path / mode
+    path.mkdir(parents=True, exist_ok=True)
+    return str(path)
+
+def test_flux_rows_carry_the_fit_statistic_without_parameters(tmp_path):
+    registry = openRegistry(str(tmp_path))
+    path = observationPath(tmp_path, "1000000001")
+    resultsDir = path + "/results/model_2_0"
+    recordFitResults(registry, resultsDir, path, "1000000001", 59000.5, 120.0, 100, [])
+    recordFluxResults(registry, resultsDir, path, "1000000001", [("powerlaw flux", "", 1.5, 1.4, 1.6)])
+
+    columns = readLatestResults(registry, [("1000000001", "")], "model_2")
+    registry.close()
+
+    assert list(columns["kind"]) == ["flux"]
+    assert list(columns["mjd"]) == [59000.5]
+    assert list(columns["chi"]) == [120.0]
+    assert list(columns["dof"]) == [100]
+
+def test_new_fit_replaces_the_statistic_and_rows(tmp_path):
+    registry = openRegistry(str(tmp_path))
+    path = observationPath(tmp_path, "1000000001")
+    resultsDir = path + "/results/model_2_0"
+    recordFitResults(registry, resultsDir, path, "1000000001", 59000.5, 300.0, 100, [("PhoIndex", "", 2.0, 1.9, 2.1)])
+    recordFitResults(registry, resultsDir, path, "1000000001", 59000.5, 120.0, 100, [])
+
+    assert registry.execute("SELECT chi, dof FROM fits WHERE results_dir = ?", (resultsDir,)).fetchall() == [(120.0, 100)]
+    assert registry.execute("SELECT COUNT(*) FROM results WHERE results_dir = ?", (resultsDir,)).fetchone()[0] == 0
+    registry.close()
+
+def test_mjd_is_taken_from_the_observation_registry(tmp_path):
+    registry = openRegistry(str(tmp_path))
+    path = observationPath(tmp_path, "1000000001")
+    registerObservations(registry, [("1000000001", "", path, 1000.0, 59010.25)])
+    recordFitResults(registry, path + "/results/model_2_0", path, "1000000001", None, 120.0, 100, [])
+
+    assert registry.execute("SELECT mjd, chi, dof FROM fits").fetchall() == [(59010.25, 120.0, 100)]
+    registry.close()
+
+def test_parameter_file_is_not_imported_over_a_recorded_fit(tmp_path):
+    # A parameters_bestmodel.txt left by an older fit must not be imported for a newer fit without parameters
+    registry = openRegistry(str(tmp_path))
+    path = observationPath(tmp_path, "1000000001")
+    with open(path + "/parameters_bestmodel.txt", "w") as file:
+        file.writelines(parameterFileLines([("PhoIndex", "", 2.0, 1.9, 2.1)]))
+    recordFitResults(registry, path + "/results/model_2_0", path, "1000000001", 59000.5, 120.0, 100, [])
+
+    assert importParameterFiles(registry, [(path, "1000000001")], "model_2") == 0
+    assert importParameterFiles(registry, [(path, "1000000001")], "model_1") == 1
+    registry.close()
+
+def test_fits_table_is_filled_from_older_registries(tmp_path):
+    # Registries created before the fits table existed only have the statistic on the parameter rows
+    commonDirectory = str(tmp_path)
+    connection = sqlite3.connect(commonDirectory + "/" + registryFileName)
+    connection.execute("""CREATE TABLE results (results_dir TEXT NOT NULL, obsid TEXT NOT NULL, mode TEXT NOT NULL, mjd REAL, model TEXT NOT NULL,
+                          version INTEGER NOT NULL, kind TEXT NOT NULL, name TEXT NOT NULL, unit TEXT, value REAL, err_low REAL, err_high REAL,
+                          chi REAL, dof INTEGER, recorded REAL, PRIMARY KEY (results_dir, kind, name))""")
+    connection.executemany("INSERT INTO results VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                           [("obs/results/model_2_0", "1000000001", "", 59000.5, "model_2", 0, "parameter", name, "", 1.0, 0.1, 0.1, 120.0, 100, 1.0)
+                            for name in ["PhoIndex", "norm"]])
+    connection.commit()
+    connection.close()
+
+    registry = openRegistry(commonDirectory)
+    assert registry.execute("SELECT results_dir, obsid, mode, mjd, model, version, chi, dof FROM fits").fetchall() == \
+           [("obs/results/model_2_0", "1000000001", "", 59000.5, "model_2", 0, 120.0, 100)]
+    registry.close()
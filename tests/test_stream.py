@@ -0,0 +1,46 @@
+# Tests of reduced_chi.log written by stream.py from the fits table of the registry
+# Authors: Batuhan Bahçeci
+# Contact: batuhan.bahceci@sabanciuniv.edu
+
+from registry import openRegistry
+from resultstore import recordFitResults, hasFitResults
+from stream import writeReducedChi
+
+def observationPath(tmp_path, obsid, mode=""):
+    path = tmp_path / "observations" / obsid
+    if mode != "":
+        path = path / mode
+    path.mkdir(parents=True, exist_ok=True)
+    return str(path)
+
+def readReducedChi(commonDirectory):
+    with open(commonDirectory + "/reduced_chi.log", "r") as file:
+        return file.readlines()
+
+def test_reduced_chi_of_fits_without_parameters(tmp_path):
+    # errorCalculations=False: the fits have no parameter rows, only their statistic
+    commonDirectory = str(tmp_path)
+    registry = openRegistry(commonDirectory)
+    firstPath = observationPath(tmp_path, "1000000001")
+    secondPath = observationPath(tmp_path, "1000000002", "night")
+    recordFitResults(registry, firstPath + "/results/model_2_0", firstPath, "1000000001", 59000.5, 120.0, 100, [])
+    recordFitResults(registry, secondPath + "/results/model_2_0", secondPath, "1000000002", 59001.5, 90.0, 60, [])
+
+    assert hasFitResults(registry, firstPath + "/results/model_2_0")
+    assert registry.execute("SELECT COUNT(*) FROM results").fetchone()[0] == 0
+    registry.close()
+
+    assert writeReducedChi(commonDirectory, ["1000000001", "1000000002", "1000000003"], "custom_name", "model_2") != False
+    assert readReducedChi(commonDirectory) == ["custom_name\n", "59000.5 1.2\n", "59001.5 1.5\n"]
+
+def test_reduced_chi_uses_the_latest_fit(tmp_path):
+    commonDirectory = str(tmp_path)
+    registry = openRegistry(commonDirectory)
+    path = observationPath(tmp_path, "1000000001")
+    recordFitResults(registry, path + "/results/model_2_0", path, "1000000001", 59000.5, 300.0, 100, [("PhoIndex", "", 2.0, 1.9, 2.1)])
+    recordFitResults(registry, path + "/results/model_2_1", path, "1000000001", 59000.5, 110.0, 100, [])
+    recordFitResults(registry, path + "/results/model_1_0", path, "1000000001", 59000.5, 500.0, 100, [])
+    registry.close()
+
+    writeReducedChi(commonDirectory, ["1000000001"], "model_2", "model_2")
+    assert readReducedChi(commonDirectory) == ["model_2\n", "59000.5 1.1\n"]
@@ -0,0 +1,42 @@
+# This is a helper module for running independent tasks of the NICER scripts in parallel worker processes
+# Authors: Batuhan Bahçeci
+# Contact: batuhan.bahceci@sabanciuniv.edu
+
+import os
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+
+def availableCores():
+    # Number of cores this process is allowed to run on
+    try:
+        return len(os.sched_getaffinity(0))
+    except AttributeError:
+        return os.cpu_count() or 1
+
+def resolveWorkerCount(workerCount):
+    # A worker count of 0 (or below) means "use all available cores"
+    try:
+        workerCount = int(workerCount)
+    except Exception:
+        print(f"Invalid worker count '{workerCount}', tasks will be run serially.")
+        return 1
+
+    if workerCount <= 0:
+        workerCount = availableCores()
+
+    return workerCount
+
+def runInParallel(function, taskList, workerCount):
+    # Runs function(task) for each task in taskList and returns the results in the same order as taskList.
+    # Tasks are dispatched to 'workerCount' forked processes. The scripts are written as top-level code, so the
+    # 'fork' start method is used to make sure the workers inherit the already validated variables instead of
+    # re-executing the calling script. If there is only one worker or one task, everything runs in this process.
+    taskList = list(taskList)
+    workerCount = min(resolveWorkerCount(workerCount), len(taskList))
+
+    if workerCount <= 1:
+        return [function(task) for task in taskList]
+
+    context = multiprocessing.get_context("fork")
+    with ProcessPoolExecutor(max_workers=workerCount, mp_context=context) as executor:
+        return list(executor.map(function, taskList))